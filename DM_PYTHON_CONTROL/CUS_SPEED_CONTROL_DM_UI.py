@@ -12,6 +12,7 @@ try:
 except ImportError:
     messagebox.showerror("错误", "DM_CAN.py 未找到或无法导入。\n请确保它和脚本在同一目录。")
     exit()
+from DM_Plot import MotorPlotPanel
 
 
 # --- 电机和串口配置 ---
@@ -26,11 +27,15 @@ MOTOR_TYPE = DM_Motor_Type.DM4310 # 根据DM_CAN.py, DM4310是类型0
 SLIDER_MAX_RPM = 250
 SLIDER_MIN_RPM = -250
 
+# 反馈曲线配置: 使能后按此周期刷新电机状态并记录到曲线
+FEEDBACK_POLL_MS = 10
+PLOT_SPAN_S = 10.0
+
 class MotorControlApp:
     def __init__(self, root):
         self.root = root
         self.root.title("达妙电机调速器 (DM_CAN)")
-        self.root.geometry("450x350") # 调整窗口大小
+        self.root.geometry("600x600") # 调整窗口大小
 
         self.motor = None
         self.motor_controller = None
@@ -38,6 +43,7 @@ class MotorControlApp:
         self.is_motor_setup_successful = False
         self.is_motor_enabled = False
         self.current_target_rpm = 0.0
+        self.poll_id = None
 
         # --- 初始化电机和串口 ---
         if not self.setup_motor_communication():
@@ -68,6 +74,11 @@ class MotorControlApp:
         if not self.is_motor_setup_successful or not self.is_motor_enabled:
              self.speed_scale.config(state=tk.DISABLED)
 
+        # 目标/反馈转速曲线
+        self.plot_panel = MotorPlotPanel(root, ["目标 RPM", "反馈 RPM"], span=PLOT_SPAN_S, height=180)
+        self.plot_panel.pack(padx=10, pady=5, fill="both", expand=True)
+        self.plot_panel.start()
+
 
         # 停止按钮（发送0速度）
         self.stop_button = tk.Button(root, text="发送0转速 (Stop)", command=self.send_zero_speed, width=15, height=2, font=("Arial", 10))
@@ -151,6 +162,7 @@ class MotorControlApp:
                 self.on_speed_scale_change(0) # 更新显示
                 self.speed_scale.config(state=tk.DISABLED)
                 self.stop_button.config(state=tk.DISABLED)
+                self.stop_feedback_poll()
                 print("电机已失能。")
             except Exception as e:
                 messagebox.showerror("错误", f"失能电机时出错: {e}")
@@ -168,6 +180,7 @@ class MotorControlApp:
                 self.update_status_label("状态: 电机已使能, 速度: 0 RPM", "green")
                 self.speed_scale.config(state=tk.NORMAL)
                 self.stop_button.config(state=tk.NORMAL)
+                self.start_feedback_poll()
                 print("电机已使能。")
             except Exception as e:
                 messagebox.showerror("错误", f"使能电机时出错: {e}")
@@ -202,6 +215,25 @@ class MotorControlApp:
             self.update_status_label(f"错误: 速度设置失败 - {e}", "red")
 
 
+    def start_feedback_poll(self):
+        if self.poll_id is None:
+            self.poll_id = self.root.after(FEEDBACK_POLL_MS, self.poll_feedback)
+
+    def stop_feedback_poll(self):
+        if self.poll_id is not None:
+            self.root.after_cancel(self.poll_id)
+            self.poll_id = None
+
+    def poll_feedback(self):
+        self.poll_id = self.root.after(FEEDBACK_POLL_MS, self.poll_feedback)
+        try:
+            self.motor_controller.refresh_motor_status(self.motor)
+            feedback_rpm = float(self.motor.getVelocity()) * 60.0 / (2 * math.pi)
+            self.plot_panel.push((self.current_target_rpm, feedback_rpm))
+        except Exception as e:
+            print(f"刷新电机状态出错: {e}")
+
+
     def send_zero_speed(self):
         if not self.is_motor_setup_successful:
             messagebox.showwarning("警告", "电机通信未成功初始化。")
@@ -217,6 +249,8 @@ class MotorControlApp:
 
     def quit_application(self):
         print("正在退出应用程序...")
+        self.stop_feedback_poll()
+        self.plot_panel.stop()
         if self.is_motor_setup_successful and self.motor_controller and self.motor:
             if self.is_motor_enabled:
                 try:
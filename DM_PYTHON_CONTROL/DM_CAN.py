@@ -1,8 +1,9 @@
-from time import sleep
+import time
+from time import sleep, monotonic
 import numpy as np
-from enum import IntEnum
 from struct import unpack
 from struct import pack
+from DM_Codec import DM_Motor_Type, DM_variable, Control_Type, DM_Motor_State, LIMIT_PARAM, is_in_ranges, RX_STALE
 
 
 class Motor:
@@ -22,13 +23,19 @@ class Motor:
         self.MasterID = MasterID
         self.MotorType = MotorType
         self.isEnable = False
+        self.status = DM_Motor_State.DISABLED  # state/error code of the last feedback 最近一次反馈的状态码
+        self.temp_mos = 0  # MOS temperature of the last feedback 最近一次反馈的MOS温度 ℃
+        self.temp_rotor = 0  # rotor temperature of the last feedback 最近一次反馈的线圈温度 ℃
+        self.recv_time = 0.0  # time of the last feedback 最近一次反馈的时间戳 time.time()
+        self.missed_replies = 0  # commands whose feedback did not arrive within the reply timeout 超时未收到反馈的次数
         self.NowControlMode = Control_Type.MIT
         self.temp_param_dict = {}
 
-    def recv_data(self, q: float, dq: float, tau: float):
+    def recv_data(self, q: float, dq: float, tau: float, t: float = None):
         self.state_q = q
         self.state_dq = dq
         self.state_tau = tau
+        self.recv_time = time.time() if t is None else t
 
     def getPosition(self):
         """
@@ -67,25 +74,35 @@ class MotorControl:
     send_data_frame = np.array(
         [0x55, 0xAA, 0x1e, 0x03, 0x01, 0x00, 0x00, 0x00, 0x0a, 0x00, 0x00, 0x00, 0x00, 0, 0, 0, 0, 0x00, 0x08, 0x00,
          0x00, 0, 0, 0, 0, 0, 0, 0, 0, 0x00], np.uint8)
-    #                4310           4310_48        4340           4340_48
-    Limit_Param = [[12.5, 30, 10], [12.5, 50, 10], [12.5, 8, 28], [12.5, 10, 28],
-                   # 6006           8006           8009            10010L         10010
-                   [12.5, 45, 20], [12.5, 45, 40], [12.5, 45, 54], [12.5, 25, 200], [12.5, 20, 200],
-                   # H3510            DMG6215      DMH6220
-                   [12.5 , 280 , 1],[12.5 , 45 , 10],[12.5 , 45 , 10]]
+    Limit_Param = [list(row) for row in LIMIT_PARAM]  # PMAX VMAX TMAX of every DM_Motor_Type 每种电机的限幅
 
     def __init__(self, serial_device):
         """
         define MotorControl object 定义电机控制对象
-        :param serial_device: serial object 串口对象
+        :param serial_device: serial object, or a transport object with send_frames/recv_frames
+        串口对象，或者实现了send_frames/recv_frames的传输层对象(例如DM_Transport.SocketCANTransport)
         """
         self.serial_ = serial_device
+        if hasattr(serial_device, "recv_frames"):
+            self.transport = serial_device
+        else:
+            self.transport = SerialTransport(serial_device)
         self.motors_map = dict()
-        self.data_save = bytes()  # save data
-        if self.serial_.is_open:  # open the serial port
-            print("Serial port is open")
-            serial_device.close()
-        self.serial_.open()
+        self.reply_timeout = 0.0  # how long control calls wait for the feedback 控制函数等待反馈的最长时间 单位秒
+        self.pending = dict()  # SlaveID -> Motor sent a command and not replied yet 已发送指令还没有回复的电机
+        self.missed = []  # motors that missed the last wait_replies 上次等待中没有回复的电机
+        # (SlaveID, RID) of register reads/writes not replied yet, only these replies are told apart from feedback
+        # 已发送还没有回复的寄存器读写 只有这些回复才会与反馈帧区分开
+        self.param_pending = set()
+        self.lut_map = dict()  # MotorType -> feedback lookup tables 反馈查找表
+        self.frame_listeners = []  # called as listener(CANID, CMD, data) for every received frame 每收到一帧都会调用
+        self.decode_listeners = []  # called as listener() after each block of feedback is decoded 每解析完一批反馈都会调用
+        self.frames_sent = 0  # counters, read them from any thread 计数器 可以在其他线程读取
+        self.frames_received = 0
+        self.decode_errors = 0  # feedback frames that match no motor 找不到对应电机的反馈帧
+        self.estop = False  # set by emergency_stop, blocks every send until clear_estop 急停后禁止发送直到clear_estop
+        self.limiter = None  # e.g. DM_Safety.CommandLimiter, limits every setpoint before sending 发送前限制所有期望值
+        self.transport.open()
 
     def controlMIT(self, DM_Motor, kp: float, kd: float, q: float, dq: float, tau: float):
         """
@@ -101,6 +118,8 @@ class MotorControl:
         if DM_Motor.SlaveID not in self.motors_map:
             print("controlMIT ERROR : Motor ID not found")
             return
+        if self.limiter is not None:
+            q, dq, tau = (float(x[0]) for x in self.limiter.apply([DM_Motor], q, dq, tau))
         kp_uint = float_to_uint(kp, 0, 500, 12)
         kd_uint = float_to_uint(kd, 0, 5, 12)
         MotorType = DM_Motor.MotorType
@@ -119,8 +138,9 @@ class MotorControl:
         data_buf[5] = kd_uint >> 4
         data_buf[6] = ((kd_uint & 0xf) << 4) | ((tau_uint >> 8) & 0xf)
         data_buf[7] = tau_uint & 0xff
+        self.__expect([DM_Motor])
         self.__send_data(DM_Motor.SlaveID, data_buf)
-        self.recv()  # receive the data from serial port
+        self.__collect()  # receive the data from serial port
 
     def control_delay(self, DM_Motor, kp: float, kd: float, q: float, dq: float, tau: float, delay: float):
         """
@@ -147,15 +167,19 @@ class MotorControl:
         if Motor.SlaveID not in self.motors_map:
             print("Control Pos_Vel Error : Motor ID not found")
             return
+        if self.limiter is not None:
+            P_desired, V_desired, _ = (x if x is None else float(x[0]) for x in
+                                       self.limiter.apply([Motor], P_desired, V_desired))
         motorid = 0x100 + Motor.SlaveID
         data_buf = np.array([0x00, 0x00, 0x00, 0x00, 0x00, 0x00, 0x00, 0x00], np.uint8)
         P_desired_uint8s = float_to_uint8s(P_desired)
         V_desired_uint8s = float_to_uint8s(V_desired)
         data_buf[0:4] = P_desired_uint8s
         data_buf[4:8] = V_desired_uint8s
+        self.__expect([Motor])
         self.__send_data(motorid, data_buf)
         # time.sleep(0.001)
-        self.recv()  # receive the data from serial port
+        self.__collect()  # receive the data from serial port
 
     def control_Vel(self, Motor, Vel_desired):
         """
@@ -166,12 +190,15 @@ class MotorControl:
         if Motor.SlaveID not in self.motors_map:
             print("control_VEL ERROR : Motor ID not found")
             return
+        if self.limiter is not None:
+            Vel_desired = float(self.limiter.apply([Motor], dq=Vel_desired)[1][0])
         motorid = 0x200 + Motor.SlaveID
         data_buf = np.array([0x00, 0x00, 0x00, 0x00, 0x00, 0x00, 0x00, 0x00], np.uint8)
         Vel_desired_uint8s = float_to_uint8s(Vel_desired)
         data_buf[0:4] = Vel_desired_uint8s
+        self.__expect([Motor])
         self.__send_data(motorid, data_buf)
-        self.recv()  # receive the data from serial port
+        self.__collect()  # receive the data from serial port
 
     def control_pos_force(self, Motor, Pos_des: float, Vel_des, i_des):
         """
@@ -194,8 +221,67 @@ class MotorControl:
         data_buf[5] = Vel_uint >> 8
         data_buf[6] = ides_uint & 0xff
         data_buf[7] = ides_uint >> 8
+        self.__expect([Motor])
         self.__send_data(motorid, data_buf)
-        self.recv()  # receive the data from serial port
+        self.__collect()  # receive the data from serial port
+
+    def controlMIT_batch(self, Motors, kp, kd, q, dq, tau, timeout=None):
+        """
+        MIT control of several motors in one serial write 批量MIT控制，所有电机的控制帧一次发送
+        :param Motors: list of Motor objects 电机对象列表
+        :param kp: kp, scalar or one per motor 标量或每个电机一个
+        :param kd: kd, scalar or one per motor
+        :param q: position 期望位置 每个电机一个
+        :param dq: velocity 期望速度 每个电机一个
+        :param tau: torque 期望力矩 每个电机一个
+        :param timeout: wait for the replies, default reply_timeout 等待反馈的时间 默认reply_timeout
+        :return: list of Motor objects that missed the reply 没有按时回复的电机
+        """
+        if self.limiter is not None:
+            q, dq, tau = self.limiter.apply(Motors, q, dq, tau)
+        data = pack_mit(kp, kd, q, dq, tau, self.limit_array(Motors))
+        self.__expect(Motors, timeout)
+        self.send_batch([Motor.SlaveID for Motor in Motors], data)
+        return self.__collect(timeout)  # receive the data from serial port
+
+    def control_Pos_Vel_batch(self, Motors, P_desired, V_desired, timeout=None):
+        """
+        position and velocity control of several motors in one serial write 批量位置速度控制
+        :param Motors: list of Motor objects 电机对象列表
+        :param P_desired: desired position 期望位置 每个电机一个
+        :param V_desired: desired velocity 期望速度 标量或每个电机一个
+        :param timeout: wait for the replies, default reply_timeout 等待反馈的时间 默认reply_timeout
+        :return: list of Motor objects that missed the reply 没有按时回复的电机
+        """
+        if self.limiter is not None:
+            P_desired, V_desired, _ = self.limiter.apply(Motors, P_desired, V_desired)
+        data = pack_pos_vel(P_desired, V_desired, len(Motors))
+        self.__expect(Motors, timeout)
+        self.send_batch([0x100 + Motor.SlaveID for Motor in Motors], data)
+        return self.__collect(timeout)  # receive the data from serial port
+
+    def control_Vel_batch(self, Motors, Vel_desired, timeout=None):
+        """
+        velocity control of several motors in one serial write 批量速度控制
+        :param Motors: list of Motor objects 电机对象列表
+        :param Vel_desired: desired velocity 期望速度 每个电机一个
+        :param timeout: wait for the replies, default reply_timeout 等待反馈的时间 默认reply_timeout
+        :return: list of Motor objects that missed the reply 没有按时回复的电机
+        """
+        if self.limiter is not None:
+            Vel_desired = self.limiter.apply(Motors, dq=Vel_desired)[1]
+        data = pack_vel(Vel_desired, len(Motors))
+        self.__expect(Motors, timeout)
+        self.send_batch([0x200 + Motor.SlaveID for Motor in Motors], data)
+        return self.__collect(timeout)  # receive the data from serial port
+
+    def limit_array(self, Motors):
+        """
+        PMAX VMAX TMAX of several motors 多个电机的PMAX VMAX TMAX
+        :param Motors: list of Motor objects 电机对象列表
+        :return: float array shape (n, 3)
+        """
+        return np.array([self.Limit_Param[Motor.MotorType] for Motor in Motors], np.float64).reshape(-1, 3)
 
     def enable(self, Motor):
         """
@@ -237,55 +323,198 @@ class MotorControl:
         sleep(0.1)
         self.recv()  # receive the data from serial port
 
+    def clear_error(self, Motor):
+        """
+        clear the error of the motor, e.g. over temperature or lost communication 清除电机错误 例如过温、通讯丢失
+        the motor stays disabled until enabled 清除后电机处于失能状态 需要重新使能
+        :param Motor: Motor object 电机对象
+        """
+        self.__control_cmd(Motor, np.uint8(0xFB))
+        sleep(0.01)
+        self.recv()  # receive the data from serial port
+
+    def clear_error_batch(self, Motors, timeout=0.1):
+        """
+        clear the error of several motors with one serial write 一次串口写入清除多个电机的错误
+        :param Motors: list of Motor objects 电机对象列表
+        :param timeout: longest wait for the replies 等待回复的最长时间 单位秒
+        :return: list of Motor objects that did not reply or still report an error 没有回复或仍然报错的电机
+        """
+        self.__control_cmd_batch(Motors, 0xFB, timeout)
+        return [Motor for Motor in Motors if Motor in self.missed or Motor.status >= DM_Motor_State.OVER_VOLTAGE]
+
+    def enable_batch(self, Motors, timeout=0.1):
+        """
+        enable several motors with one serial write 一次串口写入使能多个电机
+        :param Motors: list of Motor objects 电机对象列表
+        :param timeout: longest wait for the replies 等待回复的最长时间 单位秒
+        :return: list of Motor objects that did not reply enabled 没有回复使能状态的电机
+        """
+        self.__control_cmd_batch(Motors, 0xFC, timeout)
+        return [Motor for Motor in Motors if Motor in self.missed or Motor.status != DM_Motor_State.ENABLED]
+
+    def disable_batch(self, Motors, timeout=0.1):
+        """
+        disable several motors with one serial write 一次串口写入失能多个电机
+        :param Motors: list of Motor objects 电机对象列表
+        :param timeout: longest wait for the replies 等待回复的最长时间 单位秒
+        :return: list of Motor objects that did not reply disabled 没有回复失能状态的电机
+        """
+        self.__control_cmd_batch(Motors, 0xFD, timeout)
+        return [Motor for Motor in Motors if Motor in self.missed or Motor.status != DM_Motor_State.DISABLED]
+
+    def set_zero_position_batch(self, Motors, timeout=0.1):
+        """
+        set the zero position of several motors with one serial write 一次串口写入设置多个电机的0位
+        :param Motors: list of Motor objects 电机对象列表
+        :param timeout: longest wait for the replies 等待回复的最长时间 单位秒
+        :return: list of Motor objects that did not reply 没有回复的电机
+        """
+        return self.__control_cmd_batch(Motors, 0xFE, timeout)
+
+    def __control_cmd_batch(self, Motors, cmd, timeout):
+        self.recv()  # old feedback must not confirm the new command 先读掉旧的反馈
+        data = np.full((len(Motors), 8), 0xff, np.uint8)
+        data[:, 7] = cmd
+        self.__expect(Motors, timeout)
+        self.send_batch([Motor.SlaveID for Motor in Motors], data)
+        return self.wait_replies(timeout)
+
+    def emergency_stop(self, Motors=None, timeout=0.02, retries=2):
+        """
+        disable every motor right now 急停 立即失能所有电机
+        commands still queued in the output buffer are dropped, then all disable frames go out in one write, and
+        every later send is blocked until clear_estop 先丢弃输出缓冲区中还没有发出的指令，再一次写入所有失能帧，之后禁止发送直到clear_estop
+        :param Motors: list of Motor objects, default every added motor 电机对象列表 默认所有已添加的电机
+        :param timeout: wait for the replies of each attempt 每次发送后等待回复的时间 单位秒
+        :param retries: resend to motors that did not reply disabled 对没有回复失能状态的电机重发的次数
+        :return: list of Motor objects that did not reply disabled 没有回复失能状态的电机
+        """
+        self.estop = True
+        if Motors is None:
+            Motors = list({id(Motor): Motor for Motor in self.motors_map.values()}.values())
+        if hasattr(self.transport, "flush_output"):
+            self.transport.flush_output()
+        self.pending.clear()
+        data = np.full((len(Motors), 8), 0xff, np.uint8)
+        data[:, 7] = 0xFD
+        left = list(Motors)
+        for _ in range(retries + 1):
+            if not left:
+                break
+            self.__expect(left, timeout)
+            self.transport.send_frames([Motor.SlaveID for Motor in left], data[:len(left)])
+            self.frames_sent += len(left)
+            self.wait_replies(timeout)
+            left = [Motor for Motor in left if Motor in self.missed or Motor.status != DM_Motor_State.DISABLED]
+        return left
+
+    def clear_estop(self):
+        """
+        allow sending again after emergency_stop, the motors stay disabled until enabled 解除急停 电机需要重新使能
+        """
+        self.estop = False
+
     def recv(self):
-        # 把上次没有解析完的剩下的也放进来
-        data_recv = b''.join([self.data_save, self.serial_.read_all()])
-        packets = self.__extract_packets(data_recv)
-        for packet in packets:
-            data = packet[7:15]
-            CANID = (packet[6] << 24) | (packet[5] << 16) | (packet[4] << 8) | packet[3]
-            CMD = packet[1]
-            self.__process_packet(data, CANID, CMD)
+        self.__decode(self.transport.recv_frames())
+
+    def __decode(self, frames):
+        self.frames_received += len(frames)
+        for CANID, CMD, data, t in frames:
+            self.__process_packet(data, CANID, CMD, t)
+            for listener in self.frame_listeners:
+                listener(CANID, CMD, data)
+        if frames:
+            for listener in self.decode_listeners:
+                listener()
+
+    def __expect(self, Motors, timeout=None):
+        # a call that waits for its own replies does not wait for the motors of earlier calls sent with timeout 0
+        # 自己等待回复的调用不再等待之前不等待回复的调用中的电机
+        if (self.reply_timeout if timeout is None else timeout) > 0:
+            self.pending.clear()
+        for Motor in Motors:
+            self.pending[Motor.SlaveID] = Motor
+
+    def __collect(self, timeout=None):
+        # 解析已收到的反馈，需要时等待还没有回复的电机
+        self.recv()
+        if timeout is None:
+            timeout = self.reply_timeout
+        if timeout > 0:
+            return self.wait_replies(timeout)
+        return []
+
+    def wait_replies(self, timeout):
+        """
+        wait until every motor that was sent a command has replied 等待所有已发送指令的电机回复
+        :param timeout: longest wait 最长等待时间 单位秒
+        :return: list of Motor objects that did not reply in time 超时没有回复的电机
+        """
+        deadline = monotonic() + timeout
+        while self.pending:
+            remaining = deadline - monotonic()
+            if remaining <= 0:
+                break
+            self.__decode(self.transport.recv_frames(len(self.pending), remaining))
+        missed = list(self.pending.values())
+        for Motor in missed:
+            Motor.missed_replies += 1
+        self.pending.clear()
+        self.missed = missed
+        return missed
 
     def recv_set_param_data(self):
-        data_recv = self.serial_.read_all()
-        packets = self.__extract_packets(data_recv)
-        for packet in packets:
-            data = packet[7:15]
-            CANID = (packet[6] << 24) | (packet[5] << 16) | (packet[4] << 8) | packet[3]
-            CMD = packet[1]
+        frames = self.transport.recv_frames()
+        self.frames_received += len(frames)
+        for CANID, CMD, data, t in frames:
             self.__process_set_param_packet(data, CANID, CMD)
-
-    def __process_packet(self, data, CANID, CMD):
-        if CMD == 0x11:
+            for listener in self.frame_listeners:
+                listener(CANID, CMD, data)
+
+    def __process_packet(self, data, CANID, CMD, t):
+        if CMD == 0x11 or CMD == RX_STALE:
+            if (data[2] == 0x33 or data[2] == 0x55) and self.param_pending:
+                # a register reply carries the SlaveID in data[0:2] and the RID in data[3], a feedback frame with
+                # status 0 and q near -PMAX looks the same, so only replies to an outstanding read/write count
+                # 寄存器回复的data[0:2]是SlaveID data[3]是RID 状态为0且q接近-PMAX的反馈帧看起来一样
+                # 所以只有正在等待的读写才算寄存器回复
+                slaveId = (data[1] << 8) | data[0]
+                Motor = self.motors_map.get(CANID if CANID != 0x00 else slaveId)
+                if Motor is not None and (slaveId, data[3]) in self.param_pending and Motor.SlaveID == slaveId:
+                    self.__process_set_param_packet(data, CANID, 0x11)
+                    return
             if CANID != 0x00:
-                if CANID in self.motors_map:
-                    q_uint = np.uint16((np.uint16(data[1]) << 8) | data[2])
-                    dq_uint = np.uint16((np.uint16(data[3]) << 4) | (data[4] >> 4))
-                    tau_uint = np.uint16(((data[4] & 0xf) << 8) | data[5])
-                    MotorType_recv = self.motors_map[CANID].MotorType
-                    Q_MAX = self.Limit_Param[MotorType_recv][0]
-                    DQ_MAX = self.Limit_Param[MotorType_recv][1]
-                    TAU_MAX = self.Limit_Param[MotorType_recv][2]
-                    recv_q = uint_to_float(q_uint, -Q_MAX, Q_MAX, 16)
-                    recv_dq = uint_to_float(dq_uint, -DQ_MAX, DQ_MAX, 12)
-                    recv_tau = uint_to_float(tau_uint, -TAU_MAX, TAU_MAX, 12)
-                    self.motors_map[CANID].recv_data(recv_q, recv_dq, recv_tau)
+                Motor = self.motors_map.get(CANID)
             else:
-                MasterID=data[0] & 0x0f
-                if MasterID in self.motors_map:
-                    q_uint = np.uint16((np.uint16(data[1]) << 8) | data[2])
-                    dq_uint = np.uint16((np.uint16(data[3]) << 4) | (data[4] >> 4))
-                    tau_uint = np.uint16(((data[4] & 0xf) << 8) | data[5])
-                    MotorType_recv = self.motors_map[MasterID].MotorType
-                    Q_MAX = self.Limit_Param[MotorType_recv][0]
-                    DQ_MAX = self.Limit_Param[MotorType_recv][1]
-                    TAU_MAX = self.Limit_Param[MotorType_recv][2]
-                    recv_q = uint_to_float(q_uint, -Q_MAX, Q_MAX, 16)
-                    recv_dq = uint_to_float(dq_uint, -DQ_MAX, DQ_MAX, 12)
-                    recv_tau = uint_to_float(tau_uint, -TAU_MAX, TAU_MAX, 12)
-                    self.motors_map[MasterID].recv_data(recv_q, recv_dq, recv_tau)
+                Motor = self.motors_map.get(data[0] & 0x0f)
+            if Motor is not None:
+                q_lut, dq_lut, tau_lut = self.feedback_lut(Motor.MotorType)
+                recv_q = q_lut[(data[1] << 8) | data[2]]
+                recv_dq = dq_lut[(data[3] << 4) | (data[4] >> 4)]
+                recv_tau = tau_lut[((data[4] & 0xf) << 8) | data[5]]
+                Motor.recv_data(recv_q, recv_dq, recv_tau, t)
+                Motor.status = data[0] >> 4
+                Motor.isEnable = Motor.status == DM_Motor_State.ENABLED
+                Motor.temp_mos = data[6]
+                Motor.temp_rotor = data[7]
+                if CMD == 0x11:
+                    self.pending.pop(Motor.SlaveID, None)
+            else:
+                self.decode_errors += 1
 
+    def feedback_lut(self, MotorType):
+        """
+        lookup tables of the feedback q/dq/tau of a motor type 电机类型对应的反馈q/dq/tau查找表
+        :param MotorType: Motor type 电机类型
+        :return: (q_lut, dq_lut, tau_lut) float32 arrays with 65536/4096/4096 entries
+        """
+        lut = self.lut_map.get(MotorType)
+        if lut is None:
+            Q_MAX, DQ_MAX, TAU_MAX = self.Limit_Param[MotorType]
+            lut = feedback_lut(Q_MAX, DQ_MAX, TAU_MAX)
+            self.lut_map[MotorType] = lut
+        return lut
 
     def __process_set_param_packet(self, data, CANID, CMD):
         if CMD == 0x11 and (data[2] == 0x33 or data[2] == 0x55):
@@ -301,6 +530,7 @@ class MotorControl:
                     masterid=slaveId
 
             RID = data[3]
+            self.param_pending.discard((self.motors_map[masterid].SlaveID, RID))
             # 读取参数得到的数据
             if is_in_ranges(RID):
                 #uint32类型
@@ -334,15 +564,86 @@ class MotorControl:
         :param data:
         :return:
         """
-        self.send_data_frame[13] = motor_id & 0xff
-        self.send_data_frame[14] = (motor_id >> 8)& 0xff  #id high 8 bits
-        self.send_data_frame[21:29] = data
-        self.serial_.write(bytes(self.send_data_frame.T))
+        if self.estop:
+            return
+        self.transport.send_frames((motor_id,), data)
+        self.frames_sent += 1
+
+    def send_batch(self, can_ids, data):
+        """
+        send several CAN frames in one serial write 一次串口写入发送多帧
+        :param can_ids: CAN ID of every frame 每一帧的CAN ID
+        :param data: frame data, shape (n, 8) 每一帧的数据
+        """
+        if len(can_ids) == 0 or self.estop:
+            return
+        self.transport.send_frames(can_ids, data)
+        self.frames_sent += len(can_ids)
+
+    def __wait_param(self, pairs, timeout):
+        # 等待所有(Motor, RID)的寄存器回复或者超时
+        deadline = monotonic() + timeout
+        while True:
+            self.recv_set_param_data()
+            if all(RID in Motor.temp_param_dict for Motor, RID in pairs) or monotonic() >= deadline:
+                return
+            sleep(0.002)
+
+    def read_motor_param_batch(self, Motors, RIDs, timeout=0.5):
+        """
+        read several registers of several motors at once 批量读取多个电机的多个寄存器
+        all requests go out in one write, replies are collected until all arrive or timeout
+        所有读取请求一次发出，然后等待全部回复或超时
+        :param Motors: list of Motor objects 电机对象列表
+        :param RIDs: list of DM_variable 电机参数列表
+        :param timeout: time to wait for the replies 等待回复的时间 单位秒
+        :return: {SlaveID: {RID: value}} 没有收到回复的参数不包含在内
+        """
+        RIDs = list(RIDs)
+        for Motor in Motors:
+            for RID in RIDs:
+                Motor.temp_param_dict.pop(RID, None)
+        can_ids = [0x7FF] * (len(Motors) * len(RIDs))
+        data = [param_data(Motor.SlaveID, 0x33, RID) for Motor in Motors for RID in RIDs]
+        self.param_pending.update((Motor.SlaveID, RID) for Motor in Motors for RID in RIDs)
+        self.send_batch(can_ids, data)
+        self.__wait_param([(Motor, RID) for Motor in Motors for RID in RIDs], timeout)
+        return {Motor.SlaveID: {RID: Motor.temp_param_dict[RID] for RID in RIDs if RID in Motor.temp_param_dict}
+                for Motor in Motors}
+
+    def change_motor_param_batch(self, writes, timeout=0.5):
+        """
+        write several registers of several motors at once 批量修改多个电机的寄存器
+        :param writes: list of (Motor, RID, value) 需要写入的参数
+        :param timeout: time to wait for the replies 等待回复的时间 单位秒
+        :return: {(SlaveID, RID): True or False} True means the motor echoed the new value
+        """
+        for Motor, RID, _ in writes:
+            Motor.temp_param_dict.pop(RID, None)
+        data = [param_data(Motor.SlaveID, 0x55, RID, value) for Motor, RID, value in writes]
+        self.param_pending.update((Motor.SlaveID, RID) for Motor, RID, _ in writes)
+        self.send_batch([0x7FF] * len(writes), data)
+        self.__wait_param([(Motor, RID) for Motor, RID, _ in writes], timeout)
+        return {(Motor.SlaveID, RID): RID in Motor.temp_param_dict and abs(Motor.temp_param_dict[RID] - value) < 0.1
+                for Motor, RID, value in writes}
+
+    def save_motor_param_batch(self, Motors):
+        """
+        save the parameters of several motors to flash at once 批量保存电机参数到flash
+        the motors are disabled first 保存前会先失能电机
+        :param Motors: list of Motor objects 电机对象列表
+        """
+        disable = np.array([0xff, 0xff, 0xff, 0xff, 0xff, 0xff, 0xff, 0xFD], np.uint8)
+        self.send_batch([Motor.SlaveID for Motor in Motors], [disable] * len(Motors))
+        sleep(0.01)
+        self.send_batch([0x7FF] * len(Motors), [param_data(Motor.SlaveID, 0xAA) for Motor in Motors])
+        sleep(0.001)
 
     def __read_RID_param(self, Motor, RID):
         can_id_l = Motor.SlaveID & 0xff #id low 8 bits
         can_id_h = (Motor.SlaveID >> 8)& 0xff  #id high 8 bits
         data_buf = np.array([np.uint8(can_id_l), np.uint8(can_id_h), 0x33, np.uint8(RID), 0x00, 0x00, 0x00, 0x00], np.uint8)
+        self.param_pending.add((Motor.SlaveID, int(RID)))
         self.__send_data(0x7FF, data_buf)
 
     def __write_motor_param(self, Motor, RID, data):
@@ -355,6 +656,7 @@ class MotorControl:
         else:
             # data is int
             data_buf[4:8] = data_to_uint8s(int(data))
+        self.param_pending.add((Motor.SlaveID, int(RID)))
         self.__send_data(0x7FF, data_buf)
 
     def switchControlMode(self, Motor, ControlMode):
@@ -403,6 +705,7 @@ class MotorControl:
         self.Limit_Param[Motor_Type][0] = PMAX
         self.Limit_Param[Motor_Type][1] = VMAX
         self.Limit_Param[Motor_Type][2] = TMAX
+        self.lut_map.pop(Motor_Type, None)
 
     def refresh_motor_status(self,Motor):
         """
@@ -411,8 +714,21 @@ class MotorControl:
         can_id_l = Motor.SlaveID & 0xff #id low 8 bits
         can_id_h = (Motor.SlaveID >> 8) & 0xff  #id high 8 bits
         data_buf = np.array([np.uint8(can_id_l), np.uint8(can_id_h), 0xCC, 0x00, 0x00, 0x00, 0x00, 0x00], np.uint8)
+        self.__expect([Motor])
         self.__send_data(0x7FF, data_buf)
-        self.recv()  # receive the data from serial port
+        self.__collect()  # receive the data from serial port
+
+    def refresh_motor_status_batch(self, Motors, timeout=None):
+        """
+        get the status of several motors with one serial write 一次串口写入获得多个电机的状态
+        :param Motors: list of Motor objects 电机对象列表
+        :param timeout: wait for the replies, default reply_timeout 等待反馈的时间 默认reply_timeout
+        :return: list of Motor objects that missed the reply 没有按时回复的电机
+        """
+        data = [param_data(Motor.SlaveID, 0xCC) for Motor in Motors]
+        self.__expect(Motors, timeout)
+        self.send_batch([0x7FF] * len(Motors), data)
+        return self.__collect(timeout)  # receive the data from serial port
 
     def change_motor_param(self, Motor, RID, data):
         """
@@ -456,6 +772,73 @@ class MotorControl:
                     return None
         return None
 
+
+class SerialTransport:
+    def __init__(self, serial_device):
+        """
+        DM USB-CAN serial framing 达妙USB转CAN串口协议
+        every CAN frame is wrapped in a 30 byte 0x55 0xAA... host frame, replies are 16 byte 0xAA...0x55 frames
+        每个CAN帧包装成30字节的0x55 0xAA...下发帧，回复为16字节的0xAA...0x55帧
+        :param serial_device: serial object 串口对象
+        """
+        self.serial_ = serial_device
+        self.data_save = bytes()  # save data
+        self.dropped_bytes = 0  # bytes skipped while looking for a frame header 寻找帧头时丢弃的字节数
+
+    def open(self):
+        if self.serial_.is_open:  # open the serial port
+            print("Serial port is open")
+            self.serial_.close()
+        self.serial_.open()
+
+    def close(self):
+        self.serial_.close()
+
+    def flush_output(self):
+        # drop host frames not written to the wire yet 丢弃还没有发出的下发帧
+        if hasattr(self.serial_, "reset_output_buffer"):
+            self.serial_.reset_output_buffer()
+
+    def send_frames(self, can_ids, data):
+        """
+        send CAN frames in one write 一次写入发送多个CAN帧
+        :param can_ids: CAN ID of every frame 每一帧的CAN ID
+        :param data: frame data, shape (n, 8) 每一帧的数据
+        """
+        can_ids = np.asarray(can_ids, np.uint32).reshape(-1)
+        frames = np.tile(MotorControl.send_data_frame, (can_ids.shape[0], 1))
+        frames[:, 13] = can_ids & 0xff
+        frames[:, 14] = (can_ids >> 8) & 0xff  # id high 8 bits
+        frames[:, 21:29] = np.asarray(data, np.uint8).reshape(-1, 8)
+        self.serial_.write(frames.tobytes())
+
+    def recv_frames(self, expected=0, timeout=0.0):
+        """
+        frames received so far 读取目前收到的所有帧
+        :param expected: wait until this many frames have arrived 等待收到的帧数
+        :param timeout: longest wait 最长等待时间 单位秒
+        :return: list of (CANID, CMD, data, t), t is time.time() of the read 读取时刻
+        """
+        if expected > 0 and timeout > 0:
+            self.__wait_bytes(expected * 16 - len(self.data_save), monotonic() + timeout)
+        # 把上次没有解析完的剩下的也放进来
+        data_recv = b''.join([self.data_save, self.serial_.read_all()])
+        t = time.time()
+        frames = []
+        for packet in self.__extract_packets(data_recv):
+            CANID = (packet[6] << 24) | (packet[5] << 16) | (packet[4] << 8) | packet[3]
+            frames.append((CANID, packet[1], packet[7:15], t))
+        return frames
+
+    def __wait_bytes(self, nbytes, deadline):
+        if hasattr(self.serial_, "wait_bytes"):
+            return self.serial_.wait_bytes(nbytes, deadline)
+        while self.serial_.in_waiting < nbytes:
+            if monotonic() >= deadline:
+                return False
+            sleep(0.0001)
+        return True
+
     # -------------------------------------------------
     # Extract packets from the serial data
     def __extract_packets(self, data):
@@ -474,19 +857,39 @@ class MotorControl:
                 remainder_pos = i
             else:
                 i += 1
+        self.dropped_bytes += remainder_pos - len(frames) * frame_length
         self.data_save = data[remainder_pos:]
         return frames
 
 
+def param_data(SlaveID, cmd, RID=0, value=None):
+    """
+    build the data of a 0x7FF register frame 构造0x7FF寄存器命令帧的数据
+    :param SlaveID: CANID 电机ID
+    :param cmd: 0x33 read 读, 0x55 write 写, 0xAA save 保存, 0xCC refresh 刷新状态
+    :param RID: DM_variable 电机参数
+    :param value: value to write 写入的值
+    :return: 8 bytes uint8 array
+    """
+    data_buf = np.array([SlaveID & 0xff, (SlaveID >> 8) & 0xff, cmd, RID, 0x00, 0x00, 0x00, 0x00], np.uint8)
+    if value is not None:
+        if is_in_ranges(RID):
+            data_buf[4:8] = data_to_uint8s(int(value))
+        else:
+            data_buf[4:8] = float_to_uint8s(value)
+    return data_buf
+
+
 def LIMIT_MIN_MAX(x, min, max):
     if x <= min:
         x = min
     elif x > max:
         x = max
+    return x
 
 
 def float_to_uint(x: float, x_min: float, x_max: float, bits):
-    LIMIT_MIN_MAX(x, x_min, x_max)
+    x = LIMIT_MIN_MAX(x, x_min, x_max)
     span = x_max - x_min
     data_norm = (x - x_min) / span
     return np.uint16(data_norm * ((1 << bits) - 1))
@@ -499,6 +902,102 @@ def uint_to_float(x: np.uint16, min: float, max: float, bits):
     return np.float32(temp)
 
 
+def float_to_uint_array(x, x_min, x_max, bits):
+    """
+    vectorized float_to_uint, values outside [x_min, x_max] are clamped 向量化的float_to_uint，超出范围的值会被限幅
+    """
+    x = np.minimum(np.maximum(np.asarray(x, np.float64), x_min), x_max)
+    return ((x - x_min) / (x_max - x_min) * ((1 << bits) - 1)).astype(np.uint16)
+
+
+def uint_to_float_array(x, x_min, x_max, bits):
+    """
+    vectorized uint_to_float 向量化的uint_to_float
+    """
+    return np.asarray(x, np.float64) / ((1 << bits) - 1) * (x_max - x_min) + x_min
+
+
+def pack_mit(kp, kd, q, dq, tau, limits):
+    """
+    data of several MIT control frames 批量构造MIT控制帧数据
+    :param limits: PMAX VMAX TMAX of every motor, shape (n, 3) 每个电机的限幅
+    :return: uint8 array shape (n, 8)
+    """
+    n = limits.shape[0]
+    # the fields are 16+12+12+12+12 bits, packed into one big-endian 64 bit word per frame
+    # 各字段为16+12+12+12+12位 每帧打包成一个大端64位整数
+    word = float_to_uint_array(q, -limits[:, 0], limits[:, 0], 16).astype(np.uint64) << np.uint64(48)
+    word |= float_to_uint_array(dq, -limits[:, 1], limits[:, 1], 12).astype(np.uint64) << np.uint64(36)
+    word |= float_to_uint_array(kp, 0, 500, 12).astype(np.uint64) << np.uint64(24)
+    word |= float_to_uint_array(kd, 0, 5, 12).astype(np.uint64) << np.uint64(12)
+    word |= float_to_uint_array(tau, -limits[:, 2], limits[:, 2], 12)
+    return np.broadcast_to(word, (n,)).astype('>u8').view(np.uint8).reshape(n, 8)
+
+
+def pack_pos_vel(P_desired, V_desired, n):
+    """
+    data of several position and velocity control frames 批量构造位置速度控制帧数据
+    :return: uint8 array shape (n, 8)
+    """
+    values = np.empty((n, 2), '<f4')
+    values[:, 0] = P_desired
+    values[:, 1] = V_desired
+    return values.view(np.uint8)
+
+
+def pack_vel(Vel_desired, n):
+    """
+    data of several velocity control frames 批量构造速度控制帧数据
+    :return: uint8 array shape (n, 8)
+    """
+    values = np.zeros((n, 2), '<f4')
+    values[:, 0] = Vel_desired
+    return values.view(np.uint8)
+
+
+feedback_lut_cache = dict()
+
+
+def uint_to_float_table(min: float, max: float, bits):
+    """
+    uint_to_float of every possible input 所有输入值的uint_to_float结果
+    :return: float32 array with 1 << bits entries
+    """
+    span = max - min
+    data_norm = np.arange(1 << bits, dtype=np.float64) / ((1 << bits) - 1)
+    return (data_norm * span + min).astype(np.float32)
+
+
+def feedback_lut(Q_MAX, DQ_MAX, TAU_MAX):
+    """
+    lookup tables for the 16 bit q and 12 bit dq/tau of the feedback frame 反馈帧q(16位)和dq/tau(12位)的查找表
+    tables are shared between all motors with the same limits 相同限幅的电机共用同一组表
+    :return: (q_lut, dq_lut, tau_lut)
+    """
+    key = (float(Q_MAX), float(DQ_MAX), float(TAU_MAX))
+    lut = feedback_lut_cache.get(key)
+    if lut is None:
+        lut = (uint_to_float_table(-Q_MAX, Q_MAX, 16),
+               uint_to_float_table(-DQ_MAX, DQ_MAX, 12),
+               uint_to_float_table(-TAU_MAX, TAU_MAX, 12))
+        feedback_lut_cache[key] = lut
+    return lut
+
+
+def decode_feedback(data, lut):
+    """
+    decode a block of feedback frames with one set of lookup tables 用查找表批量解析反馈帧
+    :param data: uint8 array shape (n, 8) 反馈帧数据
+    :param lut: (q_lut, dq_lut, tau_lut) from feedback_lut
+    :return: (q, dq, tau) float32 arrays shape (n,)
+    """
+    data = np.asarray(data, np.uint8).reshape(-1, 8).astype(np.intp)
+    q = lut[0][(data[:, 1] << 8) | data[:, 2]]
+    dq = lut[1][(data[:, 3] << 4) | (data[:, 4] >> 4)]
+    tau = lut[2][((data[:, 4] & 0xf) << 8) | data[:, 5]]
+    return q, dq, tau
+
+
 def float_to_uint8s(value):
     # Pack the float into 4 bytes
     packed = pack('f', value)
@@ -518,17 +1017,6 @@ def data_to_uint8s(value):
     return unpack('4B', packed)
 
 
-def is_in_ranges(number):
-    """
-    check if the number is in the range of uint32
-    :param number:
-    :return:
-    """
-    if (7 <= number <= 10) or (13 <= number <= 16) or (35 <= number <= 36):
-        return True
-    return False
-
-
 def uint8s_to_uint32(byte1, byte2, byte3, byte4):
     # Pack the four uint8 values into a single uint32 value in little-endian order
     packed = pack('<4B', byte1, byte2, byte3, byte4)
@@ -554,72 +1042,3 @@ def get_enum_by_index(index, enum_class):
     except ValueError:
         return None
 
-
-class DM_Motor_Type(IntEnum):
-    DM4310 = 0
-    DM4310_48V = 1
-    DM4340 = 2
-    DM4340_48V = 3
-    DM6006 = 4
-    DM8006 = 5
-    DM8009 = 6
-    DM10010L = 7
-    DM10010 = 8
-    DMH3510 = 9
-    DMH6215 = 10
-    DMG6220 = 11
-
-
-class DM_variable(IntEnum):
-    UV_Value = 0
-    KT_Value = 1
-    OT_Value = 2
-    OC_Value = 3
-    ACC = 4
-    DEC = 5
-    MAX_SPD = 6
-    MST_ID = 7
-    ESC_ID = 8
-    TIMEOUT = 9
-    CTRL_MODE = 10
-    Damp = 11
-    Inertia = 12
-    hw_ver = 13
-    sw_ver = 14
-    SN = 15
-    NPP = 16
-    Rs = 17
-    LS = 18
-    Flux = 19
-    Gr = 20
-    PMAX = 21
-    VMAX = 22
-    TMAX = 23
-    I_BW = 24
-    KP_ASR = 25
-    KI_ASR = 26
-    KP_APR = 27
-    KI_APR = 28
-    OV_Value = 29
-    GREF = 30
-    Deta = 31
-    V_BW = 32
-    IQ_c1 = 33
-    VL_c1 = 34
-    can_br = 35
-    sub_ver = 36
-    u_off = 50
-    v_off = 51
-    k1 = 52
-    k2 = 53
-    m_off = 54
-    dir = 55
-    p_m = 80
-    xout = 81
-
-
-class Control_Type(IntEnum):
-    MIT = 1
-    POS_VEL = 2
-    VEL = 3
-    Torque_Pos = 4
@@ -0,0 +1,272 @@
+"""
+wire codec without NumPy 不依赖NumPy的协议编解码
+
+Encodes and decodes the DM USB-CAN host frames and the motor CAN payloads one frame at a time with struct, so tools
+that talk to a few motors (dmctl.py) start without importing NumPy. DM_CAN builds on the same constants and enums
+and adds the vectorized batch encoders. 使用struct逐帧编解码达妙USB转CAN的下发/回复帧和电机CAN数据，只操作少量电机的
+工具(dmctl.py)不需要导入NumPy。DM_CAN使用同样的常量和枚举，并提供向量化的批量编码。
+"""
+import struct
+from enum import IntEnum
+
+#                4310           4310_48        4340           4340_48
+LIMIT_PARAM = ((12.5, 30, 10), (12.5, 50, 10), (12.5, 8, 28), (12.5, 10, 28),
+               # 6006           8006           8009            10010L         10010
+               (12.5, 45, 20), (12.5, 45, 40), (12.5, 45, 54), (12.5, 25, 200), (12.5, 20, 200),
+               # H3510            DMG6215      DMH6220
+               (12.5, 280, 1), (12.5, 45, 10), (12.5, 45, 10))
+
+PARAM_CAN_ID = 0x7FF  # CAN ID of register frames 寄存器命令帧的CAN ID
+CMD_READ = 0x33
+CMD_WRITE = 0x55
+CMD_SAVE = 0xAA
+CMD_REFRESH = 0xCC
+CMD_ENABLE = 0xFC
+CMD_DISABLE = 0xFD
+CMD_ZERO = 0xFE
+CMD_CLEAR_ERROR = 0xFB
+MODE_OFFSET = {2: 0x100, 3: 0x200, 4: 0x300}  # CAN ID offset of POS_VEL/VEL/Torque_Pos frames 各控制模式的CAN ID偏移
+
+# 30 byte host frame: fixed head, CAN ID, DLC block, data, tail 下发帧: 固定帧头 CAN ID 长度 数据 帧尾
+host_frame = struct.Struct("<13sI4s8sx")
+HOST_HEAD = bytes((0x55, 0xAA, 0x1e, 0x03, 0x01, 0x00, 0x00, 0x00, 0x0a, 0x00, 0x00, 0x00, 0x00))
+HOST_DLC = bytes((0x00, 0x08, 0x00, 0x00))
+# 16 byte reply frame: 0xAA, CMD, length, CAN ID, data, 0x55 回复帧
+reply_frame = struct.Struct("<BBBI8sB")
+# CMD of a CAN frame that the transport knows left the motor before the last command reached it (GatewayTransport),
+# it updates the motor state but is not a reply to that command 在最近的命令到达电机之前发出的CAN帧的CMD
+# 会更新电机状态 但不算作该命令的回复
+RX_STALE = 0x91
+param_frame = struct.Struct("<HBB4s")  # SlaveID, cmd, RID, value
+u32 = struct.Struct("<I")
+f32 = struct.Struct("<f")
+pos_vel_frame = struct.Struct("<ff")
+vel_frame = struct.Struct("<f4x")
+feedback_frame = struct.Struct(">BHBBBBB")  # id/status, q, dq/tau packed in 3 bytes, T_MOS, T_Rotor
+
+
+def encode_host_frame(can_id, data):
+    """
+    wrap one CAN frame in a host frame 把一个CAN帧包装成下发帧
+    :param can_id: CAN ID
+    :param data: 8 bytes 数据
+    :return: 30 bytes
+    """
+    return host_frame.pack(HOST_HEAD, can_id & 0xffff, HOST_DLC, bytes(data))
+
+
+def encode_host_frames(frames):
+    """
+    :param frames: iterable of (can_id, data) 多个(CAN ID, 数据)
+    :return: bytes for one serial write 一次串口写入的数据
+    """
+    return b"".join(encode_host_frame(can_id, data) for can_id, data in frames)
+
+
+def extract_reply_frames(buf):
+    """
+    split received bytes into reply frames 把收到的字节拆分成回复帧
+    :param buf: bytes received, including the remainder of the last call 收到的字节 包括上次剩下的部分
+    :return: ([(CANID, CMD, data), ...], remainder, dropped bytes) 帧列表 剩余字节 丢弃的字节数
+    """
+    frames = []
+    size = reply_frame.size
+    i = 0
+    end = 0
+    dropped = 0
+    while i <= len(buf) - size:
+        if buf[i] == 0xAA and buf[i + size - 1] == 0x55:
+            _, CMD, _, CANID, data, _ = reply_frame.unpack_from(buf, i)
+            frames.append((CANID, CMD, data))
+            dropped += i - end
+            i += size
+            end = i
+        else:
+            i += 1
+    return frames, bytes(buf[end:]), dropped
+
+
+def is_in_ranges(number):
+    """
+    check if the number is in the range of uint32
+    :param number:
+    :return:
+    """
+    if (7 <= number <= 10) or (13 <= number <= 16) or (35 <= number <= 36):
+        return True
+    return False
+
+
+def param_frame_data(SlaveID, cmd, RID=0, value=None):
+    """
+    data of a 0x7FF register frame 寄存器命令帧的数据
+    :param cmd: CMD_READ, CMD_WRITE, CMD_SAVE or CMD_REFRESH
+    :param value: value to write, uint32 or float depending on RID 写入的值 按RID决定uint32或float
+    :return: 8 bytes
+    """
+    if value is None:
+        raw = bytes(4)
+    elif is_in_ranges(RID):
+        raw = u32.pack(int(value))
+    else:
+        raw = f32.pack(value)
+    return param_frame.pack(SlaveID & 0xffff, cmd, RID, raw)
+
+
+def decode_param_reply(data):
+    """
+    :param data: data of a register reply 寄存器回复帧的数据
+    :return: (SlaveID, cmd, RID, value), None if the frame is not a read/write reply 不是读写回复时返回None
+    """
+    SlaveID, cmd, RID, raw = param_frame.unpack(bytes(data))
+    if cmd not in (CMD_READ, CMD_WRITE):
+        return None
+    value = u32.unpack(raw)[0] if is_in_ranges(RID) else f32.unpack(raw)[0]
+    return SlaveID, cmd, RID, value
+
+
+def control_cmd_data(cmd):
+    """
+    data of an enable/disable/zero/clear error frame 使能/失能/设零/清除错误帧的数据
+    :param cmd: CMD_ENABLE, CMD_DISABLE, CMD_ZERO, CMD_CLEAR_ERROR
+    """
+    return b"\xff" * 7 + bytes((cmd,))
+
+
+def float_to_uint(x, x_min, x_max, bits):
+    x = min(max(x, x_min), x_max)
+    return int((x - x_min) / (x_max - x_min) * ((1 << bits) - 1))
+
+
+def uint_to_float(x, x_min, x_max, bits):
+    return x / ((1 << bits) - 1) * (x_max - x_min) + x_min
+
+
+def mit_data(kp, kd, q, dq, tau, limits):
+    """
+    data of an MIT control frame MIT控制帧的数据
+    :param limits: (PMAX, VMAX, TMAX) of the motor 电机的限幅
+    :return: 8 bytes
+    """
+    Q_MAX, DQ_MAX, TAU_MAX = limits
+    kp_uint = float_to_uint(kp, 0, 500, 12)
+    kd_uint = float_to_uint(kd, 0, 5, 12)
+    q_uint = float_to_uint(q, -Q_MAX, Q_MAX, 16)
+    dq_uint = float_to_uint(dq, -DQ_MAX, DQ_MAX, 12)
+    tau_uint = float_to_uint(tau, -TAU_MAX, TAU_MAX, 12)
+    return bytes((q_uint >> 8, q_uint & 0xff, dq_uint >> 4, ((dq_uint & 0xf) << 4) | (kp_uint >> 8), kp_uint & 0xff,
+                  kd_uint >> 4, ((kd_uint & 0xf) << 4) | (tau_uint >> 8), tau_uint & 0xff))
+
+
+def pos_vel_data(P_desired, V_desired):
+    return pos_vel_frame.pack(P_desired, V_desired)
+
+
+def vel_data(Vel_desired):
+    return vel_frame.pack(Vel_desired)
+
+
+def decode_feedback(data, limits):
+    """
+    decode a feedback frame 解析反馈帧
+    :param limits: (PMAX, VMAX, TMAX) of the motor 电机的限幅
+    :return: (id nibble, status, q, dq, tau, temp_mos, temp_rotor)
+    """
+    head, q_uint, dq_tau, low, tau_low, temp_mos, temp_rotor = feedback_frame.unpack(bytes(data))
+    Q_MAX, DQ_MAX, TAU_MAX = limits
+    dq_uint = (dq_tau << 4) | (low >> 4)
+    tau_uint = ((low & 0xf) << 8) | tau_low
+    return (head & 0xf, head >> 4, uint_to_float(q_uint, -Q_MAX, Q_MAX, 16),
+            uint_to_float(dq_uint, -DQ_MAX, DQ_MAX, 12), uint_to_float(tau_uint, -TAU_MAX, TAU_MAX, 12),
+            temp_mos, temp_rotor)
+
+
+def motor_types_for_limits(PMAX, VMAX, TMAX):
+    """
+    motor types whose default limits match 默认限幅相符的电机类型
+    :return: list of DM_Motor_Type
+    """
+    return [DM_Motor_Type(i) for i, row in enumerate(LIMIT_PARAM)
+            if all(abs(a - b) <= 1e-3 + 1e-3 * abs(a) for a, b in zip((PMAX, VMAX, TMAX), row))]
+
+
+class DM_Motor_Type(IntEnum):
+    DM4310 = 0
+    DM4310_48V = 1
+    DM4340 = 2
+    DM4340_48V = 3
+    DM6006 = 4
+    DM8006 = 5
+    DM8009 = 6
+    DM10010L = 7
+    DM10010 = 8
+    DMH3510 = 9
+    DMH6215 = 10
+    DMG6220 = 11
+
+
+class DM_variable(IntEnum):
+    UV_Value = 0
+    KT_Value = 1
+    OT_Value = 2
+    OC_Value = 3
+    ACC = 4
+    DEC = 5
+    MAX_SPD = 6
+    MST_ID = 7
+    ESC_ID = 8
+    TIMEOUT = 9
+    CTRL_MODE = 10
+    Damp = 11
+    Inertia = 12
+    hw_ver = 13
+    sw_ver = 14
+    SN = 15
+    NPP = 16
+    Rs = 17
+    LS = 18
+    Flux = 19
+    Gr = 20
+    PMAX = 21
+    VMAX = 22
+    TMAX = 23
+    I_BW = 24
+    KP_ASR = 25
+    KI_ASR = 26
+    KP_APR = 27
+    KI_APR = 28
+    OV_Value = 29
+    GREF = 30
+    Deta = 31
+    V_BW = 32
+    IQ_c1 = 33
+    VL_c1 = 34
+    can_br = 35
+    sub_ver = 36
+    u_off = 50
+    v_off = 51
+    k1 = 52
+    k2 = 53
+    m_off = 54
+    dir = 55
+    p_m = 80
+    xout = 81
+
+
+class Control_Type(IntEnum):
+    MIT = 1
+    POS_VEL = 2
+    VEL = 3
+    Torque_Pos = 4
+
+
+class DM_Motor_State(IntEnum):
+    DISABLED = 0x0
+    ENABLED = 0x1
+    OVER_VOLTAGE = 0x8
+    UNDER_VOLTAGE = 0x9
+    OVER_CURRENT = 0xA
+    MOS_OVER_TEMP = 0xB
+    ROTOR_OVER_TEMP = 0xC
+    LOST_COMM = 0xD
+    OVERLOAD = 0xE
@@ -0,0 +1,191 @@
+"""
+fleet commissioning tool 多电机批量配置工具
+
+Reads a declarative fleet spec, reads the current registers of every motor in one pipelined sweep,
+and only writes / saves what differs. 读取声明式的配置文件，批量读取所有电机的当前寄存器，只写入和保存有差异的参数。
+
+fleet spec example 配置文件示例 (JSON):
+
+    {
+      "motors": [
+        {"id": 1, "master_id": 17, "type": "DM4310", "mode": "MIT",
+         "params": {"PMAX": 12.5, "VMAX": 30, "TMAX": 10}},
+        {"id": 2, "current_id": 5, "master_id": 18, "type": "DM4310", "mode": "VEL",
+         "params": {"KP_ASR": 0.02}}
+      ]
+    }
+
+"current_id" is the CAN ID the motor answers on now, default "id". current_id为电机当前的CAN ID，默认等于id
+"current_master_id" is the master ID it replies on now, default "master_id".
+
+usage 用法:
+    python DM_Commission.py fleet.json --port COM8 [--baud 921600] [--dry-run]
+"""
+import argparse
+import json
+import serial
+from DM_CAN import *
+
+
+class FleetEntry:
+    def __init__(self, spec):
+        """
+        one motor of the fleet spec 配置文件中的一个电机
+        :param spec: dict from the fleet spec 配置文件中的字典
+        """
+        self.id = int(spec["id"])
+        self.master_id = int(spec["master_id"])
+        self.current_id = int(spec.get("current_id", self.id))
+        self.current_master_id = int(spec.get("current_master_id", self.master_id))
+        self.MotorType = DM_Motor_Type[spec.get("type", "DM4310")]
+        self.motor = Motor(self.MotorType, self.current_id, self.current_master_id)
+        self.target = {}
+        if "mode" in spec:
+            self.target[DM_variable.CTRL_MODE] = int(Control_Type[spec["mode"]])
+        for name, value in spec.get("params", {}).items():
+            self.target[DM_variable[name]] = value
+        if self.master_id != self.current_master_id:
+            self.target[DM_variable.MST_ID] = self.master_id
+        if self.id != self.current_id:
+            self.target[DM_variable.ESC_ID] = self.id
+        self.current = {}
+        self.diff = {}
+        self.written = {}
+        self.verified = {}
+
+
+def load_fleet(path):
+    """
+    load a fleet spec file 读取配置文件
+    :param path: JSON file path 配置文件路径
+    :return: list of FleetEntry
+    """
+    with open(path, "r", encoding="utf-8") as f:
+        spec = json.load(f)
+    return [FleetEntry(m) for m in spec["motors"]]
+
+
+def same_value(RID, current, target):
+    if is_in_ranges(RID):
+        return int(current) == int(target)
+    return abs(float(current) - float(target)) <= 1e-4 * max(1.0, abs(float(target)))
+
+
+def diff_fleet(motor_control, fleet, timeout=0.5):
+    """
+    read the registers named in the spec of every motor and compute what differs 读取所有电机寄存器并计算差异
+    :param motor_control: MotorControl object 电机控制对象
+    :param fleet: list of FleetEntry
+    :param timeout: time to wait for the replies 等待回复的时间 单位秒
+    :return: list of FleetEntry that did not answer 没有回复的电机
+    """
+    RIDs = sorted({RID for entry in fleet for RID in entry.target})
+    for entry in fleet:
+        motor_control.addMotor(entry.motor)
+    values = motor_control.read_motor_param_batch([entry.motor for entry in fleet], RIDs, timeout)
+    missing = []
+    for entry in fleet:
+        entry.current = values[entry.motor.SlaveID]
+        if not entry.current:
+            missing.append(entry)
+            continue
+        entry.diff = {RID: value for RID, value in entry.target.items()
+                      if RID not in entry.current or not same_value(RID, entry.current[RID], value)}
+    return missing
+
+
+def apply_fleet(motor_control, fleet, timeout=0.5):
+    """
+    write and save the differences of all motors in parallel 并行写入并保存所有电机的差异参数
+    ordinary registers go first, then MST_ID, then ESC_ID, because those change how the motor replies
+    先写普通寄存器，再写MST_ID，最后写ESC_ID，因为这两个会改变电机的回复方式
+    :param motor_control: MotorControl object 电机控制对象
+    :param fleet: list of FleetEntry after diff_fleet
+    :param timeout: time to wait for each phase 每个阶段等待回复的时间 单位秒
+    :return: True if every write was echoed back 所有写入都成功返回True
+    """
+    changed = [entry for entry in fleet if entry.diff]
+    if not changed:
+        return True
+    # 修改参数前先失能
+    motor_control.disable_batch([entry.motor for entry in changed], timeout)
+
+    id_RIDs = (DM_variable.MST_ID, DM_variable.ESC_ID)
+    phases = [[(entry, RID) for entry in changed for RID in entry.diff if RID not in id_RIDs]]
+    phases += [[(entry, RID) for entry in changed if RID in entry.diff] for RID in id_RIDs]
+    for phase in phases:
+        if not phase:
+            continue
+        writes = [(entry.motor, RID, entry.diff[RID]) for entry, RID in phase]
+        result = motor_control.change_motor_param_batch(writes, timeout)
+        for entry, RID in phase:
+            entry.written[RID] = result[(entry.motor.SlaveID, RID)]
+            if RID == DM_variable.MST_ID and entry.written[RID]:
+                # replies now come back on the new master ID 之后的回复使用新的MasterID
+                entry.motor.MasterID = entry.master_id
+                motor_control.addMotor(entry.motor)
+
+    saved = [entry for entry in changed if all(entry.written.values())]
+    motor_control.save_motor_param_batch([entry.motor for entry in saved])
+    sleep(0.1)
+
+    # ESC_ID is verified by its echo, the other registers are read back after saving
+    # ESC_ID以写入回复为准，其他寄存器保存后重新读取校验
+    verify = [entry for entry in saved if DM_variable.ESC_ID not in entry.diff]
+    RIDs = sorted({RID for entry in verify for RID in entry.diff})
+    if verify:
+        values = motor_control.read_motor_param_batch([entry.motor for entry in verify], RIDs, timeout)
+        for entry in verify:
+            now = values[entry.motor.SlaveID]
+            entry.verified = {RID: RID in now and same_value(RID, now[RID], value) for RID, value in entry.diff.items()}
+    for entry in saved:
+        if DM_variable.ESC_ID in entry.diff:
+            entry.verified = dict(entry.written)
+    return all(entry in saved and all(entry.verified.values()) for entry in changed)
+
+
+def print_plan(fleet, missing):
+    for entry in fleet:
+        if entry in missing:
+            print(f"motor 0x{entry.current_id:02X}: no reply 无回复")
+            continue
+        if not entry.diff:
+            print(f"motor 0x{entry.current_id:02X}: up to date 无需修改")
+            continue
+        for RID, value in entry.diff.items():
+            print(f"motor 0x{entry.current_id:02X}: {DM_variable(RID).name} {entry.current.get(RID)} -> {value}")
+
+
+def print_result(fleet):
+    for entry in fleet:
+        for RID in entry.diff:
+            ok = entry.verified.get(RID, False)
+            print(f"motor 0x{entry.current_id:02X}: {DM_variable(RID).name} {'OK' if ok else 'FAILED 失败'}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="DM motor fleet commissioning 达妙电机批量配置")
+    parser.add_argument("spec", help="fleet spec JSON file 配置文件")
+    parser.add_argument("--port", required=True, help="serial port 串口")
+    parser.add_argument("--baud", type=int, default=921600)
+    parser.add_argument("--timeout", type=float, default=0.5, help="reply timeout per phase 每阶段等待回复时间")
+    parser.add_argument("--dry-run", action="store_true", help="only print the plan 只打印需要修改的参数")
+    args = parser.parse_args()
+
+    fleet = load_fleet(args.spec)
+    serial_device = serial.Serial(args.port, args.baud, timeout=0.5)
+    motor_control = MotorControl(serial_device)
+    try:
+        missing = diff_fleet(motor_control, fleet, args.timeout)
+        print_plan(fleet, missing)
+        if args.dry_run:
+            return 0 if not missing else 1
+        ok = apply_fleet(motor_control, [entry for entry in fleet if entry not in missing], args.timeout)
+        print_result(fleet)
+        return 0 if ok and not missing else 1
+    finally:
+        serial_device.close()
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
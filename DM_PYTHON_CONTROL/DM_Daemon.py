@@ -0,0 +1,423 @@
+"""
+motor daemon 电机守护进程
+
+One process owns the bus through MotorControl, other processes talk to it through a Unix domain socket and read
+the motor state from shared memory without any bus traffic. 由一个进程通过MotorControl独占总线，其他进程通过Unix域套接字
+发送指令，并从共享内存直接读取电机状态，不产生额外的总线通信。
+
+requests are JSON lines, replies are {"ok": true, ...} or {"ok": false, "error": "..."} 请求和回复都是一行JSON:
+
+    {"op": "hello", "name": "gui", "priority": 10}          -> {"shm": name}
+    {"op": "acquire", "motors": [1, 2]}                     -> {"granted": [...], "denied": [...]}
+    {"op": "release", "motors": [1, 2]}
+    {"op": "enable" | "disable" | "zero", "motors": [1, 2]} -> {"failed": [...]}
+    {"op": "mit", "motors": [1, 2], "kp": 30, "kd": 0.5, "q": [0, 0], "dq": [0, 0], "tau": [0, 0]}
+    {"op": "pos_vel", "motors": [1, 2], "p": [0, 0], "v": [1, 1]}
+    {"op": "vel", "motors": [1, 2], "v": [1, 1]}
+    {"op": "read_param", "motor": 1, "rid": 21}             -> {"value": 12.5}
+    {"op": "estop"} / {"op": "clear_estop"}
+
+A client must hold a motor to command it. A motor is free, or held by one client; acquire takes it over from a
+client of lower priority. estop is accepted from every client and runs ahead of the requests already queued.
+只有持有电机的客户端才能控制它，优先级高的客户端可以从优先级低的客户端接管电机，
+任何客户端都可以急停，急停排在已经排队的请求前面执行。
+
+usage 用法:
+    python DM_Daemon.py --port /dev/ttyACM0 --motor DM4310:0x01:0x11 --motor DM4310:0x02:0x12
+"""
+import argparse
+import json
+import os
+import socket
+import socketserver
+import threading
+from concurrent.futures import Future
+from multiprocessing import shared_memory, resource_tracker
+from itertools import count
+from queue import PriorityQueue, Empty
+from time import monotonic, sleep
+import numpy as np
+from DM_CAN import Motor, MotorControl, DM_Motor_Type
+
+SOCKET_PATH = "/tmp/dm_motor.sock"
+SHM_NAME = "dm_motor_state"
+
+HEADER_DTYPE = np.dtype([("seq", "<u8"), ("n", "<u4"), ("estop", "<u4"), ("tick", "<u8"), ("time", "<f8")])
+STATE_DTYPE = np.dtype([("SlaveID", "<u4"), ("MasterID", "<u4"), ("status", "u1"), ("temp_mos", "u1"),
+                        ("temp_rotor", "u1"), ("enabled", "u1"), ("missed_replies", "<u4"), ("q", "<f8"),
+                        ("dq", "<f8"), ("tau", "<f8"), ("recv_time", "<f8")])
+
+
+class StateSegment:
+    def __init__(self, name=SHM_NAME, n=None):
+        """
+        motor state in shared memory, guarded by a sequence lock 共享内存中的电机状态，用顺序锁保护
+        the writer makes seq odd while writing, readers retry until they copy the same even seq on both sides
+        写入时seq为奇数，读取方在前后读到相同的偶数seq时才算读到完整的数据
+        :param name: shared memory name 共享内存名称
+        :param n: number of motors to create the segment, None to attach to an existing one 创建时的电机数 None表示打开已有的
+        """
+        if n is not None:
+            size = HEADER_DTYPE.itemsize + n * STATE_DTYPE.itemsize
+            try:
+                shared_memory.SharedMemory(name).unlink()  # left over from a crashed daemon 上次异常退出留下的
+            except FileNotFoundError:
+                pass
+            self.shm = shared_memory.SharedMemory(name, create=True, size=size)
+        else:
+            self.shm = shared_memory.SharedMemory(name)
+            # only the creator may unlink it 只有创建者可以删除
+            resource_tracker.unregister(self.shm._name, "shared_memory")
+        self.owner = n is not None
+        self.header = np.ndarray((), HEADER_DTYPE, self.shm.buf)
+        if n is not None:
+            self.header[()] = (0, n, 0, 0, 0.0)
+        self.n = int(self.header["n"])
+        self.motors = np.ndarray((self.n,), STATE_DTYPE, self.shm.buf, HEADER_DTYPE.itemsize)
+
+    def write(self, Motors, tick, t, estop):
+        seq = int(self.header["seq"])
+        self.header["seq"] = seq + 1
+        for i, Motor in enumerate(Motors):
+            self.motors[i] = (Motor.SlaveID, Motor.MasterID, Motor.status, Motor.temp_mos, Motor.temp_rotor,
+                              Motor.isEnable, Motor.missed_replies, Motor.state_q, Motor.state_dq, Motor.state_tau,
+                              Motor.recv_time)
+        self.header["tick"] = tick
+        self.header["time"] = t
+        self.header["estop"] = estop
+        self.header["seq"] = seq + 2
+
+    def read(self):
+        """
+        consistent copy of the motor states 电机状态的一致副本
+        :return: (STATE_DTYPE array, header copy)
+        """
+        while True:
+            seq = int(self.header["seq"])
+            if seq & 1:
+                sleep(0)
+                continue
+            motors = self.motors.copy()
+            header = self.header.copy()
+            if int(self.header["seq"]) == seq:
+                return motors, header
+
+    def close(self):
+        del self.header, self.motors
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
+
+
+class ClientSession:
+    def __init__(self):
+        self.name = "client"
+        self.priority = 0
+        self.held = set()
+
+
+class MotorDaemon:
+    def __init__(self, motor_control, Motors, socket_path=SOCKET_PATH, shm_name=SHM_NAME, period=0.01, poll=0.0,
+                 disable_on_disconnect=True):
+        """
+        serve one bus to several client processes 把一条总线提供给多个客户端进程
+        all bus traffic happens on the thread running serve_forever 所有总线通信都在运行serve_forever的线程中进行
+        :param motor_control: MotorControl object 电机控制对象
+        :param Motors: list of Motor objects 电机对象列表
+        :param socket_path: Unix domain socket path 套接字路径
+        :param shm_name: shared memory name 共享内存名称
+        :param period: state publish period 状态发布周期 单位秒
+        :param poll: refresh motors nobody commanded for this long, 0 for never 多久没有指令的电机刷新一次状态 0表示不刷新
+        :param disable_on_disconnect: disable the motors of a client that disconnects 客户端断开时失能它持有的电机
+        """
+        self.motor_control = motor_control
+        self.Motors = list(Motors)
+        self.motors_map = {Motor.SlaveID: Motor for Motor in self.Motors}
+        self.socket_path = socket_path
+        self.shm_name = shm_name
+        self.period = period
+        self.poll = poll
+        self.disable_on_disconnect = disable_on_disconnect
+        self.owner = {}  # SlaveID -> ClientSession
+        self.last_command = {Motor.SlaveID: 0.0 for Motor in self.Motors}
+        self.queue = PriorityQueue()  # (rank, order, session, request, future), estop has rank 0 急停排在最前
+        self.order = count()
+        self.tick = 0
+        self.running = False
+        self.segment = None
+        self.server = None
+
+    def submit(self, session, request):
+        """
+        run a request on the bus thread and wait for its reply 在总线线程中执行请求并等待回复
+        """
+        future = Future()
+        if request.get("op") == "estop":
+            # block the sends of the request running now and of the queued ones right away 立即禁止正在执行和排队的请求发送
+            self.motor_control.estop = True
+            self.queue.put((0, next(self.order), session, request, future))
+        else:
+            self.queue.put((1, next(self.order), session, request, future))
+        return future.result()
+
+    def serve_forever(self):
+        self.segment = StateSegment(self.shm_name, len(self.Motors))
+        if os.path.exists(self.socket_path):
+            os.unlink(self.socket_path)
+        self.server = socketserver.ThreadingUnixStreamServer(self.socket_path, ClientHandler)
+        self.server.daemon_threads = True
+        self.server.motor_daemon = self
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.running = True
+        next_tick = monotonic()
+        try:
+            while self.running:
+                # ticks run by the deadline, a busy queue must not starve the polling and the state refresh
+                # 按截止时间运行周期任务 请求很多时也不会停止状态刷新
+                if monotonic() >= next_tick:
+                    self.__tick()
+                    next_tick += self.period
+                    if next_tick < monotonic():
+                        next_tick = monotonic() + self.period
+                try:
+                    _, _, session, request, future = self.queue.get(timeout=max(next_tick - monotonic(), 0))
+                except Empty:
+                    continue
+                try:
+                    future.set_result(self.__execute(session, request))
+                except Exception as e:
+                    future.set_result({"ok": False, "error": "%s: %s" % (type(e).__name__, e)})
+                self.segment.write(self.Motors, self.tick, monotonic(), self.motor_control.estop)
+        finally:
+            self.close()
+
+    def shutdown(self):
+        self.running = False
+
+    def close(self):
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+            self.server = None
+            if os.path.exists(self.socket_path):
+                os.unlink(self.socket_path)
+        if self.segment is not None:
+            self.segment.close()
+            self.segment = None
+
+    def __tick(self):
+        self.tick += 1
+        now = monotonic()
+        if self.poll > 0 and not self.motor_control.estop:
+            idle = [Motor for Motor in self.Motors if now - self.last_command[Motor.SlaveID] >= self.poll]
+            if idle:
+                self.motor_control.refresh_motor_status_batch(idle, timeout=0)
+                for Motor in idle:
+                    self.last_command[Motor.SlaveID] = now
+        self.motor_control.recv()
+        self.segment.write(self.Motors, self.tick, now, self.motor_control.estop)
+
+    def disconnect(self, session):
+        """
+        called by the handler thread when a client goes away 客户端断开时由处理线程调用
+        """
+        self.submit(session, {"op": "release", "motors": sorted(session.held),
+                              "disable": self.disable_on_disconnect})
+
+    def __motors(self, session, ids, hold=True):
+        Motors = []
+        for SlaveID in ids:
+            Motor = self.motors_map.get(SlaveID)
+            if Motor is None:
+                raise ValueError("motor 0x%02X not found" % SlaveID)
+            if hold and self.owner.get(SlaveID) is not session:
+                owner = self.owner.get(SlaveID)
+                raise PermissionError("motor 0x%02X is held by %s" % (SlaveID, owner.name if owner else "nobody"))
+            Motors.append(Motor)
+        now = monotonic()
+        for Motor in Motors:
+            self.last_command[Motor.SlaveID] = now
+        return Motors
+
+    def __execute(self, session, request):
+        mc = self.motor_control
+        op = request.get("op")
+        ids = [int(SlaveID) for SlaveID in request.get("motors", [])]
+        if op == "hello":
+            session.name = str(request.get("name", session.name))
+            session.priority = int(request.get("priority", session.priority))
+            return {"ok": True, "shm": self.shm_name, "motors": [Motor.SlaveID for Motor in self.Motors]}
+        if op == "acquire":
+            granted, denied = [], []
+            for SlaveID in ids:
+                self.__motors(session, [SlaveID], hold=False)
+                owner = self.owner.get(SlaveID)
+                if owner is None or owner is session or owner.priority < session.priority:
+                    if owner is not None:
+                        owner.held.discard(SlaveID)
+                    self.owner[SlaveID] = session
+                    session.held.add(SlaveID)
+                    granted.append(SlaveID)
+                else:
+                    denied.append(SlaveID)
+            return {"ok": True, "granted": granted, "denied": denied}
+        if op == "release":
+            ids = [SlaveID for SlaveID in ids if self.owner.get(SlaveID) is session]
+            if request.get("disable") and ids:
+                mc.disable_batch(self.__motors(session, ids))
+            for SlaveID in ids:
+                del self.owner[SlaveID]
+                session.held.discard(SlaveID)
+            return {"ok": True, "released": ids}
+        if op == "estop":
+            return {"ok": True, "failed": [Motor.SlaveID for Motor in mc.emergency_stop(self.Motors)]}
+        if op == "clear_estop":
+            mc.clear_estop()
+            return {"ok": True}
+        if op == "read_param":
+            Motor = self.__motors(session, [int(request["motor"])], hold=False)[0]
+            return {"ok": True, "value": mc.read_motor_param(Motor, int(request["rid"]))}
+        Motors = self.__motors(session, ids)
+        if op == "enable":
+            failed = mc.enable_batch(Motors)
+        elif op == "disable":
+            failed = mc.disable_batch(Motors)
+        elif op == "zero":
+            failed = mc.set_zero_position_batch(Motors)
+        elif op == "mit":
+            failed = mc.controlMIT_batch(Motors, request.get("kp", 0.0), request.get("kd", 0.0), request["q"],
+                                         request["dq"], request["tau"])
+        elif op == "pos_vel":
+            failed = mc.control_Pos_Vel_batch(Motors, request["p"], request["v"])
+        elif op == "vel":
+            failed = mc.control_Vel_batch(Motors, request["v"])
+        else:
+            raise ValueError("unknown op %r" % (op,))
+        return {"ok": True, "failed": [Motor.SlaveID for Motor in failed]}
+
+
+class ClientHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        daemon = self.server.motor_daemon
+        session = ClientSession()
+        try:
+            for line in self.rfile:
+                try:
+                    request = json.loads(line)
+                except ValueError as e:
+                    reply = {"ok": False, "error": "bad request: %s" % e}
+                else:
+                    reply = daemon.submit(session, request)
+                self.wfile.write(json.dumps(reply).encode() + b"\n")
+        except (ConnectionError, OSError):
+            pass
+        finally:
+            if session.held and daemon.running:
+                daemon.disconnect(session)
+
+
+class MotorClient:
+    def __init__(self, socket_path=SOCKET_PATH, name="client", priority=0):
+        """
+        connect to a motor daemon 连接电机守护进程
+        :param socket_path: Unix domain socket path 套接字路径
+        :param name: client name shown to other clients 客户端名称
+        :param priority: higher priority clients can take motors over 优先级高的客户端可以接管电机
+        """
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.connect(socket_path)
+        self.rfile = self.sock.makefile("rb")
+        info = self.call("hello", name=name, priority=priority)
+        self.motor_ids = info["motors"]
+        self.segment = StateSegment(info["shm"])
+
+    def call(self, op, **kwargs):
+        """
+        send one request and wait for the reply 发送一个请求并等待回复
+        :return: reply dict 回复
+        """
+        kwargs["op"] = op
+        self.sock.sendall(json.dumps(kwargs, default=as_list).encode() + b"\n")
+        reply = json.loads(self.rfile.readline())
+        if not reply.get("ok"):
+            raise RuntimeError(reply.get("error", "request failed"))
+        return reply
+
+    def acquire(self, ids):
+        return self.call("acquire", motors=ids)["granted"]
+
+    def release(self, ids):
+        return self.call("release", motors=ids)["released"]
+
+    def enable(self, ids):
+        return self.call("enable", motors=ids)["failed"]
+
+    def disable(self, ids):
+        return self.call("disable", motors=ids)["failed"]
+
+    def set_zero_position(self, ids):
+        return self.call("zero", motors=ids)["failed"]
+
+    def controlMIT(self, ids, kp, kd, q, dq, tau):
+        return self.call("mit", motors=ids, kp=kp, kd=kd, q=q, dq=dq, tau=tau)["failed"]
+
+    def control_Pos_Vel(self, ids, P_desired, V_desired):
+        return self.call("pos_vel", motors=ids, p=P_desired, v=V_desired)["failed"]
+
+    def control_Vel(self, ids, Vel_desired):
+        return self.call("vel", motors=ids, v=Vel_desired)["failed"]
+
+    def read_motor_param(self, SlaveID, RID):
+        return self.call("read_param", motor=SlaveID, rid=int(RID))["value"]
+
+    def emergency_stop(self):
+        return self.call("estop")["failed"]
+
+    def clear_estop(self):
+        self.call("clear_estop")
+
+    def state(self):
+        """
+        latest motor states from shared memory, no request is sent 从共享内存读取最新的电机状态 不发送请求
+        :return: STATE_DTYPE array, one row per motor 每个电机一行
+        """
+        return self.segment.read()[0]
+
+    def close(self):
+        self.rfile.close()
+        self.sock.close()
+        self.segment.close()
+
+
+def as_list(x):
+    # numpy arrays and scalars in requests 请求中的numpy数组和标量
+    return np.asarray(x).tolist()
+
+
+def main():
+    import serial
+    parser = argparse.ArgumentParser(description="DM motor daemon 达妙电机守护进程")
+    parser.add_argument("--port", required=True, help="serial port 串口")
+    parser.add_argument("--baud", type=int, default=921600)
+    parser.add_argument("--motor", action="append", required=True, help="TYPE:SlaveID:MasterID, e.g. DM4310:0x01:0x11")
+    parser.add_argument("--socket", default=SOCKET_PATH)
+    parser.add_argument("--shm", default=SHM_NAME)
+    parser.add_argument("--poll", type=float, default=0.0, help="refresh idle motors every POLL seconds 空闲电机的刷新间隔")
+    args = parser.parse_args()
+
+    Motors = []
+    for spec in args.motor:
+        MotorType, SlaveID, MasterID = spec.split(":")
+        Motors.append(Motor(DM_Motor_Type[MotorType], int(SlaveID, 0), int(MasterID, 0)))
+    motor_control = MotorControl(serial.Serial(args.port, args.baud, timeout=0.5))
+    for m in Motors:
+        motor_control.addMotor(m)
+    daemon = MotorDaemon(motor_control, Motors, args.socket, args.shm, poll=args.poll)
+    try:
+        daemon.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,177 @@
+from time import sleep, monotonic
+from DM_CAN import Motor, DM_Motor_Type, DM_variable, param_data, is_in_ranges, uint8s_to_uint32, uint8s_to_float
+from DM_Codec import motor_types_for_limits
+
+
+class DiscoveredMotor:
+    def __init__(self, SlaveID):
+        """
+        a motor found on the bus 扫描到的电机
+        :param SlaveID: CANID 电机ID
+        """
+        self.SlaveID = SlaveID
+        self.MasterID = None
+        self.status = None  # feedback state/error code 反馈帧中的状态码
+        self.params = {}  # {RID: value}
+
+    def getParam(self, RID):
+        return self.params.get(RID)
+
+    def type_hints(self):
+        """
+        motor types whose default limits match PMAX/VMAX/TMAX 根据PMAX/VMAX/TMAX推测的电机类型
+        :return: list of DM_Motor_Type, empty if the limits were not read or match nothing
+        """
+        limits = [self.params.get(RID) for RID in (DM_variable.PMAX, DM_variable.VMAX, DM_variable.TMAX)]
+        if None in limits:
+            return []
+        return motor_types_for_limits(*limits)
+
+    def motor(self, MotorType=None):
+        """
+        create a Motor object for this motor 创建对应的电机对象
+        :param MotorType: Motor type, default the first type hint 电机类型 默认使用推测的第一个类型
+        """
+        if MotorType is None:
+            hints = self.type_hints()
+            MotorType = hints[0] if hints else DM_Motor_Type.DM4310
+        return Motor(MotorType, self.SlaveID, self.MasterID if self.MasterID is not None else 0)
+
+    def __repr__(self):
+        master = "?" if self.MasterID is None else f"0x{self.MasterID:02X}"
+        hints = ",".join(t.name for t in self.type_hints()) or "?"
+        return f"DiscoveredMotor(SlaveID=0x{self.SlaveID:02X}, MasterID={master}, SN={self.getParam(DM_variable.SN)}, type={hints})"
+
+
+class BusScanner:
+    PROBE_RIDS = (DM_variable.MST_ID, DM_variable.ESC_ID)
+    DETAIL_RIDS = (DM_variable.SN, DM_variable.PMAX, DM_variable.VMAX, DM_variable.TMAX)
+
+    def __init__(self, motor_control, frames_per_second=4000, chunk=16):
+        """
+        scan the bus for motors 扫描总线上的电机
+        :param motor_control: MotorControl object 电机控制对象
+        :param frames_per_second: send rate limit 发送速率上限 帧/秒
+        :param chunk: frames per serial write 每次串口写入的帧数
+        """
+        self.motor_control = motor_control
+        self.frames_per_second = frames_per_second
+        self.chunk = chunk
+        self.found = {}
+        self.feedback = []  # (MasterID, status/ID byte) of refresh replies 刷新状态的回复
+        self.unresolved = []  # MasterIDs that answered refresh from an unconfirmed SlaveID 回复了刷新状态但无法确认SlaveID
+
+    def __on_frame(self, CANID, CMD, data):
+        if CMD != 0x11:
+            return
+        slave = (data[1] << 8) | data[0]
+        if data[2] == 0x33 and slave in self.probing and data[3] in self.rids:
+            RID = data[3]
+            found = self.found.setdefault(slave, DiscoveredMotor(slave))
+            if is_in_ranges(RID):
+                found.params[RID] = uint8s_to_uint32(data[4], data[5], data[6], data[7])
+            else:
+                found.params[RID] = uint8s_to_float(data[4], data[5], data[6], data[7])
+            if RID == DM_variable.MST_ID:
+                found.MasterID = found.params[RID]
+        else:
+            self.feedback.append((CANID, data[0]))
+
+    def __sweep(self, can_ids, data, timeout):
+        period = self.chunk / float(self.frames_per_second)
+        next_send = monotonic()
+        for i in range(0, len(can_ids), self.chunk):
+            while monotonic() < next_send:
+                self.motor_control.recv_set_param_data()
+                sleep(0.0005)
+            self.motor_control.send_batch(can_ids[i:i + self.chunk], data[i:i + self.chunk])
+            next_send += period
+        deadline = monotonic() + timeout
+        while monotonic() < deadline:
+            self.motor_control.recv_set_param_data()
+            sleep(0.001)
+
+    def __confirm(self, SlaveID, MasterID, timeout):
+        # refresh a single ID and wait for the reply from MasterID 只刷新一个ID 等待MasterID的回复
+        self.feedback = []
+        self.motor_control.send_batch([0x7FF], [param_data(SlaveID, 0xCC)])
+        deadline = monotonic() + timeout
+        while monotonic() < deadline:
+            self.motor_control.recv_set_param_data()
+            if any(CANID == MasterID for CANID, _ in self.feedback):
+                return True
+            sleep(0.001)
+        return False
+
+    def scan(self, ids=range(0x01, 0x80), timeout=0.05, details=True):
+        """
+        find every motor in the ID range 扫描ID范围内的所有电机
+        phase 1 fires refresh (0xCC) and MST_ID/ESC_ID reads at every ID, phase 2 reads SN/PMAX/VMAX/TMAX
+        of the motors that answered 第一轮对每个ID发送刷新状态和MST_ID/ESC_ID读取，第二轮只读取有回复电机的SN/PMAX/VMAX/TMAX
+        a motor that only answers refresh is refreshed again one candidate ID at a time, the MasterIDs no single ID
+        confirmed are left in self.unresolved 只回复刷新状态的电机逐个候选ID再次刷新确认，无法确认的MasterID保存在self.unresolved
+        :param ids: CAN IDs to probe 需要扫描的ID
+        :param timeout: time to wait for late replies after each phase 每轮发送后等待回复的时间 单位秒
+        :param details: also read SN/PMAX/VMAX/TMAX 是否读取SN/PMAX/VMAX/TMAX
+        :return: list of DiscoveredMotor sorted by SlaveID
+        """
+        self.found = {}
+        self.feedback = []
+        self.unresolved = []
+        ids = list(ids)
+        self.probing = set(ids)
+        self.rids = set(self.PROBE_RIDS) | set(self.DETAIL_RIDS)
+        self.motor_control.frame_listeners.append(self.__on_frame)
+        try:
+            can_ids = []
+            data = []
+            for SlaveID in ids:
+                can_ids.append(0x7FF)
+                data.append(param_data(SlaveID, 0xCC))
+                for RID in self.PROBE_RIDS:
+                    can_ids.append(0x7FF)
+                    data.append(param_data(SlaveID, 0x33, RID))
+            self.__sweep(can_ids, data, timeout)
+
+            # firmware without register read still answers refresh, the low nibble of its byte 0 only narrows the
+            # SlaveID down 不支持读寄存器的旧固件只回复刷新状态 第0字节的低4位只能缩小SlaveID的范围
+            feedback = self.feedback
+            for MasterID, byte0 in feedback:
+                if any(found.MasterID == MasterID for found in self.found.values()) or MasterID in self.unresolved:
+                    continue
+                for SlaveID in ids:
+                    if (SlaveID & 0x0f) == (byte0 & 0x0f) and SlaveID not in self.found and \
+                            self.__confirm(SlaveID, MasterID, timeout):
+                        found = self.found.setdefault(SlaveID, DiscoveredMotor(SlaveID))
+                        found.MasterID = MasterID
+                        break
+                else:
+                    self.unresolved.append(MasterID)
+            for MasterID, byte0 in feedback:
+                for found in self.found.values():
+                    if found.MasterID == MasterID and (found.SlaveID & 0x0f) == (byte0 & 0x0f):
+                        found.status = byte0 >> 4
+
+            if details and self.found:
+                can_ids = []
+                data = []
+                for SlaveID in self.found:
+                    for RID in self.DETAIL_RIDS:
+                        can_ids.append(0x7FF)
+                        data.append(param_data(SlaveID, 0x33, RID))
+                self.__sweep(can_ids, data, timeout)
+        finally:
+            self.motor_control.frame_listeners.remove(self.__on_frame)
+        return [self.found[SlaveID] for SlaveID in sorted(self.found)]
+
+
+def discover(motor_control, ids=range(0x01, 0x80), timeout=0.05, frames_per_second=4000):
+    """
+    find every motor on the bus 扫描总线上的所有电机
+    :param motor_control: MotorControl object 电机控制对象
+    :param ids: CAN IDs to probe 需要扫描的ID
+    :param timeout: time to wait for late replies 等待回复的时间 单位秒
+    :param frames_per_second: send rate limit 发送速率上限 帧/秒
+    :return: list of DiscoveredMotor
+    """
+    return BusScanner(motor_control, frames_per_second).scan(ids, timeout)
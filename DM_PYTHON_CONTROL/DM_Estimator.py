@@ -0,0 +1,106 @@
+import numpy as np
+from DM_CAN import MotorControl
+
+
+class StateEstimator:
+    def __init__(self, Motors, alpha=0.5, beta=0.1, gamma=0.01, motor_control=None):
+        """
+        multi-turn position, velocity and acceleration of a motor group 电机组的多圈位置、速度和加速度估计
+        the feedback q covers one span of 2*PMAX and wraps, every new sample is unwrapped against the previous one and
+        counted in turns, then an alpha-beta-gamma filter runs on the timestamps of the feedback
+        反馈位置只覆盖2*PMAX的范围并会回绕，每个新样本与上一个样本比较后解回绕并计圈，再按反馈时间戳进行alpha-beta-gamma滤波
+        :param Motors: list of Motor objects 电机对象列表
+        :param alpha: position gain 位置增益
+        :param beta: velocity gain 速度增益
+        :param gamma: acceleration gain, 0 for a plain alpha-beta filter 加速度增益 为0时是alpha-beta滤波器
+        :param motor_control: MotorControl object, the estimator then updates after every decoded block of feedback
+        电机控制对象 设置后每解析完一批反馈就自动更新
+        """
+        self.Motors = list(Motors)
+        n = len(self.Motors)
+        self.alpha = np.broadcast_to(np.asarray(alpha, np.float64), (n,)).copy()
+        self.beta = np.broadcast_to(np.asarray(beta, np.float64), (n,)).copy()
+        self.gamma = np.broadcast_to(np.asarray(gamma, np.float64), (n,)).copy()
+        self.span = 2.0 * np.array([MotorControl.Limit_Param[Motor.MotorType][0] for Motor in self.Motors], np.float64)
+        self.raw = np.zeros(n)  # last wrapped feedback position 上次的反馈位置(回绕)
+        self.turns = np.zeros(n, np.int64)  # whole spans added to the feedback 累计的圈数(以2*PMAX为一圈)
+        self.q = np.zeros(n)  # filtered continuous position 滤波后的连续位置
+        self.dq = np.zeros(n)
+        self.ddq = np.zeros(n)
+        self.t = np.zeros(n)  # recv_time of the last sample used 上次使用的样本时间
+        self.seeded = np.zeros(n, bool)
+        self.updates = 0  # samples filtered 已处理的样本数
+        self.motor_control = None
+        if motor_control is not None:
+            self.attach(motor_control)
+
+    def attach(self, motor_control):
+        """
+        update after every block of feedback that motor_control decodes 每当motor_control解析完一批反馈就更新
+        """
+        self.detach()
+        self.motor_control = motor_control
+        motor_control.decode_listeners.append(self.update)
+
+    def detach(self):
+        if self.motor_control is not None:
+            self.motor_control.decode_listeners.remove(self.update)
+            self.motor_control = None
+
+    def reset(self, Motors=None, turns=0):
+        """
+        restart from the next sample, e.g. after set_zero_position 从下一个样本重新开始 例如设置零点之后
+        :param Motors: list of Motor objects, default all 电机对象列表 默认全部
+        :param turns: turn count to start from 起始圈数
+        """
+        idx = slice(None) if Motors is None else self.__index(Motors)
+        self.seeded[idx] = False
+        self.turns[idx] = turns
+
+    def __index(self, Motors):
+        position = {id(Motor): i for i, Motor in enumerate(self.Motors)}
+        return np.array([position[id(Motor)] for Motor in Motors], np.intp)
+
+    def update(self):
+        """
+        filter the feedback that arrived since the last call 处理上次调用之后收到的反馈
+        :return: number of motors with a new sample 有新样本的电机数
+        """
+        Motors = self.Motors
+        n = len(Motors)
+        t = np.fromiter((Motor.recv_time for Motor in Motors), np.float64, n)
+        new = t > self.t
+        count = int(np.count_nonzero(new))
+        if count == 0:
+            return 0
+        raw = np.fromiter((Motor.state_q for Motor in Motors), np.float64, n)
+        seed = new & ~self.seeded
+        step = new & self.seeded
+        # a jump of more than half a span is a wrap 跳变超过半圈就认为是回绕
+        wraps = np.rint((raw - self.raw) / self.span)
+        np.subtract(self.turns, wraps.astype(np.int64), out=self.turns, where=step)
+        np.copyto(self.raw, raw, where=new)
+        z = raw + self.turns * self.span
+
+        # whole-array arithmetic with masked stores is cheaper than gathering the updated motors 整个数组计算再按掩码写回
+        dt = np.where(step, t - self.t, 1.0)
+        q = self.q + (self.dq + 0.5 * self.ddq * dt) * dt
+        dq = self.dq + self.ddq * dt
+        r = z - q
+        np.copyto(self.q, q + self.alpha * r, where=step)
+        np.copyto(self.dq, dq + self.beta / dt * r, where=step)
+        np.copyto(self.ddq, self.ddq + 2.0 * self.gamma / (dt * dt) * r, where=step)
+        if seed.any():
+            np.copyto(self.q, z, where=seed)
+            np.copyto(self.dq, np.fromiter((Motor.state_dq for Motor in Motors), np.float64, n), where=seed)
+            self.ddq[seed] = 0.0
+            self.seeded |= seed
+        np.copyto(self.t, t, where=new)
+        self.updates += count
+        return count
+
+    def state(self):
+        """
+        :return: (q, dq, ddq) float64 arrays, q is continuous over turns 连续位置 速度 加速度
+        """
+        return self.q, self.dq, self.ddq
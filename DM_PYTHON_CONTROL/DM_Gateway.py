@@ -0,0 +1,456 @@
+"""
+UART gateway of the CtrBoard-H7 串口网关 (DM_STM32_CONTROL/dm_ctrl_h7, DM_GATEWAY_MODE)
+
+The host sends one packed frame per tick with the CAN frames of all motors, the board keeps the latest control frame
+of every motor and sends it over FDCAN at its own fixed rate, and streams back one frame per period with every CAN
+frame it received. One serial write and one read per tick instead of one 30/16 byte round trip per motor.
+主机每个周期发送一帧，里面是所有电机的CAN帧；板子保存每个电机最近的控制帧并按自己的固定频率发到FDCAN，每个周期把收到的
+所有CAN帧打包成一帧发回主机。每个周期一次串口写入和一次读取，不再是每个电机一次往返。
+
+Frame layout, little-endian, same in both directions 帧格式(小端) 两个方向相同:
+
+    [0] 0xA5 [1] 0x5A [2] type [3] seq [4] count [5] flags
+    host  [6:]  count entries of 10 bytes: CAN ID (u16) + data[8]
+    state [6:10] board tick (u32), [10:] count entries
+    the seq of a state frame is that of the host frame the board was forwarding when its entries were received,
+    every entry of a state frame belongs to the same host frame
+    状态帧的seq是收到这些CAN帧时板子正在转发的主机帧的序号 一帧状态帧中的CAN帧都属于同一个主机帧
+    last 2 bytes: CRC16-CCITT (init 0xFFFF) of everything from type to the last entry
+
+Control frames (MIT/POS_VEL/VEL/PSI) replace the slot of their motor and are resent every period, command frames
+(enable/disable/clear error/zero, first 7 bytes 0xFF) and register frames (0x7FF) go out once and a command frame
+releases the slot of its motor. The board releases every slot when no host frame arrived for host_timeout periods.
+控制帧替换该电机的槽位并每个周期重发；命令帧和参数帧(0x7FF)只发送一次，命令帧同时释放该电机的槽位。
+host_timeout个周期没有主机帧时板子释放所有槽位。
+
+    MotorControl1 = MotorControl(GatewayTransport(serial.Serial('/dev/ttyACM0', 921600, timeout=0)))
+
+GatewayEmulator runs the firmware logic on the host, on top of any CAN transport, e.g. a simulated fleet
+GatewayEmulator在主机上运行同样的网关逻辑，CAN端可以是任意传输层，例如仿真电机:
+
+    board = GatewayEmulator(SimTransport(SimFleet([DM_Motor_Type.DM4310] * 6, dt=0.002)), period=0.002)
+    MotorControl1 = MotorControl(GatewayTransport(board))
+"""
+import binascii
+import struct
+import time
+from time import monotonic, sleep
+import numpy as np
+from DM_Codec import RX_STALE
+
+MAGIC = b"\xA5\x5A"
+TYPE_FRAMES = 0x01  # host: a batch of CAN frames 主机: 一批CAN帧
+TYPE_RELEASE = 0x02  # host: release every slot 主机: 释放所有槽位
+TYPE_STATE = 0x81  # board: CAN frames received 板子: 收到的CAN帧
+FLAG_OVERFLOW = 0x01  # CAN frames dropped on the board 板子丢弃了CAN帧
+FLAG_TIMEOUT = 0x02  # host timeout, slots released 主机超时 槽位已释放
+FLAG_BAD_FRAME = 0x04  # host frame with a bad CRC 主机帧CRC错误
+FLAG_TX_FULL = 0x08  # FDCAN transmit queue full 发送队列满
+MAX_FRAMES = 32  # entries per frame, GW_MAX_FRAMES/GW_MAX_STATE of the firmware 每帧最多的CAN帧数
+ENTRY_SIZE = 10
+HEAD = struct.Struct("<2sBBBB")
+TICK = struct.Struct("<I")
+
+
+def crc16(data):
+    """
+    CRC16-CCITT with init 0xFFFF, gw_crc16 of the firmware 与固件gw_crc16相同
+    """
+    return binascii.crc_hqx(data, 0xFFFF)
+
+
+def frame_size(frame_type, count):
+    """
+    :return: bytes of a frame with count entries 包含count个条目的帧长
+    """
+    return HEAD.size + (TICK.size if frame_type == TYPE_STATE else 0) + ENTRY_SIZE * count + 2
+
+
+def pack_frame(frame_type, seq, can_ids=(), data=None, flags=0, tick=None):
+    """
+    build one gateway frame 打包一帧
+    :param frame_type: TYPE_FRAMES, TYPE_RELEASE or TYPE_STATE 帧类型
+    :param seq: sequence number, 0..255 序号
+    :param can_ids: CAN ID of every entry 每个条目的CAN ID
+    :param data: entry data, shape (n, 8) 每个条目的数据
+    :param flags: FLAG_* 标志
+    :param tick: board tick, TYPE_STATE only 板子的周期计数 只用于状态帧
+    :return: bytes
+    """
+    can_ids = np.asarray(can_ids, np.uint16).reshape(-1)
+    n = can_ids.shape[0]
+    if n > MAX_FRAMES:
+        raise ValueError("at most %d CAN frames per gateway frame, got %d" % (MAX_FRAMES, n))
+    entries = np.empty((n, ENTRY_SIZE), np.uint8)
+    entries[:, :2] = can_ids.astype("<u2").view(np.uint8).reshape(n, 2)
+    if n:
+        entries[:, 2:] = np.asarray(data, np.uint8).reshape(n, 8)
+    body = b"".join((HEAD.pack(MAGIC, frame_type, seq & 0xff, n, flags),
+                     TICK.pack(tick & 0xffffffff) if frame_type == TYPE_STATE else b"", entries.tobytes()))
+    return body + struct.pack("<H", crc16(body[2:]))
+
+
+class GatewayParser:
+    def __init__(self, frame_types):
+        """
+        split a byte stream into gateway frames 从字节流中切分网关帧
+        :param frame_types: frame types to accept, others are skipped 接收的帧类型 其他类型跳过
+        """
+        self.frame_types = frozenset(frame_types)
+        self.buf = bytearray()
+        self.bad_frames = 0  # bad CRC or count CRC或条目数错误
+        self.dropped_bytes = 0  # bytes skipped while looking for a frame header 寻找帧头时丢弃的字节数
+
+    def feed(self, data):
+        """
+        :param data: bytes read from the serial port 串口读到的数据
+        :return: list of (frame_type, seq, flags, tick, can_ids, data), tick is None for host frames,
+        can_ids is a uint16 array and data a (n, 8) uint8 array 主机帧的tick为None
+        """
+        buf = self.buf
+        buf += data
+        frames = []
+        pos = 0
+        while True:
+            start = buf.find(MAGIC, pos)
+            if start < 0:
+                # keep a trailing 0xA5, it may start the next header 保留末尾的0xA5 可能是下一个帧头
+                keep = len(buf) - 1 if buf.endswith(MAGIC[:1]) else len(buf)
+                self.dropped_bytes += keep - pos
+                pos = keep
+                break
+            self.dropped_bytes += start - pos
+            pos = start
+            if len(buf) - pos < HEAD.size:
+                break
+            _, frame_type, seq, count, flags = HEAD.unpack_from(buf, pos)
+            if frame_type not in self.frame_types or count > MAX_FRAMES:
+                self.bad_frames += frame_type in self.frame_types
+                self.dropped_bytes += 1
+                pos += 1
+                continue
+            size = frame_size(frame_type, count)
+            if len(buf) - pos < size:
+                break
+            end = pos + size
+            if struct.unpack_from("<H", buf, end - 2)[0] != crc16(buf[pos + 2:end - 2]):
+                self.bad_frames += 1
+                self.dropped_bytes += 1
+                pos += 1
+                continue
+            offset = pos + HEAD.size
+            tick = None
+            if frame_type == TYPE_STATE:
+                tick = TICK.unpack_from(buf, offset)[0]
+                offset += TICK.size
+            # copy out of the buffer, it is resized below 复制出来 缓冲区随后会被截断
+            entries = np.frombuffer(bytes(buf[offset:end - 2]), np.uint8).reshape(count, ENTRY_SIZE)
+            can_ids = entries[:, :2].copy().view("<u2").reshape(count)
+            frames.append((frame_type, seq, flags, tick, can_ids, entries[:, 2:]))
+            pos = end
+        del buf[:pos]
+        return frames
+
+
+class GatewayTransport:
+    def __init__(self, serial_device, release_on_close=True):
+        """
+        MotorControl transport for the CtrBoard-H7 gateway 串口网关的传输层
+        every send_frames call becomes one host frame, so a batched control call for all motors is one write
+        每次send_frames是一帧主机帧，所有电机的批量控制就是一次写入
+        :param serial_device: serial object, e.g. serial.Serial, DM_Transport.TermiosSerial or GatewayEmulator
+        串口对象 例如serial.Serial、DM_Transport.TermiosSerial或GatewayEmulator
+        :param release_on_close: stop the board sending setpoints when the transport closes 关闭时让板子停止转发
+        """
+        self.serial_ = serial_device
+        self.release_on_close = release_on_close
+        self.parser = GatewayParser((TYPE_STATE,))
+        self.seq = 0  # sequence number of the next host frame 下一帧主机帧的序号
+        self.acked_seq = None  # seq of the host frame of the last state frame 最近状态帧所属的主机帧序号
+        # seq of the last host frame with an enable/disable/clear error/zero command until a state frame of it or a
+        # later host frame arrives, None once one did; replies of earlier host frames are the resent slots
+        # 最近一个带有使能/失能/清除错误/保存零点命令的主机帧序号 收到属于它或之后主机帧的状态帧后为None
+        # 之前的主机帧的回复是重发槽位得到的
+        self.command_seq = None
+        self.board_tick = None  # tick of the last state frame 最近状态帧的周期计数
+        self.host_frames = 0  # counters 计数器
+        self.state_frames = 0
+        self.board_overflows = 0  # state frames with FLAG_OVERFLOW, and so on 带有对应标志的状态帧数
+        self.host_timeouts = 0
+        self.board_bad_frames = 0
+        self.board_tx_full = 0
+
+    @property
+    def bad_frames(self):
+        return self.parser.bad_frames
+
+    @property
+    def dropped_bytes(self):
+        return self.parser.dropped_bytes
+
+    def open(self):
+        if self.serial_.is_open:
+            self.serial_.close()
+        self.serial_.open()
+        self.parser.buf.clear()
+
+    def close(self):
+        if self.release_on_close and self.serial_.is_open:
+            self.release()
+        self.serial_.close()
+
+    def flush_output(self):
+        # drop host frames not written yet, the disable frames that follow release their slots on the board
+        # 丢弃还没有发出的主机帧 随后的失能帧会释放板子上对应的槽位
+        if hasattr(self.serial_, "reset_output_buffer"):
+            self.serial_.reset_output_buffer()
+
+    def release(self):
+        """
+        stop the board resending setpoints, the motors keep the last one until their CAN timeout
+        让板子停止重发控制帧 电机保持最后的指令直到自身的CAN超时
+        """
+        self.serial_.write(pack_frame(TYPE_RELEASE, self.seq))
+        self.seq = (self.seq + 1) & 0xff
+        self.host_frames += 1
+
+    def send_frames(self, can_ids, data):
+        """
+        send CAN frames as one host frame, more than MAX_FRAMES are split but still written at once
+        把CAN帧打包成一帧主机帧发送 超过MAX_FRAMES时分成多帧但仍然一次写入
+        :param can_ids: CAN ID of every frame 每一帧的CAN ID
+        :param data: frame data, shape (n, 8) 每一帧的数据
+        """
+        can_ids = np.asarray(can_ids, np.uint16).reshape(-1)
+        data = np.asarray(data, np.uint8).reshape(-1, 8)
+        command = (can_ids < 0x400) & (data[:, :7] == 0xff).all(1)
+        chunks = []
+        for start in range(0, can_ids.shape[0], MAX_FRAMES):
+            chunks.append(pack_frame(TYPE_FRAMES, self.seq, can_ids[start:start + MAX_FRAMES],
+                                     data[start:start + MAX_FRAMES]))
+            if command[start:start + MAX_FRAMES].any():
+                self.command_seq = self.seq
+            self.seq = (self.seq + 1) & 0xff
+        self.host_frames += len(chunks)
+        self.serial_.write(b"".join(chunks))
+
+    def recv_frames(self, expected=0, timeout=0.0):
+        """
+        CAN frames of the state frames received so far 目前收到的状态帧中的CAN帧
+        :param expected: wait until this many CAN frames have arrived 等待收到的帧数
+        :param timeout: longest wait 最长等待时间 单位秒
+        :return: list of (CANID, CMD, data, t), CMD is RX_STALE for frames received while the board was still
+        forwarding a host frame sent before the last command, t is time.time() of the read
+        板子还在转发最近命令之前的主机帧时收到的CAN帧CMD为RX_STALE 否则为0x11 t为读取时刻
+        """
+        frames = self.__read()
+        if expected > 0 and timeout > 0:
+            deadline = monotonic() + timeout
+            while len(frames) < expected and self.__wait(deadline):
+                frames += self.__read()
+        return frames
+
+    def __wait(self, deadline):
+        if hasattr(self.serial_, "wait_bytes"):
+            return self.serial_.wait_bytes(1, deadline)
+        while self.serial_.in_waiting == 0:
+            if monotonic() >= deadline:
+                return False
+            sleep(0.0001)
+        return True
+
+    def __read(self):
+        states = self.parser.feed(self.serial_.read_all())
+        t = time.time()
+        frames = []
+        for _, seq, flags, tick, can_ids, data in states:
+            self.state_frames += 1
+            cmd = 0x11
+            if self.command_seq is not None:
+                if (seq - self.command_seq) & 0xff < 0x80:  # seq at or after command_seq, mod 256 序号已到达 按256取模
+                    self.command_seq = None
+                else:
+                    cmd = RX_STALE
+            self.acked_seq = seq
+            self.board_tick = tick
+            self.board_overflows += bool(flags & FLAG_OVERFLOW)
+            self.host_timeouts += bool(flags & FLAG_TIMEOUT)
+            self.board_bad_frames += bool(flags & FLAG_BAD_FRAME)
+            self.board_tx_full += bool(flags & FLAG_TX_FULL)
+            raw = data.tobytes()
+            frames.extend((int(can_id), cmd, raw[8 * i:8 * i + 8], t) for i, can_id in enumerate(can_ids.tolist()))
+        return frames
+
+
+class GatewayEmulator:
+    def __init__(self, bus, period=0.002, realtime=True, host_timeout=50, slots=10, rx_fifo=64,
+                 max_state=MAX_FRAMES):
+        """
+        the gateway firmware running on the host, a serial-like object for GatewayTransport
+        在主机上运行的网关固件 可以作为串口对象传给GatewayTransport
+        :param bus: CAN side, any transport with send_frames/recv_frames, e.g. DM_Sim.SimTransport
+        CAN端 任何实现send_frames/recv_frames的传输层
+        :param period: gateway period, GW_TICK_DIV ms on the board 网关周期 单位秒
+        :param realtime: True runs the periods that are due by the wall clock on every call, False runs one period
+        per poll (read_all/in_waiting/wait_bytes) for deterministic tests
+        True时每次调用按实际时间运行到期的周期，False时每次查询运行一个周期 便于确定性测试
+        :param host_timeout: periods without a host frame before the slots are released 主机超时周期数
+        :param slots: motors the board can stream to, num of the firmware 槽位数
+        :param rx_fifo: CAN frames buffered for the host 等待上传的CAN帧数
+        :param max_state: CAN frames per state frame, GW_MAX_STATE 每帧状态帧最多的CAN帧数
+        """
+        self.bus = bus
+        self.period = period
+        self.realtime = realtime
+        self.host_timeout = host_timeout
+        self.rx_fifo = rx_fifo
+        self.max_state = max_state
+        self.parser = GatewayParser((TYPE_FRAMES, TYPE_RELEASE))
+        self.slot_id = np.zeros(slots, np.intp)  # motor ID of every slot, 0 free 每个槽位的电机ID 0表示空闲
+        self.slot_can_id = np.zeros(slots, np.intp)
+        self.slot_data = np.zeros((slots, 8), np.uint8)
+        self.active = np.zeros(slots, bool)
+        self.oneshot = []  # (CAN ID, data) sent once next period 下个周期只发送一次的帧
+        self.rx = []  # (CAN ID, data, seq on the bus) for the next state frames 等待上传的CAN帧和当时转发的主机帧序号
+        self.host_in = bytearray()
+        self.out = bytearray()
+        self.tick_count = 0
+        self.seq = 0
+        self.bus_seq = 0  # seq of the host frame last forwarded 最近一次转发的主机帧序号
+        self.flags = 0
+        self.host_age = 0
+        self.host_frames = 0  # counters, same as gw_stat 计数器 与固件gw_stat相同
+        self.rx_dropped = 0
+        self.skipped_ticks = 0  # periods not run because the caller fell behind 调用太慢而跳过的周期
+        self.is_open = False
+        self.next_tick = None
+
+    def open(self):
+        self.is_open = True
+        self.next_tick = monotonic()
+        self.host_in.clear()
+        self.out.clear()
+
+    def close(self):
+        self.is_open = False
+
+    def write(self, data):
+        self.host_in += data
+        if self.realtime:
+            self.__advance()
+
+    def reset_output_buffer(self):
+        self.host_in.clear()
+
+    @property
+    def in_waiting(self):
+        self.__advance()
+        return len(self.out)
+
+    def read_all(self):
+        self.__advance()
+        data = bytes(self.out)
+        self.out.clear()
+        return data
+
+    def wait_bytes(self, nbytes, deadline):
+        """
+        wait until nbytes of state frames are buffered or the deadline passes 等待直到缓冲了nbytes字节或超时
+        """
+        self.__advance()
+        while self.realtime and len(self.out) < nbytes:
+            remaining = min(deadline, self.next_tick) - monotonic()
+            if remaining > 0:
+                sleep(remaining)
+            if monotonic() >= deadline:
+                self.__advance()
+                break
+            self.__advance()
+        return len(self.out) >= nbytes
+
+    def __advance(self, max_ticks=100):
+        if not self.realtime:
+            self.tick()
+            return
+        due = int((monotonic() - self.next_tick) // self.period) + 1
+        if due <= 0:
+            return
+        if due > max_ticks:
+            self.skipped_ticks += due - max_ticks
+        for _ in range(min(due, max_ticks)):
+            self.tick()
+        self.next_tick += due * self.period
+
+    def tick(self):
+        """
+        one gateway period, dm_gateway_tick of the firmware 一个网关周期 对应固件的dm_gateway_tick
+        host frames -> host timeout -> state frame -> one-shot frames and every active slot
+        a state frame only carries frames received while the same host frame was forwarded
+        一帧状态帧只包含同一个主机帧转发期间收到的CAN帧
+        """
+        self.tick_count += 1
+        for frame_type, seq, _, _, can_ids, data in self.parser.feed(bytes(self.host_in)):
+            self.__apply(frame_type, seq, can_ids, data)
+        self.host_in.clear()
+        self.host_age += 1
+        if self.host_age > self.host_timeout and self.active.any():
+            self.active[:] = False
+            self.flags |= FLAG_TIMEOUT
+        if self.parser.bad_frames:
+            self.flags |= FLAG_BAD_FRAME
+            self.parser.bad_frames = 0
+        seq = self.rx[0][2] if self.rx else self.bus_seq
+        n = 0
+        while n < min(len(self.rx), self.max_state) and self.rx[n][2] == seq:
+            n += 1
+        sent, self.rx = self.rx[:n], self.rx[n:]
+        self.out += pack_frame(TYPE_STATE, seq, [can_id for can_id, _, _ in sent],
+                               [data for _, data, _ in sent], self.flags, self.tick_count)
+        self.flags = 0
+        self.bus_seq = self.seq
+        frames = self.oneshot + [(int(self.slot_can_id[i]), self.slot_data[i]) for i in np.flatnonzero(self.active)]
+        self.oneshot = []
+        if frames:
+            self.bus.send_frames([can_id for can_id, _ in frames], np.array([data for _, data in frames], np.uint8))
+        for can_id, _, data, _ in self.bus.recv_frames():
+            if len(self.rx) >= self.rx_fifo:
+                self.rx_dropped += 1
+                self.flags |= FLAG_OVERFLOW
+                continue
+            self.rx.append((can_id, np.frombuffer(bytes(data), np.uint8), self.bus_seq))
+
+    def __apply(self, frame_type, seq, can_ids, data):
+        self.seq = seq
+        self.host_age = 0
+        self.host_frames += 1
+        if frame_type == TYPE_RELEASE:
+            self.active[:] = False
+            self.oneshot = []
+            return
+        for can_id, row in zip(can_ids.tolist(), data):
+            slave = can_id & 0xff
+            command = bool((row[:7] == 0xff).all())
+            if can_id < 0x400 and slave and not command:
+                slot = self.__slot(slave, True)
+                if slot >= 0:
+                    self.slot_can_id[slot] = can_id
+                    self.slot_data[slot] = row
+                    self.active[slot] = True
+                    continue
+            elif can_id < 0x400 and slave:
+                slot = self.__slot(slave, False)
+                if slot >= 0:
+                    self.active[slot] = False
+            self.oneshot.append((can_id, row.copy()))
+
+    def __slot(self, slave, create):
+        hit = np.flatnonzero(self.slot_id == slave)
+        if hit.size:
+            return int(hit[0])
+        if not create:
+            return -1
+        free = np.flatnonzero(self.slot_id == 0)
+        if not free.size:
+            return -1
+        self.slot_id[free[0]] = slave
+        return int(free[0])
@@ -0,0 +1,97 @@
+import numpy as np
+from DM_CAN import MotorControl
+
+
+class ImpedanceController:
+    def __init__(self, motor_control, Motors, Kp, Kd, tau_max=None, estimator=None):
+        """
+        impedance control computed on the host, sent as torque-only MIT frames 在主机上计算的阻抗控制 以纯力矩MIT帧发送
+        tau = Kp (q* - q) + Kd (dq* - dq) + tau_ff, the motors get kp = kd = 0 and only the torque
+        电机收到的kp和kd为0 只执行计算出的力矩
+        :param motor_control: MotorControl object 电机控制对象
+        :param Motors: list of Motor objects, in MIT mode 电机对象列表 需要处于MIT模式
+        :param Kp: stiffness, scalar, one per motor or a full (n, n) matrix 刚度 标量、每个电机一个或(n, n)矩阵
+        :param Kd: damping, scalar, one per motor or a full (n, n) matrix 阻尼
+        :param tau_max: torque saturation, scalar or one per motor, default the TMAX of each motor type
+        力矩限幅 标量或每个电机一个 默认使用电机类型的TMAX
+        :param estimator: DM_Estimator.StateEstimator of the same motors, its q/dq are used instead of the raw
+        feedback 同一组电机的状态估计器 使用其位置和速度代替原始反馈
+        """
+        self.motor_control = motor_control
+        self.Motors = list(Motors)
+        n = len(self.Motors)
+        self.Kp = self.__gain(Kp, n)
+        self.Kd = self.__gain(Kd, n)
+        if tau_max is None:
+            tau_max = [MotorControl.Limit_Param[Motor.MotorType][2] for Motor in self.Motors]
+        self.tau_max = np.broadcast_to(np.asarray(tau_max, np.float64), (n,)).copy()
+        if estimator is not None and [id(Motor) for Motor in estimator.Motors] != [id(Motor) for Motor in self.Motors]:
+            raise ValueError("the estimator must cover the same motors in the same order")
+        self.estimator = estimator
+        self.tau = np.zeros(n)  # last torque sent 上次发送的力矩
+        self.zero = np.zeros(n)
+        self.saturated = np.zeros(n, np.int64)  # ticks the torque was clamped 力矩被限幅的次数
+
+    @staticmethod
+    def __gain(K, n):
+        # diagonal gains stay 1-D and are applied element-wise 对角增益保持一维 按元素相乘
+        K = np.asarray(K, np.float64)
+        if K.ndim == 2:
+            if K.shape != (n, n):
+                raise ValueError("gain matrix must be (%d, %d), not %r" % (n, n, K.shape))
+            if not np.any(K - np.diag(np.diagonal(K))):
+                return np.diagonal(K).copy()
+            return K.copy()
+        return np.broadcast_to(K, (n,)).copy()
+
+    def set_gains(self, Kp=None, Kd=None):
+        """
+        change the stiffness and damping, e.g. between contact phases 修改刚度和阻尼
+        """
+        n = len(self.Motors)
+        if Kp is not None:
+            self.Kp = self.__gain(Kp, n)
+        if Kd is not None:
+            self.Kd = self.__gain(Kd, n)
+
+    def state(self):
+        """
+        :return: (q, dq) used by the control law 控制律使用的位置和速度
+        """
+        if self.estimator is not None:
+            return self.estimator.q, self.estimator.dq
+        n = len(self.Motors)
+        return (np.fromiter((Motor.state_q for Motor in self.Motors), np.float64, n),
+                np.fromiter((Motor.state_dq for Motor in self.Motors), np.float64, n))
+
+    def compute(self, q_des, dq_des=0.0, tau_ff=0.0, q=None, dq=None):
+        """
+        torque of the control law, saturated 计算控制律的力矩(已限幅)
+        :param q_des: desired position, scalar or one per motor 期望位置 标量或每个电机一个
+        :param dq_des: desired velocity 期望速度
+        :param tau_ff: feed-forward torque, e.g. gravity compensation 前馈力矩 例如重力补偿
+        :param q: measured position, default from state() 实测位置 默认由state()获得
+        :param dq: measured velocity 实测速度
+        :return: float64 array of torques 力矩数组
+        """
+        if q is None or dq is None:
+            q_state, dq_state = self.state()
+            q = q_state if q is None else q
+            dq = dq_state if dq is None else dq
+        e = np.subtract(q_des, q)
+        de = np.subtract(dq_des, dq)
+        tau = (self.Kp @ e if self.Kp.ndim == 2 else self.Kp * e) + \
+              (self.Kd @ de if self.Kd.ndim == 2 else self.Kd * de) + tau_ff
+        clamped = np.minimum(np.maximum(tau, -self.tau_max), self.tau_max)
+        self.saturated += clamped != tau
+        return clamped
+
+    def step(self, q_des, dq_des=0.0, tau_ff=0.0, q=None, dq=None, timeout=None):
+        """
+        one control tick: compute the torque and send it 一个控制周期 计算并发送力矩
+        arguments as in compute 参数与compute相同
+        :param timeout: wait for the replies, default reply_timeout 等待反馈的时间 默认reply_timeout
+        :return: list of Motor objects that missed the reply 没有按时回复的电机
+        """
+        self.tau = self.compute(q_des, dq_des, tau_ff, q, dq)
+        return self.motor_control.controlMIT_batch(self.Motors, 0, 0, self.zero, self.zero, self.tau, timeout)
@@ -0,0 +1,224 @@
+"""
+metrics exporter 运行指标导出
+
+Snapshots the counters of a running MotorControl and the state of its motors into the Prometheus text format,
+served over HTTP or written to a file for the node_exporter textfile collector. 定期把MotorControl的计数器和电机状态
+转换为Prometheus文本格式，通过HTTP提供或写入文件(node_exporter的textfile采集器)。
+
+The control thread only increments plain integer counters, the exporter thread reads them, no locks are taken.
+控制线程只对整数计数器加一，导出线程直接读取，不使用锁。
+
+    exporter = MetricsExporter(MotorControl1, period=1.0)
+    exporter.start_http(9108)               # curl http://127.0.0.1:9108/metrics
+    loop = LoopStats(0.001)
+    exporter.add_loop("control", loop)
+    while True:
+        ...
+        loop.tick()
+"""
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from time import monotonic
+
+
+class LoopStats:
+    def __init__(self, period):
+        """
+        period and overrun counters of a control loop 控制循环的周期和超时计数
+        :param period: expected loop period 期望的循环周期 单位秒
+        """
+        self.period = period
+        self.ticks = 0
+        self.overruns = 0  # ticks longer than the period 超过周期的次数
+        self.last = None
+        self.max_period = 0.0  # longest tick since the last snapshot 上次导出以来最长的周期
+
+    def tick(self):
+        """
+        call once per loop iteration 每次循环调用一次
+        """
+        now = monotonic()
+        if self.last is not None:
+            dt = now - self.last
+            if dt > self.max_period:
+                self.max_period = dt
+            if dt > self.period:
+                self.overruns += 1
+        self.last = now
+        self.ticks += 1
+
+
+class MetricsExporter:
+    def __init__(self, motor_control, Motors=None, period=1.0):
+        """
+        :param motor_control: MotorControl object 电机控制对象
+        :param Motors: list of Motor objects, default every added motor 电机对象列表 默认所有已添加的电机
+        :param period: snapshot period 导出周期 单位秒
+        """
+        self.motor_control = motor_control
+        self.Motors = Motors
+        self.period = period
+        self.loops = {}
+        self.extra = []  # (name, kind, help, fn) 额外的指标
+        self.text = ""
+        self.path = None
+        self.server = None
+        self.stopped = threading.Event()
+        self.thread = None
+
+    def add_loop(self, name, loop):
+        """
+        export a LoopStats, or any object with ticks and overruns (e.g. TrajectoryStreamer.overruns) 导出循环统计
+        """
+        self.loops[name] = loop
+
+    def add_metric(self, name, kind, help, fn):
+        """
+        export the value returned by fn 导出fn返回的值
+        :param kind: "counter" or "gauge"
+        """
+        self.extra.append((name, kind, help, fn))
+
+    def render(self):
+        """
+        :return: metrics in the Prometheus text format Prometheus文本格式的指标
+        """
+        mc = self.motor_control
+        if self.Motors is None:
+            Motors = list({id(Motor): Motor for Motor in list(mc.motors_map.values())}.values())
+        else:
+            Motors = self.Motors
+        out = []
+
+        def metric(name, kind, help, samples):
+            out.append("# HELP %s %s" % (name, help))
+            out.append("# TYPE %s %s" % (name, kind))
+            for labels, value in samples:
+                label = ",".join('%s="%s"' % item for item in labels.items())
+                out.append("%s{%s} %s" % (name, label, format_value(value)) if label else
+                           "%s %s" % (name, format_value(value)))
+
+        metric("dm_frames_sent_total", "counter", "CAN frames sent", [({}, mc.frames_sent)])
+        metric("dm_frames_received_total", "counter", "CAN frames received", [({}, mc.frames_received)])
+        metric("dm_decode_errors_total", "counter", "feedback frames that match no motor", [({}, mc.decode_errors)])
+        if hasattr(mc.transport, "dropped_bytes"):
+            metric("dm_dropped_bytes_total", "counter", "serial bytes skipped while looking for a frame header",
+                   [({}, mc.transport.dropped_bytes)])
+        metric("dm_estop", "gauge", "1 while the emergency stop is active", [({}, mc.estop)])
+
+        now = time.time()
+        motors = [{"slave_id": "0x%02X" % Motor.SlaveID, "master_id": "0x%02X" % Motor.MasterID} for Motor in Motors]
+        for name, kind, help, fn in (
+                ("dm_motor_missed_replies_total", "counter", "commands whose feedback did not arrive in time",
+                 lambda Motor: Motor.missed_replies),
+                ("dm_motor_feedback_age_seconds", "gauge", "time since the last feedback",
+                 lambda Motor: now - Motor.recv_time if Motor.recv_time else float("inf")),
+                ("dm_motor_status", "gauge", "state/error code of the last feedback", lambda Motor: Motor.status),
+                ("dm_motor_enabled", "gauge", "1 if the last feedback reported enabled", lambda Motor: Motor.isEnable),
+                ("dm_motor_temperature_mos_celsius", "gauge", "MOS temperature", lambda Motor: Motor.temp_mos),
+                ("dm_motor_temperature_rotor_celsius", "gauge", "rotor temperature", lambda Motor: Motor.temp_rotor),
+                ("dm_motor_position_rad", "gauge", "position", lambda Motor: Motor.state_q),
+                ("dm_motor_velocity_rad_per_second", "gauge", "velocity", lambda Motor: Motor.state_dq),
+                ("dm_motor_torque_nm", "gauge", "torque", lambda Motor: Motor.state_tau)):
+            metric(name, kind, help, [(labels, fn(Motor)) for labels, Motor in zip(motors, Motors)])
+
+        limiter = mc.limiter
+        if limiter is not None and hasattr(limiter, "saturated"):
+            for name, counts in (("dm_limiter_saturated_total", limiter.saturated),
+                                 ("dm_limiter_slewed_total", limiter.slewed)):
+                samples = []
+                for i, Motor in enumerate(limiter.Motors):
+                    for j, field in enumerate(("q", "dq", "tau")):
+                        samples.append(({"slave_id": "0x%02X" % Motor.SlaveID, "field": field}, counts[j, i]))
+                metric(name, "counter", "setpoints changed by the command limiter", samples)
+
+        if self.loops:
+            metric("dm_loop_ticks_total", "counter", "control loop iterations",
+                   [({"loop": name}, getattr(loop, "ticks", 0)) for name, loop in self.loops.items()])
+            metric("dm_loop_overruns_total", "counter", "control loop iterations that missed their period",
+                   [({"loop": name}, loop.overruns) for name, loop in self.loops.items()])
+            samples = []
+            for name, loop in self.loops.items():
+                if hasattr(loop, "max_period"):
+                    # 读取后重新开始统计
+                    samples.append(({"loop": name}, loop.max_period))
+                    loop.max_period = 0.0
+            if samples:
+                metric("dm_loop_max_period_seconds", "gauge", "longest loop period since the last snapshot", samples)
+
+        for name, kind, help, fn in self.extra:
+            metric(name, kind, help, [({}, fn())])
+        return "\n".join(out) + "\n"
+
+    def snapshot(self):
+        self.text = self.render()
+        if self.path is not None:
+            # write then rename so readers never see a partial file 先写临时文件再改名 避免读到不完整的文件
+            tmp = self.path + ".tmp"
+            with open(tmp, "w") as f:
+                f.write(self.text)
+            os.replace(tmp, self.path)
+
+    def __run(self):
+        while not self.stopped.wait(self.period):
+            self.snapshot()
+
+    def start(self):
+        if self.thread is None:
+            self.snapshot()
+            self.thread = threading.Thread(target=self.__run, daemon=True)
+            self.thread.start()
+
+    def start_http(self, port=9108, host="127.0.0.1"):
+        """
+        serve the metrics at http://host:port/metrics 通过HTTP提供指标
+        """
+        exporter = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split("?")[0] not in ("/metrics", "/"):
+                    self.send_error(404)
+                    return
+                body = exporter.text.encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = ThreadingHTTPServer((host, port), Handler)
+        self.server.daemon_threads = True
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.start()
+
+    def start_file(self, path):
+        """
+        write the metrics to a file every period 每个周期把指标写入文件
+        """
+        self.path = path
+        self.start()
+
+    def stop(self):
+        self.stopped.set()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+            self.server = None
+
+
+def format_value(value):
+    value = float(value)
+    if value != value:
+        return "NaN"
+    if value in (float("inf"), float("-inf")):
+        return "+Inf" if value > 0 else "-Inf"
+    return repr(value)
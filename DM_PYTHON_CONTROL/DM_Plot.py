@@ -0,0 +1,217 @@
+import time
+import tkinter as tk
+import numpy as np
+
+
+class RingBuffer:
+    def __init__(self, capacity, channels):
+        """
+        fixed-size sample history 固定长度的环形缓冲区，每个通道一行
+        :param capacity: number of samples kept 保存的采样点数
+        :param channels: number of channels 通道数
+        """
+        self.capacity = int(capacity)
+        self.channels = int(channels)
+        self.t = np.zeros(self.capacity, np.float64)
+        self.data = np.zeros((self.channels, self.capacity), np.float32)
+        self.total = 0  # samples pushed since creation 累计写入的点数
+
+    def push(self, t, values):
+        """
+        append one sample of every channel 追加一个采样点
+        :param t: timestamp 时间戳 单位秒
+        :param values: one value per channel 每个通道一个值
+        """
+        i = self.total % self.capacity
+        self.t[i] = t
+        self.data[:, i] = values
+        self.total += 1
+
+    def extend(self, t, values):
+        """
+        append a block of samples 批量追加采样点
+        :param t: timestamps shape (n,) 时间戳
+        :param values: samples shape (channels, n) 采样数据
+        """
+        t = np.asarray(t, np.float64)
+        values = np.asarray(values, np.float32).reshape(self.channels, -1)
+        n = t.shape[0]
+        if n > self.capacity:
+            t = t[-self.capacity:]
+            values = values[:, -self.capacity:]
+            self.total += n - self.capacity
+            n = self.capacity
+        idx = (self.total + np.arange(n)) % self.capacity
+        self.t[idx] = t
+        self.data[:, idx] = values
+        self.total += n
+
+    def since(self, total):
+        """
+        samples pushed after the given counter value, oldest first 返回某个计数之后写入的数据
+        :param total: value of self.total at the previous read 上次读取时的total
+        :return: (t, data) copies in time order 按时间排序的数据
+        """
+        n = min(self.total - total, self.total, self.capacity)
+        if n <= 0:
+            return self.t[:0].copy(), self.data[:, :0].copy()
+        idx = (self.total - n + np.arange(n)) % self.capacity
+        return self.t[idx], self.data[:, idx]
+
+
+class MinMaxDecimator:
+    def __init__(self, channels, width, span):
+        """
+        min/max per pixel column 按像素列求最大最小值的抽取器
+        columns are keyed by absolute time so new samples only touch the last few columns
+        列按绝对时间编号，新数据只会更新最后几列
+        :param channels: number of channels 通道数
+        :param width: number of pixel columns 像素列数
+        :param span: visible time window 显示的时间窗口 单位秒
+        """
+        self.channels = channels
+        self.resize(width, span)
+
+    def resize(self, width, span):
+        self.width = max(int(width), 2)
+        self.span = float(span)
+        self.dt = self.span / self.width
+        self.col = np.full(self.width, -1, np.int64)
+        self.lo = np.full((self.channels, self.width), np.nan, np.float32)
+        self.hi = np.full((self.channels, self.width), np.nan, np.float32)
+
+    def add(self, t, data):
+        """
+        fold new samples into the column cache 把新的采样点合并进列缓存
+        :param t: timestamps in time order 按时间排序的时间戳
+        :param data: samples shape (channels, n) 采样数据
+        """
+        if t.shape[0] == 0:
+            return
+        keep = t > t[-1] - self.span
+        t = t[keep]
+        data = data[:, keep]
+        cols = np.floor(t / self.dt).astype(np.int64)
+        starts = np.flatnonzero(np.r_[True, cols[1:] != cols[:-1]])
+        ucols = cols[starts]
+        lo = np.minimum.reduceat(data, starts, axis=1)
+        hi = np.maximum.reduceat(data, starts, axis=1)
+        slot = ucols % self.width
+        same = self.col[slot] == ucols
+        self.lo[:, slot] = np.where(same, np.fmin(self.lo[:, slot], lo), lo)
+        self.hi[:, slot] = np.where(same, np.fmax(self.hi[:, slot], hi), hi)
+        self.col[slot] = ucols
+
+    def columns(self):
+        """
+        visible columns ordered left to right 按从左到右排序的可见列
+        :return: (x, lo, hi) x is the pixel column x为像素列
+        """
+        last = self.col.max()
+        valid = (self.col >= 0) & (self.col > last - self.width)
+        x = self.width - 1 - (last - self.col[valid])
+        order = np.argsort(x)
+        return x[order], self.lo[:, valid][:, order], self.hi[:, valid][:, order]
+
+
+class MotorPlotPanel(tk.Frame):
+    COLORS = ["#1f77b4", "#d62728", "#2ca02c", "#ff7f0e", "#9467bd", "#8c564b", "#e377c2", "#17becf"]
+
+    def __init__(self, master, channels, span=5.0, capacity=20000, max_fps=30, height=200, **kwargs):
+        """
+        live plot for motor feedback 电机反馈实时曲线面板
+        samples are kept in a RingBuffer and decimated to one min/max pair per pixel column,
+        so drawing cost depends on the canvas width and not on the sample rate
+        数据保存在环形缓冲区中，按像素列抽取最大最小值后绘制，绘制开销只和画布宽度有关
+        :param master: Tk parent 父控件
+        :param channels: list of channel names 通道名称列表
+        :param span: visible time window 显示的时间窗口 单位秒
+        :param capacity: samples kept per channel 每个通道保存的点数
+        :param max_fps: redraw rate cap 最大刷新帧率
+        :param height: canvas height 画布高度
+        """
+        super().__init__(master, **kwargs)
+        self.names = list(channels)
+        self.span = span
+        self.period_ms = max(int(1000 / max_fps), 1)
+        self.history = RingBuffer(capacity, len(self.names))
+        self.read_total = 0
+        self.t0 = time.time()
+
+        self.canvas = tk.Canvas(self, height=height, bg="white", highlightthickness=0)
+        self.canvas.pack(fill="both", expand=True)
+        self.decimator = MinMaxDecimator(len(self.names), max(self.canvas.winfo_reqwidth(), 2), span)
+        self.lines = []
+        for i, name in enumerate(self.names):
+            color = self.COLORS[i % len(self.COLORS)]
+            self.lines.append(self.canvas.create_line(0, 0, 0, 0, fill=color))
+            self.canvas.create_text(6, 6 + 14 * i, text=name, fill=color, anchor="nw", font=("Arial", 9))
+        self.axis_text = self.canvas.create_text(0, 6, text="", anchor="ne", font=("Arial", 9))
+        self.after_id = None
+        self.canvas.bind("<Configure>", self.__on_resize)
+
+    def push(self, values, t=None):
+        """
+        add one sample of every channel 添加一个采样点
+        :param values: one value per channel 每个通道一个值
+        :param t: timestamp, default time.time() 时间戳 默认当前时间
+        """
+        self.history.push((time.time() if t is None else t) - self.t0, values)
+
+    def start(self):
+        """
+        start the periodic redraw 开始周期刷新
+        """
+        if self.after_id is None:
+            self.after_id = self.after(self.period_ms, self.__redraw)
+
+    def stop(self):
+        """
+        stop the periodic redraw 停止周期刷新
+        """
+        if self.after_id is not None:
+            self.after_cancel(self.after_id)
+            self.after_id = None
+
+    def __on_resize(self, event):
+        # 宽度变化后列缓存失效，从历史数据重建
+        if event.width != self.decimator.width:
+            self.decimator.resize(event.width, self.span)
+            self.read_total = 0
+
+    def __redraw(self):
+        self.after_id = self.after(self.period_ms, self.__redraw)
+        if self.history.total == self.read_total:
+            return  # nothing new, keep the last frame
+        t, data = self.history.since(self.read_total)
+        self.read_total = self.history.total
+        self.decimator.add(t, data)
+
+        x, lo, hi = self.decimator.columns()
+        if x.shape[0] < 2:
+            return
+        y_min = float(np.nanmin(lo))
+        y_max = float(np.nanmax(hi))
+        if y_max - y_min < 1e-6:
+            y_min -= 1.0
+            y_max += 1.0
+        margin = 0.1 * (y_max - y_min)
+        y_min -= margin
+        y_max += margin
+        h = max(self.canvas.winfo_height(), 2)
+        scale = (h - 1) / (y_max - y_min)
+
+        xs = np.repeat(x, 2).astype(np.float32)
+        for i, item in enumerate(self.lines):
+            ys = np.empty(2 * x.shape[0], np.float32)
+            ys[0::2] = (y_max - lo[i]) * scale
+            ys[1::2] = (y_max - hi[i]) * scale
+            ok = ~np.isnan(ys)
+            if np.count_nonzero(ok) < 4:
+                continue
+            coords = np.empty((np.count_nonzero(ok), 2), np.float32)
+            coords[:, 0] = xs[ok]
+            coords[:, 1] = ys[ok]
+            self.canvas.coords(item, *coords.ravel().tolist())
+        self.canvas.coords(self.axis_text, self.decimator.width - 6, 6)
+        self.canvas.itemconfig(self.axis_text, text=f"{y_min:.2f} ~ {y_max:.2f}")
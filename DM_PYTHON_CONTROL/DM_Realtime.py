@@ -0,0 +1,500 @@
+"""
+allocation-free control loop 无内存分配的控制循环
+
+The batch control calls of MotorControl build new arrays, bytes and tuples on every tick. That is cheap on average,
+but the garbage collector runs every few hundred ticks and stalls the loop for milliseconds. RealtimeLoop encodes the
+commands into a preallocated transmit buffer, reads the replies into a preallocated receive buffer and decodes them in
+place. In steady state a tick creates no arrays, bytes or containers, the only objects left are the byte counts
+above 256 returned by write/readinto, plain ints that the collector does not track. gc_paused() freezes everything
+allocated during setup and turns the collector off, AllocationAudit counts the allocations of every tick with
+tracemalloc to check it. MotorControl的批量控制函数每个周期都会创建新的数组、bytes和元组，平均开销不大，但每几百个周期就会
+触发一次垃圾回收，使循环停顿数毫秒。RealtimeLoop把指令编码到预先分配的发送缓冲区，把回复读到预先分配的接收缓冲区并原地解析，
+稳定运行时每个周期不创建数组、bytes和容器，只剩下write/readinto返回的大于256的字节数(垃圾回收不跟踪的整数)。gc_paused()
+冻结初始化期间分配的对象并关闭垃圾回收，AllocationAudit用tracemalloc统计每个周期的内存分配来验证。
+
+only DM_Transport.TermiosSerial is read and written without allocating, pyserial works but allocates in read/write
+只有DM_Transport.TermiosSerial的读写不分配内存，pyserial也可以使用但读写时会分配
+"""
+import gc
+import io
+import select
+import time
+import tracemalloc
+from contextlib import contextmanager
+from time import monotonic
+import numpy as np
+from DM_CAN import MotorControl, SerialTransport, Control_Type, DM_Motor_State
+
+
+class RealtimeLoop:
+    # constants as 0-d arrays of the operand dtype, a Python scalar would be converted on every call
+    # 常量使用与操作数相同类型的0维数组 Python标量每次调用都会被转换
+    HEAD = np.array(0xAA, np.uint8)
+    TAIL = np.array(0x55, np.uint8)
+    FEEDBACK = np.array(0x11, np.uint8)
+    SHIFT4 = np.array(4, np.uint16)
+    MASK12 = np.array(0xfff, np.uint16)
+    ID_LIMIT = 0x800  # MasterIDs are standard 11 bit CAN IDs 标准11位CAN ID
+    KEY_LIMIT = np.array(ID_LIMIT, np.uint32)
+
+    def __init__(self, motor_control, Motors, mode=Control_Type.MIT, timeout=0.001, spin=True, slots=None):
+        """
+        control a motor group without allocating 不分配内存地控制一组电机
+        write the setpoints into the command arrays (np.copyto or ufuncs with out=), then call step()
+        把期望值写入指令数组(使用np.copyto或带out=的ufunc)，再调用step()
+        MIT: kp kd q_des dq_des tau_des, POS_VEL: q_des dq_des(float32), VEL: dq_des(float32)
+        the feedback is in q dq tau status temp_mos temp_rotor recv_time, fresh marks the motors that replied this
+        tick, call publish() to copy it to the Motor objects 反馈在q dq tau status temp_mos temp_rotor recv_time中，
+        fresh标记本周期回复的电机，调用publish()复制到电机对象
+        MotorControl.limiter, frame_listeners and decode_listeners are not run by step()
+        step()不运行MotorControl.limiter、frame_listeners和decode_listeners
+        :param motor_control: MotorControl object on the USB-CAN serial transport 使用USB转CAN串口的电机控制对象
+        :param Motors: list of Motor objects, every MasterID set and different 电机对象列表 MasterID必须设置且互不相同
+        :param mode: Control_Type.MIT, POS_VEL or VEL 控制模式
+        :param timeout: longest wait for the replies in step() 等待反馈的最长时间 单位秒
+        :param spin: busy-wait for the replies, otherwise sleep in poll which allocates a little
+        忙等反馈 否则在poll中休眠(会有少量分配)
+        :param slots: reply frames the receive buffer holds, default twice the number of motors 接收缓冲区的帧数
+        """
+        if not isinstance(motor_control.transport, SerialTransport):
+            raise TypeError("RealtimeLoop needs the DM USB-CAN serial transport")
+        self.motor_control = motor_control
+        self.Motors = list(Motors)
+        n = len(self.Motors)
+        master_ids = [Motor.MasterID for Motor in self.Motors]
+        if any(i <= 0 or i >= self.ID_LIMIT for i in master_ids) or len(set(master_ids)) != n:
+            raise ValueError("every motor needs its own MasterID between 0x001 and 0x7FF")
+        self.mode = mode
+        self.timeout = timeout
+        self.spin = spin
+        self.device = motor_control.transport.serial_
+        # TermiosSerial: the tty is read and written through a FileIO, whose readinto/write take the buffer without
+        # copying and return None instead of raising when the non-blocking tty is not ready
+        # 通过FileIO直接读写串口 readinto/write不复制缓冲区 非阻塞串口没有就绪时返回None而不抛出异常
+        fd = getattr(self.device, "fd", None)
+        self.file = None if fd is None else io.FileIO(fd, "r+", closefd=False)
+        self.poller = None
+        if fd is not None and not spin:
+            self.poller = select.poll()
+            self.poller.register(fd, select.POLLIN)
+
+        # transmit buffer, the headers and CAN IDs are written once 发送缓冲区 帧头和CAN ID只写一次
+        self.tx = bytearray(30 * n)
+        self.tx_size = len(self.tx)
+        frames = np.frombuffer(self.tx, np.uint8).reshape(n, 30)
+        frames[:] = MotorControl.send_data_frame
+        if mode == Control_Type.MIT:
+            base = 0x000
+        elif mode == Control_Type.POS_VEL:
+            base = 0x100
+        elif mode == Control_Type.VEL:
+            base = 0x200
+        else:
+            raise ValueError("RealtimeLoop supports MIT, POS_VEL and VEL, not %r" % mode)
+        can_ids = np.array([base + Motor.SlaveID for Motor in self.Motors], np.uint32)
+        frames[:, 13] = can_ids & 0xff
+        frames[:, 14] = (can_ids >> 8) & 0xff
+        limits = motor_control.limit_array(self.Motors)
+        if mode == Control_Type.MIT:
+            # rows kp kd q dq tau, packed as q<<48 | dq<<36 | kp<<24 | kd<<12 | tau like DM_CAN.pack_mit
+            # 按行存放kp kd q dq tau 与DM_CAN.pack_mit的打包方式相同
+            zero = np.zeros(n)
+            self.cmd_min = np.stack((zero, zero, -limits[:, 0], -limits[:, 1], -limits[:, 2]))
+            cmd_max = np.stack((zero + 500, zero + 5, limits[:, 0], limits[:, 1], limits[:, 2]))
+            bits = np.array([12, 12, 16, 12, 12])[:, None]
+            self.cmd_scale = ((1 << bits) - 1) / (cmd_max - self.cmd_min)
+            self.cmd_max = cmd_max
+            self.cmd = np.zeros((5, n))
+            self.kp, self.kd, self.q_des, self.dq_des, self.tau_des = self.cmd
+            self.cmd_work = np.empty((5, n))
+            self.cmd_fields = np.empty((5, n), np.uint64)
+            self.cmd_field_rows = list(self.cmd_fields)
+            # full shape, a broadcast operand makes the ufunc allocate a buffer 使用完整形状 广播会使ufunc分配缓冲区
+            self.cmd_shift = np.repeat(np.array([24, 12, 48, 36, 0], np.uint64)[:, None], n, 1)
+            self.cmd_word = np.empty(n, np.uint64)
+            self.tx_word = np.ndarray((n,), ">u8", self.tx, 21, (30,))
+        else:
+            # float32 setpoints are written straight into the frames 浮点期望值直接写在帧里
+            if mode == Control_Type.POS_VEL:
+                self.q_des = np.ndarray((n,), "<f4", self.tx, 21, (30,))
+            self.dq_des = np.ndarray((n,), "<f4", self.tx, 25 if mode == Control_Type.POS_VEL else 21, (30,))
+
+        # receive buffer, one 16 byte reply per slot 接收缓冲区 每个槽位一个16字节回复帧
+        k = 2 * n if slots is None else max(slots, n)
+        self.slots = k
+        self.rx = bytearray(16 * k)
+        self.rx_size = len(self.rx)
+        rx = np.frombuffer(self.rx, np.uint8).reshape(k, 16)
+        self.rx_frames = rx
+        self.rx_head = rx[:, 0]
+        self.rx_head_rest = rx[1:, 0]
+        self.rx_tail = rx[:, 15]
+        self.rx_cmd = rx[:, 1]
+        self.rx_canid = np.ndarray((k,), "<u4", self.rx, 3, (16,))
+        # data[0] status, data[1:3] q, data[3:5] dq, data[4:6] tau, data[6] T_MOS, data[7] T_Rotor
+        self.rx_fields = (rx[:, 7], np.ndarray((k,), ">u2", self.rx, 8, (16,)),
+                          np.ndarray((k,), ">u2", self.rx, 10, (16,)), np.ndarray((k,), ">u2", self.rx, 11, (16,)),
+                          rx[:, 13], rx[:, 14])
+        view = memoryview(self.rx)
+        self.rx_tails = [view[i:] for i in range(16 * k)]  # one view per fill level, slicing would allocate 每个位置一个视图
+        self.fill = 0
+        self.reply_size = 16 * n
+
+        # decode work arrays, every motor array has one extra trash entry for frames that match no motor
+        # 解析用的数组 每个电机数组多一个位置用来存放找不到电机的帧
+        self.framed = np.zeros(k, bool)
+        self.valid = np.zeros(k, bool)
+        self.invalid = np.zeros(k, bool)
+        self.key = np.zeros(k, np.uint32)
+        self.key_index = np.zeros(k, np.intp)
+        self.idx = np.zeros(k, np.intp)
+        self.trash = np.full(k, n, np.intp)
+        self.slot = np.zeros((6, k), np.uint16)
+        self.slot_rows = list(self.slot)
+        self.lut = np.full(self.ID_LIMIT + 1, n, np.intp)  # MasterID -> index 反馈CAN ID到电机序号
+        self.lut[master_ids] = np.arange(n)
+        self.raw = np.zeros((6, n + 1), np.uint16)
+        self.raw_rows = list(self.raw)
+        self.raw_float = self.raw[:3]
+        pmax, vmax, tmax = np.append(limits, limits[:1], 0).T  # trash entry reuses the first motor 垃圾位置借用第一个电机
+        bits = np.array([16, 12, 12])[:, None]
+        self.fb_min = np.stack((-pmax, -vmax, -tmax))
+        self.fb_scale = (2 * np.stack((pmax, vmax, tmax))) / ((1 << bits) - 1)
+        self.fb = np.zeros((3, n + 1))
+        self.q, self.dq, self.tau = (row[:n] for row in self.fb)
+        self.status = self.raw[3, :n]
+        self.temp_mos = self.raw[4, :n]
+        self.temp_rotor = self.raw[5, :n]
+        self.fresh_all = np.zeros(n + 1, bool)
+        self.fresh = self.fresh_all[:n]
+        self.ones = np.ones(k, bool)
+        self.now = np.zeros(1)
+        self.recv_time_all = np.zeros(n + 1)
+        self.recv_time = self.recv_time_all[:n]
+        self.unpublished = np.zeros(n, bool)
+        # replies counted with integer ops, np.count_nonzero and reductions allocate 用整数运算计数 np.count_nonzero和归约会分配内存
+        self.fresh_int = np.zeros(n + 1, np.int64)
+        self.fresh_count = self.fresh_int[:n]
+        self.ones_int = np.ones(k, np.int64)
+        self.replied = np.zeros(n, np.int64)
+        self.replied_view = memoryview(self.replied)
+        self.one = np.ones(n + 1, np.int64)
+        self.missed_replies_all = np.zeros(n + 1, np.int64)
+        self.missed_replies = self.missed_replies_all[:n]  # ticks without a reply 没有回复的周期数
+        # ticks, frames sent, reply frames decoded, resyncs 周期数 发送帧数 解析的回复帧数 重新同步次数
+        self.counters = np.zeros(4, np.int64)
+        self.tick_counts = np.zeros(4, np.int64)
+        self.tick_counts[0] = 1
+        self.tick_counts[1] = n
+        self.published = (0, 0)  # frames_sent and frames_received already added to MotorControl 已计入MotorControl的帧数
+        self.flush()
+
+    def flush(self):
+        """
+        hand the replies of earlier calls to MotorControl and start from an empty buffer
+        把之前调用的回复交给MotorControl解析 从空缓冲区开始
+        """
+        self.motor_control.recv()
+        self.motor_control.transport.data_save = bytes()
+        self.fill = 0
+        self.rx_head.fill(0)
+        self.rx_tail.fill(0)
+
+    def step(self, timeout=None):
+        """
+        one control tick: encode and send the commands, wait for the replies and decode them in place
+        一个控制周期: 编码并发送指令 等待回复并原地解析
+        :param timeout: longest wait, default self.timeout 最长等待时间
+        :return: number of motors without a reply 没有回复的电机数
+        """
+        n = len(self.Motors)
+        if self.motor_control.estop:
+            return n
+        if self.mode == Control_Type.MIT:
+            self.__encode_mit()
+        self.__write()
+        self.fresh_all.fill(False)
+        self.fresh_int.fill(0)
+        deadline = monotonic() + (self.timeout if timeout is None else timeout)
+        want = self.fill + self.reply_size
+        while True:
+            self.__read(want, deadline)
+            self.__decode()
+            np.add.accumulate(self.fresh_count, out=self.replied)
+            missing = n - self.replied_view[n - 1]
+            if missing == 0 or monotonic() >= deadline:
+                break
+            want = self.fill + 16 * missing
+        np.add(self.missed_replies_all, self.one, out=self.missed_replies_all)
+        np.subtract(self.missed_replies_all, self.fresh_int, out=self.missed_replies_all)
+        np.logical_or(self.unpublished, self.fresh, out=self.unpublished)
+        np.add(self.counters, self.tick_counts, out=self.counters)
+        return missing
+
+    def __encode_mit(self):
+        # float_to_uint of all five fields at once 一次计算五个字段的float_to_uint
+        w = self.cmd_work
+        np.maximum(self.cmd, self.cmd_min, out=w)
+        np.minimum(w, self.cmd_max, out=w)
+        np.subtract(w, self.cmd_min, out=w)
+        np.multiply(w, self.cmd_scale, out=w)
+        np.copyto(self.cmd_fields, w, casting="unsafe")
+        np.left_shift(self.cmd_fields, self.cmd_shift, out=self.cmd_fields)
+        rows = self.cmd_field_rows
+        word = self.cmd_word
+        np.bitwise_or(rows[0], rows[1], out=word)
+        np.bitwise_or(word, rows[2], out=word)
+        np.bitwise_or(word, rows[3], out=word)
+        np.bitwise_or(word, rows[4], out=word)
+        np.copyto(self.tx_word, word)  # big-endian into the frames 以大端写入帧
+
+    def __write(self):
+        if self.file is None:
+            self.device.write(self.tx)
+            return
+        sent = self.file.write(self.tx)
+        if sent is None:
+            sent = 0
+        if sent < self.tx_size:
+            self.device.write(memoryview(self.tx)[sent:])  # output queue full, rare 输出队列满 很少发生
+
+    def __read(self, want, deadline):
+        while self.fill < want and self.fill < self.rx_size:
+            got = self.__readinto(self.rx_tails[self.fill])
+            if got:
+                self.fill += got
+                continue
+            remaining = deadline - monotonic()
+            if remaining <= 0:
+                return
+            if self.poller is not None:
+                self.poller.poll(remaining * 1000.0)
+
+    def __readinto(self, view):
+        if self.file is None:
+            waiting = self.device.in_waiting
+            if not waiting:
+                return 0
+            data = self.device.read(min(waiting, len(view)))
+            view[:len(data)] = data
+            return len(data)
+        return self.file.readinto(view) or 0
+
+    def __decode(self):
+        frames = self.fill >> 4
+        if frames == 0:
+            return
+        np.equal(self.rx_head, self.HEAD, out=self.framed)
+        np.equal(self.rx_tail, self.TAIL, out=self.valid)
+        np.logical_and(self.framed, self.valid, out=self.framed)
+        if np.count_nonzero(self.framed) != frames:
+            self.__resync()
+            frames = self.fill >> 4
+            if frames == 0:
+                return
+        self.now.fill(time.time())
+        # feedback frames from a known MasterID, everything else goes to the trash entry
+        # 来自已知MasterID的反馈帧 其余的帧写到垃圾位置
+        np.equal(self.rx_cmd, self.FEEDBACK, out=self.valid)
+        np.logical_and(self.valid, self.framed, out=self.valid)
+        np.logical_not(self.valid, out=self.invalid)
+        np.copyto(self.key, self.rx_canid)
+        np.minimum(self.key, self.KEY_LIMIT, out=self.key)
+        np.copyto(self.key_index, self.key)
+        self.lut.take(self.key_index, out=self.idx, mode="clip")
+        np.putmask(self.idx, self.invalid, self.trash)
+        slot = self.slot_rows
+        raw = self.raw_rows
+        fields = self.rx_fields
+        np.copyto(slot[0], fields[0])
+        np.copyto(slot[1], fields[1])
+        np.copyto(slot[2], fields[2])
+        np.copyto(slot[3], fields[3])
+        np.copyto(slot[4], fields[4])
+        np.copyto(slot[5], fields[5])
+        np.right_shift(slot[0], self.SHIFT4, out=slot[0])
+        np.right_shift(slot[2], self.SHIFT4, out=slot[2])
+        np.bitwise_and(slot[3], self.MASK12, out=slot[3])
+        # slot order to motor order, q dq tau first so that raw rows 0..2 are the floats 槽位顺序转换为电机顺序
+        raw[0].put(self.idx, slot[1])
+        raw[1].put(self.idx, slot[2])
+        raw[2].put(self.idx, slot[3])
+        raw[3].put(self.idx, slot[0])
+        raw[4].put(self.idx, slot[4])
+        raw[5].put(self.idx, slot[5])
+        self.fresh_all.put(self.idx, self.ones)
+        self.fresh_int.put(self.idx, self.ones_int)
+        np.putmask(self.recv_time_all, self.fresh_all, self.now)
+        np.copyto(self.fb, self.raw_float)
+        np.multiply(self.fb, self.fb_scale, out=self.fb)
+        np.add(self.fb, self.fb_min, out=self.fb)
+        self.tick_counts[2] = frames
+        # keep a partial frame for the next read, clear the tails so that it does not look framed before its last
+        # byte arrives 保留不完整的帧等下次读取 清除帧尾 不完整的帧在最后一个字节到达前不会被当成完整的帧
+        rest = self.fill - 16 * frames
+        self.rx_tail.fill(0)
+        if rest:
+            self.rx[:rest] = self.rx[16 * frames:self.fill]
+            self.rx_head_rest.fill(0)
+        else:
+            self.rx_head.fill(0)
+        self.fill = rest
+
+    def __resync(self):
+        # bytes were lost, move the whole frames back onto the slot boundaries, rare 丢失了字节 把完整帧重新对齐到槽位
+        data = bytes(self.rx[:self.fill])
+        packed = bytearray()
+        i = 0
+        end = 0
+        while i <= len(data) - 16:
+            if data[i] == 0xAA and data[i + 15] == 0x55:
+                packed += data[i:i + 16]
+                i += 16
+                end = i
+            else:
+                i += 1
+        packed += data[end:]
+        self.rx_head.fill(0)
+        self.rx_tail.fill(0)
+        self.rx[:len(packed)] = packed
+        self.fill = len(packed)
+        self.counters[3] += 1
+        np.equal(self.rx_head, self.HEAD, out=self.framed)
+        np.equal(self.rx_tail, self.TAIL, out=self.valid)
+        np.logical_and(self.framed, self.valid, out=self.framed)
+
+    def publish(self):
+        """
+        copy the feedback received since the last call to the Motor objects and run decode_listeners, allocates, so
+        call it from a slower loop or after the run 把上次调用之后收到的反馈复制到电机对象并运行decode_listeners
+        会分配内存 在较慢的循环中或运行结束后调用
+        """
+        for i in np.flatnonzero(self.unpublished):
+            Motor = self.Motors[i]
+            Motor.recv_data(float(self.q[i]), float(self.dq[i]), float(self.tau[i]), float(self.recv_time[i]))
+            Motor.status = int(self.status[i])
+            Motor.isEnable = Motor.status == DM_Motor_State.ENABLED
+            Motor.temp_mos = int(self.temp_mos[i])
+            Motor.temp_rotor = int(self.temp_rotor[i])
+        for i, Motor in enumerate(self.Motors):
+            Motor.missed_replies = int(self.missed_replies[i])
+        self.unpublished.fill(False)
+        sent, received = int(self.counters[1]), int(self.counters[2])
+        mc = self.motor_control
+        mc.frames_sent += sent - self.published[0]
+        mc.frames_received += received - self.published[1]
+        self.published = (sent, received)
+        for listener in mc.decode_listeners:
+            listener()
+
+    def stats(self):
+        """
+        :return: dict of ticks, frames_sent, frames_received, resyncs 周期数 发送帧数 接收帧数 重新同步次数
+        """
+        ticks, sent, received, resyncs = (int(x) for x in self.counters)
+        return {"ticks": ticks, "frames_sent": sent, "frames_received": received, "resyncs": resyncs}
+
+
+@contextmanager
+def gc_paused(freeze=True):
+    """
+    run a block without garbage collection 在没有垃圾回收的情况下运行一段代码
+    collects once, moves every surviving object to the permanent generation with gc.freeze so later collections do
+    not scan it, and disables the collector until the block ends 先回收一次，用gc.freeze把存活的对象移入永久代，
+    之后的回收不再扫描它们，并在代码块结束前关闭垃圾回收
+    :param freeze: also gc.freeze, keep it when the process forks workers later 同时调用gc.freeze
+    """
+    enabled = gc.isenabled()
+    gc.collect()
+    if freeze:
+        gc.freeze()
+    gc.disable()
+    try:
+        yield
+    finally:
+        if freeze:
+            gc.unfreeze()
+        if enabled:
+            gc.enable()
+
+
+class AllocationAudit:
+    def __init__(self, frames=4):
+        """
+        count the memory allocated by every tick of a control loop with tracemalloc 用tracemalloc统计控制循环每个周期的内存分配
+        :param frames: stack frames kept per allocation for the report 报告中每次分配保留的调用栈深度
+        """
+        self.frames = frames
+        self.per_tick = np.zeros(0, np.int64)
+        self.retained = []
+        self.gc_objects = 0
+        self.collections = 0
+
+    def run(self, step, ticks=1000, warmup=100):
+        """
+        call step() ticks times under tracemalloc 在tracemalloc下调用step() ticks次
+        :param step: one tick of the loop, e.g. RealtimeLoop.step 一个控制周期
+        :param ticks: ticks to audit 统计的周期数
+        :param warmup: ticks run first so that caches fill up 先运行的周期数 使缓存填满
+        :return: report() 统计结果
+        """
+        for _ in range(warmup):
+            step()
+        collections = [0]
+
+        def on_gc(phase, info):
+            if phase == "start":
+                collections[0] += 1
+
+        tracing = tracemalloc.is_tracing()
+        if not tracing:
+            tracemalloc.start(self.frames)
+        per_tick = np.zeros(ticks, np.int64)
+        gc.callbacks.append(on_gc)
+        try:
+            before = tracemalloc.take_snapshot()
+            count = gc.get_count()[0]
+            for i in range(ticks):
+                current = tracemalloc.get_traced_memory()[0]
+                tracemalloc.reset_peak()
+                step()
+                # peak above the level before the tick: transient plus retained allocations 本周期分配的峰值
+                per_tick[i] = tracemalloc.get_traced_memory()[1] - current
+            self.gc_objects = gc.get_count()[0] - count
+            after = tracemalloc.take_snapshot()
+        finally:
+            gc.callbacks.remove(on_gc)
+            if not tracing:
+                tracemalloc.stop()
+        # leave out the bookkeeping of this function 不计入本函数自身的分配
+        ignore = [tracemalloc.Filter(False, tracemalloc.__file__)] + \
+                 [tracemalloc.Filter(False, __file__, line) for _, _, line in self.run.__code__.co_lines() if line]
+        self.retained = [stat for stat in after.filter_traces(ignore).compare_to(before.filter_traces(ignore),
+                                                                                  "traceback")
+                         if stat.size_diff > 0]
+        self.per_tick = per_tick
+        self.collections = collections[0]
+        return self.report()
+
+    def report(self):
+        """
+        :return: dict of ticks, allocating_ticks, max_bytes, mean_bytes, retained_bytes, retained_blocks, gc_objects
+        (net new objects tracked by the collector) and collections 周期数 有分配的周期数 最大/平均分配字节数 保留的字节数和
+        块数 新增的回收器跟踪对象数 垃圾回收次数
+        """
+        per_tick = self.per_tick
+        return {"ticks": int(per_tick.size), "allocating_ticks": int(np.count_nonzero(per_tick)),
+                "max_bytes": int(per_tick.max(initial=0)), "mean_bytes": float(per_tick.mean()) if per_tick.size else 0.0,
+                "retained_bytes": sum(stat.size_diff for stat in self.retained),
+                "retained_blocks": sum(stat.count_diff for stat in self.retained),
+                "gc_objects": self.gc_objects, "collections": self.collections}
+
+    def print_report(self, top=5):
+        row = self.report()
+        print("ticks %d, allocating %d, max %d B, mean %.1f B, retained %d B in %d blocks, gc objects %+d, "
+              "collections %d" % (row["ticks"], row["allocating_ticks"], row["max_bytes"], row["mean_bytes"],
+                                  row["retained_bytes"], row["retained_blocks"], row["gc_objects"], row["collections"]))
+        for stat in sorted(self.retained, key=lambda stat: -stat.size_diff)[:top]:
+            print("  %+d B %+d blocks" % (stat.size_diff, stat.count_diff))
+            for line in stat.traceback.format()[-2:]:
+                print("   ", line.strip())
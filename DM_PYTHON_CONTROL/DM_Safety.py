@@ -0,0 +1,131 @@
+import numpy as np
+from DM_CAN import MotorControl
+
+
+class CommandLimiter:
+    Q, DQ, TAU = 0, 1, 2
+
+    def __init__(self, Motors, q_min=None, q_max=None, dq_max=None, tau_max=None, q_step=None, dq_step=None,
+                 tau_step=None):
+        """
+        saturation and slew rate limit of the setpoints of a motor group 电机组期望值的限幅和变化率限制
+        set it as MotorControl.limiter and every control call goes through it 设置为MotorControl.limiter后所有控制函数都会经过它
+        limits are scalars or one value per motor, default the PMAX/VMAX/TMAX of the motor type
+        限幅可以是标量或每个电机一个值，默认使用电机类型的PMAX/VMAX/TMAX
+        :param Motors: list of Motor objects 电机对象列表
+        :param q_min: lowest position 最小位置
+        :param q_max: highest position 最大位置
+        :param dq_max: largest velocity magnitude 最大速度
+        :param tau_max: largest torque magnitude 最大力矩
+        :param q_step: largest position change per tick, None for no limit 每个周期位置的最大变化量 None不限制
+        :param dq_step: largest velocity change per tick 每个周期速度的最大变化量
+        :param tau_step: largest torque change per tick 每个周期力矩的最大变化量
+        """
+        self.Motors = list(Motors)
+        self.index = {Motor.SlaveID: i for i, Motor in enumerate(self.Motors)}
+        n = len(self.Motors)
+        limits = np.array([MotorControl.Limit_Param[Motor.MotorType] for Motor in self.Motors], np.float64).reshape(-1, 3)
+        self.lo = -limits.T.copy()  # shape (3, n), rows q dq tau
+        self.hi = limits.T.copy()
+        for row, low, high in ((self.Q, q_min, q_max), (self.DQ, None, dq_max), (self.TAU, None, tau_max)):
+            if high is not None:
+                self.hi[row] = np.minimum(self.hi[row], high)
+                if low is None:
+                    self.lo[row] = -self.hi[row]
+            if low is not None:
+                self.lo[row] = np.maximum(self.lo[row], low)
+        if np.any(self.lo > self.hi):
+            raise ValueError("lower limit above upper limit")
+        self.step = np.full((3, n), np.inf)
+        for row, step in ((self.Q, q_step), (self.DQ, dq_step), (self.TAU, tau_step)):
+            if step is not None:
+                self.step[row] = step
+        self.last = np.full((3, n), np.nan)  # last limited setpoint, nan means none yet 上次输出的期望值
+        self.saturated = np.zeros((3, n), np.int64)  # clamped or nan setpoints 被限幅或为nan的次数
+        self.slewed = np.zeros((3, n), np.int64)  # setpoints held back by the rate limit 被变化率限制的次数
+        self.cache = {}
+
+    def __select(self, Motors, fields):
+        key = (fields, tuple(Motor.SlaveID for Motor in Motors))
+        sel = self.cache.get(key)
+        if sel is None:
+            try:
+                rows = np.array([self.index[SlaveID] for SlaveID in key[1]], np.intp)
+            except KeyError as e:
+                raise ValueError("motor 0x%02X is not in the limiter group" % e.args[0]) from None
+            # plain slices where possible, they index without copying 尽量使用切片 避免复制
+            if fields == tuple(range(fields[0], fields[-1] + 1)):
+                fields = slice(fields[0], fields[-1] + 1)
+            else:
+                fields = np.array(fields, np.intp)[:, None]
+            # a slice and an index array together would make the selection 3-d, so both or neither are arrays
+            # 切片和索引数组一起使用会得到三维的结果 所以两者要么都是切片要么都是数组
+            if isinstance(fields, slice) and np.array_equal(rows, np.arange(len(self.Motors))):
+                rows = slice(None)
+            elif isinstance(fields, slice):
+                fields = np.arange(fields.start, fields.stop)[:, None]
+            sel = (fields, rows)
+            self.cache[key] = sel
+        return sel
+
+    def apply(self, Motors, q=None, dq=None, tau=None):
+        """
+        limit the setpoints of one control call 限制一次控制的期望值
+        :param Motors: list of Motor objects in the group 组内的电机对象列表
+        :param q: position, scalar or one per motor, None if not sent 期望位置 不发送时为None
+        :param dq: velocity 期望速度
+        :param tau: torque 期望力矩
+        :return: (q, dq, tau) float arrays, None where the input was None
+        :raises ValueError: nan setpoint of a motor without an earlier output, there is nothing to hold
+        电机还没有输出过时期望值为nan 没有可以保持的值
+        """
+        values = (q, dq, tau)
+        fields = tuple(i for i in range(3) if values[i] is not None)
+        if not fields:
+            return values
+        sel = self.__select(Motors, fields)
+        cmd = np.empty((len(fields), len(Motors)))
+        for j, i in enumerate(fields):
+            cmd[j] = values[i]
+        last = self.last[sel]
+        fresh = np.isnan(last)
+        # nan setpoints hold the last output 无效的期望值保持上次输出
+        bad = np.isnan(cmd)
+        if bad.any():
+            if (bad & fresh).any():
+                j, k = np.argwhere(bad & fresh)[0]
+                raise ValueError("nan %s setpoint for motor 0x%02X before any valid one" % (
+                    ("q", "dq", "tau")[fields[j]], Motors[k].SlaveID))
+            cmd[bad] = last[bad]
+        # np.minimum/np.maximum are much faster than np.clip on small arrays 小数组上比np.clip快很多
+        out = np.minimum(np.maximum(cmd, self.lo[sel]), self.hi[sel])
+        self.saturated[sel] += (out != cmd) | bad
+        step = self.step[sel]
+        slewed = np.minimum(np.maximum(out, last - step), last + step)
+        slewed[fresh] = out[fresh]
+        self.slewed[sel] += slewed != out
+        self.last[sel] = slewed
+        result = [None, None, None]
+        for j, i in enumerate(fields):
+            result[i] = slewed[j]
+        return tuple(result)
+
+    def reset(self, Motors=None):
+        """
+        restart the rate limit from the last feedback, e.g. after enabling 从最近的反馈重新开始变化率限制 例如使能之后
+        motors that never replied start from their first setpoint 从未回复过的电机从第一个期望值开始
+        :param Motors: list of Motor objects, default the whole group 电机对象列表 默认整个组
+        """
+        for Motor in self.Motors if Motors is None else Motors:
+            i = self.index[Motor.SlaveID]
+            if not Motor.recv_time:
+                self.last[:, i] = np.nan
+            else:
+                self.last[:, i] = (Motor.getPosition(), Motor.getVelocity(), Motor.getTorque())
+
+    def saturation_events(self):
+        """
+        :return: {SlaveID: (saturated, slewed)} counters, each (q, dq, tau) 每个电机的限幅和变化率限制次数
+        """
+        return {Motor.SlaveID: (tuple(self.saturated[:, i].tolist()), tuple(self.slewed[:, i].tolist()))
+                for i, Motor in enumerate(self.Motors)}
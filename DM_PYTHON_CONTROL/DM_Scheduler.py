@@ -0,0 +1,370 @@
+import math
+import time
+from time import monotonic
+import numpy as np
+from DM_CAN import Control_Type, DM_variable
+
+
+class HoldScheduler:
+    TIMEOUT_UNIT = 50e-6  # one count of the TIMEOUT register 寄存器TIMEOUT的单位 秒
+
+    def __init__(self, motor_control, Motors, mode=Control_Type.VEL, tolerance=1e-3, keepalive=None, margin=0.5,
+                 max_interval=0.5, stale=0.01):
+        """
+        send holding setpoints only when needed 只在需要时发送保持不变的期望值
+        a motor is sent its command when the setpoint moved more than tolerance since the last send or when its
+        keepalive is due, the slots of skipped motors refresh the status of the motors with the oldest feedback
+        期望值变化超过tolerance或保活时间到期时才发送，省下的帧用来刷新反馈最旧的电机的状态
+        :param motor_control: MotorControl object 电机控制对象
+        :param Motors: list of Motor objects 电机对象列表
+        :param mode: Control_Type.VEL or POS_VEL 控制模式
+        :param tolerance: setpoint change that is sent at once 需要立即发送的期望值变化量
+        :param keepalive: seconds between sends of a holding setpoint, scalar or one per motor, default from the
+        TIMEOUT register of each motor 期望值不变时的发送间隔 默认由每个电机的TIMEOUT寄存器计算
+        :param margin: keepalive as a fraction of the TIMEOUT watchdog 保活间隔占TIMEOUT的比例
+        :param max_interval: longest keepalive, also used when TIMEOUT is 0 (off) 最长发送间隔 TIMEOUT为0(关闭)时使用
+        :param stale: feedback older than this is refreshed in a free slot 反馈超过该时间就在空闲帧中刷新 单位秒
+        """
+        if mode not in (Control_Type.VEL, Control_Type.POS_VEL):
+            raise ValueError("HoldScheduler supports VEL and POS_VEL, not %r" % (mode,))
+        self.motor_control = motor_control
+        self.Motors = list(Motors)
+        self.mode = mode
+        self.tolerance = tolerance
+        self.margin = margin
+        self.max_interval = max_interval
+        self.stale = stale
+        n = len(self.Motors)
+        self.last = np.full((1 if mode == Control_Type.VEL else 2, n), np.nan)  # last sent setpoints 上次发送的期望值
+        self.due = np.full(n, -np.inf)  # monotonic() time the keepalive is due 需要保活发送的时刻
+        if keepalive is None:
+            self.read_keepalive()
+        else:
+            self.keepalive = np.broadcast_to(np.asarray(keepalive, np.float64), (n,)).copy()
+        self.sent = 0  # commands sent 发送的指令数
+        self.suppressed = 0  # commands skipped 省略的指令数
+        self.refreshed = 0  # status refreshes sent in free slots 在空闲帧中发送的状态刷新数
+
+    def read_keepalive(self, timeout=0.5):
+        """
+        set the keepalive of every motor from its TIMEOUT register 根据每个电机的TIMEOUT寄存器设置保活间隔
+        :param timeout: time to wait for the replies 等待回复的时间 单位秒
+        """
+        values = self.motor_control.read_motor_param_batch(self.Motors, [DM_variable.TIMEOUT], timeout)
+        counts = np.array([values[Motor.SlaveID].get(DM_variable.TIMEOUT, 0) for Motor in self.Motors], np.float64)
+        keepalive = np.where(counts > 0, counts * self.TIMEOUT_UNIT * self.margin, self.max_interval)
+        self.keepalive = np.minimum(keepalive, self.max_interval)
+
+    def reset(self):
+        """
+        send every motor on the next step, e.g. after enabling 下一次全部发送 例如使能之后
+        """
+        self.last[:] = np.nan
+        self.due[:] = -np.inf
+
+    def step(self, *setpoints):
+        """
+        one control tick 一个控制周期
+        VEL: step(V), POS_VEL: step(P, V), each a scalar or one per motor 标量或每个电机一个
+        :return: list of Motor objects that missed the reply, when reply_timeout is set 没有按时回复的电机
+        """
+        motor_control = self.motor_control
+        if motor_control.estop:
+            self.reset()
+            return []
+        target = np.empty(self.last.shape)
+        for j, value in enumerate(setpoints):
+            target[j] = value
+        now = monotonic()
+        # nan never compares <= tolerance, so motors not sent yet are sent 从未发送过的电机为nan 一定会发送
+        send = (now >= self.due) | ~np.all(np.abs(target - self.last) <= self.tolerance, axis=0)
+        idx = np.flatnonzero(send)
+        if idx.size:
+            Motors = [self.Motors[i] for i in idx]
+            if self.mode == Control_Type.VEL:
+                motor_control.control_Vel_batch(Motors, target[0, idx], timeout=0)
+            else:
+                motor_control.control_Pos_Vel_batch(Motors, target[0, idx], target[1, idx], timeout=0)
+            self.last[:, idx] = target[:, idx]
+            self.due[idx] = now + self.keepalive[idx]
+        free = len(self.Motors) - idx.size
+        if free:
+            age = time.time() - np.array([Motor.recv_time for Motor in self.Motors])
+            stale = np.flatnonzero(~send & (age > self.stale))
+            stale = stale[np.argsort(-age[stale], kind="stable")][:free]
+            if stale.size:
+                motor_control.refresh_motor_status_batch([self.Motors[i] for i in stale], timeout=0)
+            self.refreshed += stale.size
+        self.sent += idx.size
+        self.suppressed += free
+        if motor_control.reply_timeout > 0:
+            return motor_control.wait_replies(motor_control.reply_timeout)
+        return []
+
+
+class RateGroup:
+    def __init__(self, name, Motors, rate, mode, together):
+        """
+        motors commanded at the same rate, see RateScheduler.add_group 以相同频率控制的电机组
+        """
+        self.name = name
+        self.Motors = list(Motors)
+        self.rate = rate
+        self.mode = mode
+        self.together = together
+        self.period = 0  # ticks between commands 两次指令之间的周期数
+        self.phase = np.zeros(len(self.Motors), np.int64)  # tick of each motor within the period 每个电机在周期内的相位
+        n = len(self.Motors)
+        fields = {Control_Type.MIT: 5, Control_Type.POS_VEL: 2, Control_Type.VEL: 1}[mode]
+        self.setpoints = np.zeros((fields, n))  # latest setpoints, rows as the control call 最新的期望值
+
+
+class RateScheduler:
+    def __init__(self, motor_control, tick_rate=1000):
+        """
+        motor groups with their own command rates 不同控制频率的电机组
+        every motor is given a phase within its period so that each tick of the hyperperiod sends about the same
+        number of frames, the slot table is computed once by build()
+        每个电机在自己的周期内分配一个相位，使超周期内每个周期发送的帧数尽量相同，时隙表由build()一次计算好
+        :param motor_control: MotorControl object 电机控制对象
+        :param tick_rate: rate step() is called at 调用step()的频率 单位Hz
+        """
+        self.motor_control = motor_control
+        self.tick_rate = tick_rate
+        self.groups = {}
+        self.hyperperiod = 0
+        self.slots = []  # per tick: [(group, Motors, index array)] 每个周期需要发送的电机
+        self.load = np.zeros(0, np.int64)  # frames sent in each tick of the hyperperiod 超周期内每个周期的帧数
+        self.tick = 0
+        self.sent = 0
+
+    def add_group(self, name, Motors, rate, mode=Control_Type.MIT, together=False):
+        """
+        :param name: group name 组名
+        :param Motors: list of Motor objects 电机对象列表
+        :param rate: command rate, tick_rate must be a multiple of it 控制频率 tick_rate必须是它的整数倍
+        :param mode: Control_Type.MIT, POS_VEL or VEL 控制模式
+        :param together: send all motors of the group in the same tick, for coordinated joints
+        整组电机在同一个周期发送 用于需要协调的关节
+        """
+        if mode not in (Control_Type.MIT, Control_Type.POS_VEL, Control_Type.VEL):
+            raise ValueError("unsupported mode %r" % (mode,))
+        period = self.tick_rate / float(rate)
+        if abs(period - round(period)) > 1e-9 or round(period) < 1:
+            raise ValueError("rate %g Hz does not divide the tick rate %g Hz" % (rate, self.tick_rate))
+        group = RateGroup(name, Motors, rate, mode, together)
+        group.period = int(round(period))
+        self.groups[name] = group
+        self.hyperperiod = 0  # 需要重新build
+        return group
+
+    def build(self):
+        """
+        assign the phases and compute the slot table of the hyperperiod 分配相位并计算超周期的时隙表
+        units (a whole group when together, else single motors) are placed shortest period and largest first, each
+        in the phase whose busiest tick is least loaded 按周期从短到长、帧数从多到少依次放置，选择最忙周期负载最小的相位
+        :return: frames per tick over the hyperperiod 超周期内每个周期的帧数
+        """
+        H = 1
+        for group in self.groups.values():
+            H = math.lcm(H, group.period)
+        load = np.zeros(H, np.int64)
+        units = []
+        for group in self.groups.values():
+            if group.together:
+                units.append((group, np.arange(len(group.Motors))))
+            else:
+                units.extend((group, np.array([i])) for i in range(len(group.Motors)))
+        units.sort(key=lambda unit: (unit[0].period, -unit[1].size))
+        for group, idx in units:
+            ticks = load.reshape(-1, group.period)  # column p holds every tick of phase p 第p列为相位p的所有周期
+            cost = ticks.max(axis=0) * H + ticks.sum(axis=0)
+            phase = int(np.argmin(cost))
+            group.phase[idx] = phase
+            load[phase::group.period] += idx.size
+        self.hyperperiod = H
+        self.load = load
+        self.slots = []
+        for t in range(H):
+            slot = []
+            for group in self.groups.values():
+                idx = np.flatnonzero(group.phase == t % group.period)
+                if idx.size:
+                    slot.append((group, [group.Motors[i] for i in idx], idx))
+            self.slots.append(slot)
+        self.tick = 0
+        return load
+
+    def set(self, name, *setpoints):
+        """
+        latest setpoints of a group, sent at the next slot of each motor 设置组的期望值 在每个电机的下一个时隙发送
+        MIT: set(name, kp, kd, q, dq, tau), POS_VEL: set(name, P, V), VEL: set(name, V), each a scalar or one per motor
+        """
+        group = self.groups[name]
+        if len(setpoints) != group.setpoints.shape[0]:
+            raise ValueError("group %r takes %d setpoints" % (name, group.setpoints.shape[0]))
+        for j, value in enumerate(setpoints):
+            group.setpoints[j] = value
+
+    def step(self):
+        """
+        one tick: send the motors whose slot it is 一个周期 发送当前时隙的电机
+        :return: list of Motor objects that missed the reply, when reply_timeout is set 没有按时回复的电机
+        """
+        if not self.hyperperiod:
+            self.build()
+        motor_control = self.motor_control
+        slot = self.slots[self.tick]
+        self.tick = (self.tick + 1) % self.hyperperiod
+        if motor_control.estop:
+            return []
+        for group, Motors, idx in slot:
+            values = group.setpoints[:, idx]
+            if group.mode == Control_Type.MIT:
+                motor_control.controlMIT_batch(Motors, *values, timeout=0)
+            elif group.mode == Control_Type.POS_VEL:
+                motor_control.control_Pos_Vel_batch(Motors, *values, timeout=0)
+            else:
+                motor_control.control_Vel_batch(Motors, values[0], timeout=0)
+            self.sent += idx.size
+        if slot and motor_control.reply_timeout > 0:
+            return motor_control.wait_replies(motor_control.reply_timeout)
+        return []
+
+    def table(self):
+        """
+        :return: {group name: [(SlaveID, phase)]} and the period of each group 每组电机的相位
+        """
+        return {name: {"period": group.period,
+                       "phases": [(Motor.SlaveID, int(p)) for Motor, p in zip(group.Motors, group.phase)]}
+                for name, group in self.groups.items()}
+
+
+class OrderedGroup:
+    FIXED = "fixed"
+    ROUND_ROBIN = "round_robin"
+    PRIORITY = "priority"
+
+    def __init__(self, motor_control, Motors, policy=FIXED, priority=None, extrapolate=False, frame_time=130e-6):
+        """
+        send order within a tick and the send-to-reply offset of every motor 周期内的发送顺序和每个电机从发送到回复的时间
+        frames of one tick leave the adapter one after another, so the last motor is commanded and reports several
+        frame times after the first 同一周期的帧依次发出，最后一个电机比第一个晚几个帧时间收到指令并回复
+        the offset of a motor is measured from the estimated send time of its own frame, t_tick + position * frame_time
+        每个电机的偏移从它自己的帧的估计发送时刻算起 即t_tick + 发送位置 * frame_time
+        offsets are only as fine as the transport timestamps: one read time on serial, per frame kernel timestamps on
+        SocketCAN 偏移的精度取决于传输层的时间戳: 串口为读取时刻，SocketCAN为每帧的内核时间戳
+        :param motor_control: MotorControl object 电机控制对象
+        :param Motors: list of Motor objects 电机对象列表
+        :param policy: FIXED keeps the list order, ROUND_ROBIN rotates the first motor every tick, PRIORITY sends higher
+        priority first FIXED按列表顺序 ROUND_ROBIN每个周期轮换第一个电机 PRIORITY优先级高的先发送
+        :param priority: one value per motor for PRIORITY, higher first, ties keep the list order 每个电机的优先级 越大越先发送
+        :param extrapolate: state() moves every motor to the tick time with q + dq * (t_tick - recv_time)
+        state()把每个电机的位置外推到周期时刻
+        :param frame_time: time one CAN frame takes on the bus, about 130 us for 8 bytes at 1 Mbps 一个CAN帧在总线上的时间
+        """
+        if policy not in (self.FIXED, self.ROUND_ROBIN, self.PRIORITY):
+            raise ValueError("unknown policy %r" % (policy,))
+        self.motor_control = motor_control
+        self.Motors = list(Motors)
+        n = len(self.Motors)
+        self.policy = policy
+        self.extrapolate = extrapolate
+        self.frame_time = frame_time
+        if policy == self.PRIORITY:
+            if priority is None:
+                raise ValueError("PRIORITY needs one priority per motor")
+            self.base = np.argsort(-np.asarray(priority, np.float64), kind="stable")
+        else:
+            self.base = np.arange(n)
+        self.rotation = 0
+        self.order = self.base
+        self.t_tick = 0.0  # time.time() of the last send 上次发送的时刻
+        self.t_send = np.zeros(n)  # estimated send time of the frame of every motor 每个电机的帧的估计发送时刻
+        # per motor statistics of recv_time - t_send 每个电机的回复偏移统计
+        self.count = np.zeros(n, np.int64)
+        self.offset_sum = np.zeros(n)
+        self.offset_max = np.zeros(n)
+        self.offset_last = np.full(n, np.nan)
+        self.position_sum = np.zeros(n)  # position in the send order 在发送顺序中的位置
+
+    def __next_order(self):
+        if self.policy == self.ROUND_ROBIN:
+            self.order = np.roll(self.base, -self.rotation)
+            self.rotation = (self.rotation + 1) % len(self.Motors)
+        return self.order
+
+    def __send(self, send, setpoints, timeout):
+        order = self.__next_order()
+        n = len(self.Motors)
+        values = [np.broadcast_to(np.asarray(value, np.float64), (n,))[order] for value in setpoints]
+        Motors = [self.Motors[i] for i in order]
+        self.t_tick = time.time()
+        missed = send(Motors, *values, timeout=timeout)
+        self.__measure()
+        return missed
+
+    def __measure(self):
+        n = len(self.Motors)
+        position = np.empty(n)
+        position[self.order] = np.arange(n)
+        self.t_send = self.t_tick + position * self.frame_time
+        recv = np.fromiter((Motor.recv_time for Motor in self.Motors), np.float64, n)
+        replied = recv >= self.t_tick
+        offset = recv - self.t_send
+        self.offset_last = np.where(replied, offset, np.nan)
+        self.count += replied
+        self.offset_sum += np.where(replied, offset, 0.0)
+        np.maximum(self.offset_max, np.where(replied, offset, 0.0), out=self.offset_max)
+        self.position_sum += np.where(replied, position, 0.0)
+
+    def measure(self):
+        """
+        record offsets again, after wait_replies when the control call was sent with timeout=0
+        用timeout=0发送并之后调用wait_replies时 重新记录偏移
+        """
+        self.__measure()
+
+    def controlMIT_batch(self, kp, kd, q, dq, tau, timeout=None):
+        """
+        arguments in the order of Motors, as MotorControl.controlMIT_batch 参数按Motors的顺序
+        """
+        return self.__send(self.motor_control.controlMIT_batch, (kp, kd, q, dq, tau), timeout)
+
+    def control_Pos_Vel_batch(self, P_desired, V_desired, timeout=None):
+        return self.__send(self.motor_control.control_Pos_Vel_batch, (P_desired, V_desired), timeout)
+
+    def control_Vel_batch(self, Vel_desired, timeout=None):
+        return self.__send(self.motor_control.control_Vel_batch, (Vel_desired,), timeout)
+
+    def state(self, t=None, extrapolate=None):
+        """
+        :param t: time.time() to align to, default the time of the last send 对齐的时刻 默认为上次发送的时刻
+        :param extrapolate: default the extrapolate of the constructor 是否外推
+        :return: (q, dq, tau) arrays in the order of Motors, q extrapolated to t when enabled 按Motors顺序的状态
+        """
+        n = len(self.Motors)
+        q = np.fromiter((Motor.state_q for Motor in self.Motors), np.float64, n)
+        dq = np.fromiter((Motor.state_dq for Motor in self.Motors), np.float64, n)
+        tau = np.fromiter((Motor.state_tau for Motor in self.Motors), np.float64, n)
+        if self.extrapolate if extrapolate is None else extrapolate:
+            recv = np.fromiter((Motor.recv_time for Motor in self.Motors), np.float64, n)
+            q = q + dq * np.where(recv > 0, (self.t_tick if t is None else t) - recv, 0.0)
+        return q, dq, tau
+
+    def report(self):
+        """
+        send-to-reply offset of every motor, from the estimated send time of its frame 每个电机从它的帧发出到回复的时间
+        :return: list of dict with SlaveID, replies, mean/max/last offset in seconds and mean send position
+        """
+        count = np.maximum(self.count, 1)
+        return [{"SlaveID": Motor.SlaveID, "replies": int(self.count[i]),
+                 "offset_mean": float(self.offset_sum[i] / count[i]), "offset_max": float(self.offset_max[i]),
+                 "offset_last": float(self.offset_last[i]), "position_mean": float(self.position_sum[i] / count[i])}
+                for i, Motor in enumerate(self.Motors)]
+
+    def print_report(self):
+        print("SlaveID  replies  position  offset_mean_us  offset_max_us")
+        for row in self.report():
+            print("0x%02X     %7d  %8.1f  %14.1f  %13.1f" % (row["SlaveID"], row["replies"], row["position_mean"],
+                                                           row["offset_mean"] * 1e6, row["offset_max"] * 1e6))
@@ -0,0 +1,377 @@
+"""
+simulated motor fleet 电机仿真
+
+SimFleet steps any number of motors in lockstep as NumPy arrays, with the limits of their DM_Motor_Type, the MIT
+law (PD plus feed-forward), the VEL and POS_VEL loops and the 12/16 bit quantization of the wire format.
+SimFleet用NumPy数组同步仿真任意数量的电机，包括电机类型的限幅、MIT控制律(PD加前馈)、速度和位置速度环以及通信协议的12/16位量化。
+
+It has the batched command API of MotorControl with motor indices instead of Motor objects, for large sweeps
+它提供与MotorControl相同的批量控制接口(用电机序号代替电机对象)，适合大规模仿真:
+
+    fleet = SimFleet([DM_Motor_Type.DM4310] * 1000, inertia=2e-3)
+    fleet.enable_batch()
+    for k in range(5000):
+        q, dq, tau = fleet.feedback()
+        fleet.controlMIT_batch(None, 20, 0.5, targets, 0, 0)
+        fleet.step()
+
+SimTransport puts a fleet behind MotorControl, so unchanged control code runs against the simulation
+SimTransport把仿真接到MotorControl上，控制程序不用修改就可以在仿真中运行:
+
+    MotorControl1 = MotorControl(SimTransport(SimFleet([DM_Motor_Type.DM4310] * 2)))
+"""
+import time
+from struct import pack, unpack
+import numpy as np
+from DM_CAN import MotorControl, Control_Type, DM_Motor_State, DM_variable, float_to_uint_array, \
+    uint_to_float_array, is_in_ranges
+
+
+class SimFleet:
+    def __init__(self, motor_types, inertia=1e-3, damping=1e-3, friction=0.0, dt=0.001, substeps=1, quantize=True,
+                 vel_bandwidth=200.0, pos_bandwidth=30.0, ambient=25.0):
+        """
+        :param motor_types: DM_Motor_Type of every motor 每个电机的类型
+        :param inertia: rotor plus load inertia, scalar or one per motor 转子加负载的惯量 kg*m^2
+        :param damping: viscous friction 粘滞摩擦 N*m*s/rad
+        :param friction: Coulomb friction 库仑摩擦 N*m
+        :param dt: time of one step 每步的时间 单位秒
+        :param substeps: integration steps per step 每步的积分次数
+        :param quantize: quantize commands and feedback like the wire format 按通信协议量化指令和反馈
+        :param vel_bandwidth: bandwidth of the simulated velocity loop 速度环带宽 rad/s
+        :param pos_bandwidth: bandwidth of the simulated position loop 位置环带宽 rad/s
+        :param ambient: ambient temperature 环境温度 ℃
+        """
+        self.types = np.array([int(t) for t in motor_types], np.intp)
+        n = self.n = self.types.shape[0]
+        self.limits = np.array(MotorControl.Limit_Param, np.float64)[self.types]  # PMAX VMAX TMAX, shape (n, 3)
+
+        def per_motor(x):
+            return np.broadcast_to(np.asarray(x, np.float64), (n,)).copy()
+
+        self.inertia = per_motor(inertia)
+        self.damping = per_motor(damping)
+        self.friction = per_motor(friction)
+        self.dt = dt
+        self.substeps = substeps
+        self.quantize = quantize
+        self.kv = self.inertia * vel_bandwidth
+        self.ki = self.kv * vel_bandwidth / 4
+        self.pos_bandwidth = per_motor(pos_bandwidth)
+        self.ambient = ambient
+        self.t = 0.0
+
+        self.q = np.zeros(n)
+        self.dq = np.zeros(n)
+        self.tau = np.zeros(n)  # applied torque 输出力矩
+        self.tau_ext = np.zeros(n)  # external load torque, set by the user 外部负载力矩
+        self.integ = np.zeros(n)
+        self.temp_mos = np.full(n, ambient)
+        self.temp_rotor = np.full(n, ambient)
+        self.enabled = np.zeros(n, bool)
+        self.status = np.zeros(n, np.uint8)
+        self.mode = np.full(n, int(Control_Type.MIT), np.int8)
+
+        self.kp = np.zeros(n)
+        self.kd = np.zeros(n)
+        self.q_des = np.zeros(n)
+        self.dq_des = np.zeros(n)
+        self.tau_ff = np.zeros(n)
+        self.p_des = np.zeros(n)
+        self.v_des = np.zeros(n)
+
+    def __index(self, idx):
+        if idx is None or isinstance(idx, slice):
+            return slice(None) if idx is None else idx
+        return np.asarray(idx, np.intp)
+
+    def switchControlMode(self, idx, ControlMode):
+        """
+        :param idx: motor indices, None for all 电机序号 None表示全部
+        """
+        idx = self.__index(idx)
+        self.mode[idx] = int(ControlMode)
+        self.integ[idx] = 0.0
+
+    def enable_batch(self, idx=None):
+        idx = self.__index(idx)
+        ok = self.status[idx] <= DM_Motor_State.ENABLED
+        self.enabled[idx] = ok
+        self.status[idx] = np.where(ok, DM_Motor_State.ENABLED, self.status[idx])
+        self.integ[idx] = 0.0
+
+    def disable_batch(self, idx=None):
+        idx = self.__index(idx)
+        self.enabled[idx] = False
+        self.status[idx] = np.where(self.status[idx] <= DM_Motor_State.ENABLED, DM_Motor_State.DISABLED,
+                                    self.status[idx])
+
+    def clear_error_batch(self, idx=None):
+        idx = self.__index(idx)
+        self.status[idx] = np.where(self.status[idx] > DM_Motor_State.ENABLED, DM_Motor_State.DISABLED,
+                                    self.status[idx])
+
+    def set_zero_position_batch(self, idx=None):
+        self.q[self.__index(idx)] = 0.0
+
+    def controlMIT_batch(self, idx, kp, kd, q, dq, tau):
+        """
+        MIT command 发送MIT指令
+        :param idx: motor indices, None for all 电机序号 None表示全部
+        """
+        idx = self.__index(idx)
+        limits = self.limits[idx]
+        if self.quantize:
+            self.kp[idx] = quantize(kp, 0, 500, 12)
+            self.kd[idx] = quantize(kd, 0, 5, 12)
+            self.q_des[idx] = quantize(q, -limits[:, 0], limits[:, 0], 16)
+            self.dq_des[idx] = quantize(dq, -limits[:, 1], limits[:, 1], 12)
+            self.tau_ff[idx] = quantize(tau, -limits[:, 2], limits[:, 2], 12)
+            return
+        self.kp[idx] = np.clip(kp, 0, 500)
+        self.kd[idx] = np.clip(kd, 0, 5)
+        self.q_des[idx] = np.clip(q, -limits[:, 0], limits[:, 0])
+        self.dq_des[idx] = np.clip(dq, -limits[:, 1], limits[:, 1])
+        self.tau_ff[idx] = np.clip(tau, -limits[:, 2], limits[:, 2])
+
+    def set_mit_wire(self, idx, kp_uint, kd_uint, q_uint, dq_uint, tau_uint):
+        """
+        MIT command as the integers of the wire format 以通信协议中的整数发送MIT指令
+        """
+        idx = self.__index(idx)
+        limits = self.limits[idx]
+        self.kp[idx] = uint_to_float_array(kp_uint, 0, 500, 12)
+        self.kd[idx] = uint_to_float_array(kd_uint, 0, 5, 12)
+        self.q_des[idx] = uint_to_float_array(q_uint, -limits[:, 0], limits[:, 0], 16)
+        self.dq_des[idx] = uint_to_float_array(dq_uint, -limits[:, 1], limits[:, 1], 12)
+        self.tau_ff[idx] = uint_to_float_array(tau_uint, -limits[:, 2], limits[:, 2], 12)
+
+    def control_Pos_Vel_batch(self, idx, P_desired, V_desired):
+        idx = self.__index(idx)
+        dtype = np.float32 if self.quantize else np.float64
+        self.p_des[idx] = np.asarray(P_desired, dtype)
+        self.v_des[idx] = np.asarray(V_desired, dtype)
+
+    def control_Vel_batch(self, idx, Vel_desired):
+        idx = self.__index(idx)
+        self.v_des[idx] = np.asarray(Vel_desired, np.float32 if self.quantize else np.float64)
+
+    def step(self, steps=1):
+        """
+        advance the simulation 仿真前进若干步
+        :param steps: number of steps of dt 步数
+        """
+        h = self.dt / self.substeps
+        tmax = self.limits[:, 2]
+        vmax = self.limits[:, 1]
+        mit = self.mode == Control_Type.MIT
+        pos_vel = self.mode == Control_Type.POS_VEL
+        v_lim = np.abs(self.v_des)
+        for _ in range(steps * self.substeps):
+            q, dq = self.q, self.dq
+            tau_mit = self.kp * (self.q_des - q) + self.kd * (self.dq_des - dq) + self.tau_ff
+            v_ref = np.where(pos_vel, np.minimum(np.maximum(self.pos_bandwidth * (self.p_des - q), -v_lim), v_lim),
+                             self.v_des)
+            err = v_ref - dq
+            integ = self.integ + err * h
+            tau_vel = self.kv * err + self.ki * integ
+            tau = np.where(mit, tau_mit, tau_vel)
+            saturated = np.abs(tau) > tmax
+            # no integration while saturated 饱和时停止积分
+            self.integ = np.where(mit | ~self.enabled, 0.0, np.where(saturated, self.integ, integ))
+            tau = np.minimum(np.maximum(tau, -tmax), tmax) * self.enabled
+            ddq = (tau + self.tau_ext - self.damping * dq - self.friction * np.sign(dq)) / self.inertia
+            self.dq = np.minimum(np.maximum(dq + ddq * h, -vmax), vmax)
+            self.q = q + self.dq * h
+            self.tau = tau
+            load = (tau / tmax) ** 2
+            self.temp_rotor += h * (80.0 * load - (self.temp_rotor - self.ambient)) / 30.0
+            self.temp_mos += h * (40.0 * load - (self.temp_mos - self.ambient)) / 10.0
+            self.t += h
+        hot = self.temp_rotor > 120.0
+        if hot.any():
+            self.status[hot] = DM_Motor_State.ROTOR_OVER_TEMP
+            self.enabled[hot] = False
+
+    def feedback_wire(self, idx=None):
+        """
+        feedback as the integers of the wire format 通信协议中的反馈整数
+        :return: (q_uint, dq_uint, tau_uint)
+        """
+        idx = self.__index(idx)
+        limits = self.limits[idx]
+        return (float_to_uint_array(wrap(self.q[idx], limits[:, 0]), -limits[:, 0], limits[:, 0], 16),
+                float_to_uint_array(self.dq[idx], -limits[:, 1], limits[:, 1], 12),
+                float_to_uint_array(self.tau[idx], -limits[:, 2], limits[:, 2], 12))
+
+    def feedback(self, idx=None):
+        """
+        what the motors report 电机反馈的状态
+        :return: (q, dq, tau), quantized and wrapped to ±PMAX like the wire format when quantize is set
+        设置quantize时按通信协议量化 位置回绕到±PMAX
+        """
+        idx = self.__index(idx)
+        if not self.quantize:
+            return self.q[idx].copy(), self.dq[idx].copy(), self.tau[idx].copy()
+        limits = self.limits[idx]
+        return (quantize(wrap(self.q[idx], limits[:, 0]), -limits[:, 0], limits[:, 0], 16),
+                quantize(self.dq[idx], -limits[:, 1], limits[:, 1], 12),
+                quantize(self.tau[idx], -limits[:, 2], limits[:, 2], 12))
+
+
+class SimTransport:
+    def __init__(self, fleet, slave_ids=None, master_ids=None, step_on_send=True):
+        """
+        MotorControl transport backed by a SimFleet 以SimFleet为后端的传输层
+        :param fleet: SimFleet object
+        :param slave_ids: CAN ID of every motor, default 1, 2, ... 每个电机的CAN ID
+        :param master_ids: master ID of every motor, default CAN ID + 0x10 每个电机的MasterID
+        :param step_on_send: step the fleet once for every write that carries a control frame 每次发送控制帧后仿真一步
+        """
+        self.fleet = fleet
+        n = fleet.n
+        self.slave_ids = np.arange(1, n + 1) if slave_ids is None else np.asarray(slave_ids, np.intp)
+        self.master_ids = self.slave_ids + 0x10 if master_ids is None else np.asarray(master_ids, np.intp)
+        if self.slave_ids.max() >= 0x100:
+            raise ValueError("CAN IDs of a simulated bus must be below 0x100")
+        self.row_of = np.full(0x100, -1, np.intp)
+        self.row_of[self.slave_ids] = np.arange(n)
+        self.timeout = np.zeros(n, np.uint32)
+        self.step_on_send = step_on_send
+        self.replies = []
+        self.is_open = False
+
+    def open(self):
+        self.is_open = True
+
+    def close(self):
+        self.is_open = False
+
+    def flush_output(self):
+        pass
+
+    def send_frames(self, can_ids, data):
+        can_ids = np.asarray(can_ids, np.intp).reshape(-1)
+        data = np.asarray(data, np.uint8).reshape(-1, 8)
+        fleet = self.fleet
+        for i in np.flatnonzero(can_ids == 0x7FF):
+            self.__register(data[i])
+        kind = can_ids >> 8
+        rows = np.where(can_ids < 0x400, self.row_of[can_ids & 0xff], -1)
+        known = rows >= 0
+        command = known & np.all(data[:, :7] == 0xff, axis=1) & (kind == 0)
+        for cmd, action in ((0xFC, fleet.enable_batch), (0xFD, fleet.disable_batch),
+                            (0xFE, fleet.set_zero_position_batch), (0xFB, fleet.clear_error_batch)):
+            hit = command & (data[:, 7] == cmd)
+            if hit.any():
+                action(rows[hit])
+        # a motor only takes the frames of its control mode 电机只接收当前控制模式的指令帧
+        control = known & ~command & (fleet.mode[rows] == kind + 1)
+        d = data.astype(np.intp)
+        mit = control & (kind == 0)
+        if mit.any():
+            m = d[mit]
+            fleet.set_mit_wire(rows[mit], ((m[:, 3] & 0xf) << 8) | m[:, 4], (m[:, 5] << 4) | (m[:, 6] >> 4),
+                               (m[:, 0] << 8) | m[:, 1], (m[:, 2] << 4) | (m[:, 3] >> 4),
+                               ((m[:, 6] & 0xf) << 8) | m[:, 7])
+        values = data.copy().view('<f4')
+        pos_vel = control & (kind == 1)
+        if pos_vel.any():
+            fleet.control_Pos_Vel_batch(rows[pos_vel], values[pos_vel, 0], values[pos_vel, 1])
+        vel = control & (kind == 2)
+        if vel.any():
+            fleet.control_Vel_batch(rows[vel], values[vel, 0])
+        # motors answer with the state they had when the frame arrived 电机回复收到指令时的状态
+        self.__feedback(rows[command | control])
+        if self.step_on_send and (command | control).any():
+            fleet.step()
+
+    def __feedback(self, rows):
+        if rows.size == 0:
+            return
+        fleet = self.fleet
+        q_uint, dq_uint, tau_uint = fleet.feedback_wire(rows)
+        data = np.empty((rows.size, 8), np.uint8)
+        data[:, 0] = (fleet.status[rows] << 4) | (self.slave_ids[rows] & 0xf)
+        data[:, 1] = q_uint >> 8
+        data[:, 2] = q_uint & 0xff
+        data[:, 3] = dq_uint >> 4
+        data[:, 4] = ((dq_uint & 0xf) << 4) | (tau_uint >> 8)
+        data[:, 5] = tau_uint & 0xff
+        data[:, 6] = np.clip(fleet.temp_mos[rows], 0, 255)
+        data[:, 7] = np.clip(fleet.temp_rotor[rows], 0, 255)
+        t = time.time()
+        raw = data.tobytes()
+        self.replies.extend((int(self.master_ids[row]), 0x11, raw[8 * i:8 * i + 8], t) for i, row in enumerate(rows))
+
+    def __register(self, data):
+        SlaveID = int(data[0]) | (int(data[1]) << 8)
+        row = self.row_of[SlaveID] if SlaveID < 0x100 else -1
+        if row < 0:
+            return
+        cmd, RID = int(data[2]), int(data[3])
+        if cmd == 0xCC:
+            self.__feedback(np.array([row]))
+            return
+        if cmd not in (0x33, 0x55):
+            return
+        if cmd == 0x55:
+            value = unpack('<I' if is_in_ranges(RID) else '<f', bytes(data[4:8]))[0]
+            self.__write_register(row, RID, value)
+        value = self.__read_register(row, RID)
+        if value is None:
+            return
+        reply = bytes(data[:4]) + pack('<I' if is_in_ranges(RID) else '<f', value)
+        self.replies.append((int(self.master_ids[row]), 0x11, reply, time.time()))
+
+    def __read_register(self, row, RID):
+        fleet = self.fleet
+        if RID == DM_variable.MST_ID:
+            return int(self.master_ids[row])
+        if RID == DM_variable.ESC_ID:
+            return int(self.slave_ids[row])
+        if RID == DM_variable.TIMEOUT:
+            return int(self.timeout[row])
+        if RID == DM_variable.CTRL_MODE:
+            return int(fleet.mode[row])
+        if RID in (DM_variable.PMAX, DM_variable.VMAX, DM_variable.TMAX):
+            return float(fleet.limits[row, RID - DM_variable.PMAX])
+        return None
+
+    def __write_register(self, row, RID, value):
+        fleet = self.fleet
+        if RID == DM_variable.MST_ID:
+            self.master_ids[row] = value
+        elif RID == DM_variable.ESC_ID and value < 0x100:
+            self.row_of[self.slave_ids[row]] = -1
+            self.slave_ids[row] = value
+            self.row_of[value] = row
+        elif RID == DM_variable.TIMEOUT:
+            self.timeout[row] = value
+        elif RID == DM_variable.CTRL_MODE:
+            fleet.switchControlMode([row], value)
+        elif RID in (DM_variable.PMAX, DM_variable.VMAX, DM_variable.TMAX):
+            fleet.limits[row, RID - DM_variable.PMAX] = value
+
+    def recv_frames(self, expected=0, timeout=0.0):
+        """
+        replies are ready as soon as the frames were sent 发送后回复立即可用
+        """
+        frames, self.replies = self.replies, []
+        return frames
+
+
+def quantize(x, x_min, x_max, bits):
+    """
+    round a value to the resolution of the wire format, same result as float_to_uint then uint_to_float
+    按通信协议的精度量化，结果与float_to_uint后再uint_to_float相同
+    """
+    scale = ((1 << bits) - 1) / (x_max - x_min)
+    return np.floor((np.minimum(np.maximum(x, x_min), x_max) - x_min) * scale) / scale + x_min
+
+
+def wrap(q, q_max):
+    """
+    position as the firmware reports it, wrapped into [-q_max, q_max) 固件反馈的位置 回绕到[-q_max, q_max)
+    """
+    return np.remainder(q + q_max, 2.0 * q_max) - q_max
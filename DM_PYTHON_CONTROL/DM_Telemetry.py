@@ -0,0 +1,507 @@
+"""
+telemetry recording and export 遥测记录与导出
+
+TelemetryRecorder appends motor states and commands to a chunked binary log from the control loop, the file is
+written by a background thread. The log is converted chunk by chunk to Parquet or Arrow IPC, so memory use stays
+bounded however long the log is. TelemetryRecorder在控制循环中把电机状态和指令追加到分块的二进制日志中，由后台线程写文件。
+日志按块转换为Parquet或Arrow IPC，内存占用与日志长度无关。
+
+pyarrow is only needed for the export 只有导出需要pyarrow: pip install pyarrow
+
+usage 用法:
+    python DM_Telemetry.py run.dmtl out_dir --format parquet
+    python DM_Telemetry.py run.dmtl run.arrow --format arrow
+"""
+import argparse
+import json
+import os
+import struct
+import threading
+import time
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from queue import Queue
+import numpy as np
+from DM_CAN import MotorControl, float_to_uint_array, uint_to_float_array
+
+RECORD_DTYPE = np.dtype([("t", "<f8"), ("motor_id", "<u2"), ("status", "u1"), ("temp_mos", "u1"),
+                         ("temp_rotor", "u1"), ("q", "<f4"), ("dq", "<f4"), ("tau", "<f4"), ("q_cmd", "<f4"),
+                         ("dq_cmd", "<f4"), ("tau_cmd", "<f4"), ("kp", "<f4"), ("kd", "<f4")])
+
+# raw wire integers of the compact format, see CompactRecorder 紧凑格式记录的协议原始整数
+COMPACT_DTYPE = np.dtype([("t", "<f8"), ("motor_id", "<u2"), ("status", "u1"), ("temp_mos", "u1"),
+                          ("temp_rotor", "u1"), ("cmd_mask", "u1"), ("q", "<u2"), ("dq", "<u2"), ("tau", "<u2"),
+                          ("q_cmd", "<u2"), ("dq_cmd", "<u2"), ("tau_cmd", "<u2"), ("kp", "<u2"), ("kd", "<u2")])
+# stored width of every column after delta and zigzag coding 差分和zigzag编码后每列的存储宽度
+COMPACT_COLUMNS = (("motor_id", "<u4"), ("t", "<u8"), ("status", "<u2"), ("temp_mos", "<u2"), ("temp_rotor", "<u2"),
+                   ("cmd_mask", "<u2"), ("q", "<u4"), ("dq", "<u4"), ("tau", "<u4"), ("q_cmd", "<u4"),
+                   ("dq_cmd", "<u4"), ("tau_cmd", "<u4"), ("kp", "<u4"), ("kd", "<u4"))
+# command columns: mask bit, limit column (0 PMAX, 1 VMAX, 2 TMAX) or fixed range, bits of the MIT frame
+# 指令列: 掩码位 限幅列(0 PMAX 1 VMAX 2 TMAX)或固定范围 MIT帧中的位数
+COMMAND_FIELDS = (("q_cmd", 0, 16), ("dq_cmd", 1, 12), ("tau_cmd", 2, 12), ("kp", (0.0, 500.0), 12),
+                  ("kd", (0.0, 5.0), 12))
+
+FILE_MAGIC = b"DMTL"
+CHUNK_MAGIC = b"DMCK"
+COMPACT_CHUNK_MAGIC = b"DMCZ"
+file_header = struct.Struct("<4sII")  # magic, version, length of the JSON header
+chunk_header = struct.Struct("<4sI")  # magic, rows
+compact_chunk_header = struct.Struct("<4sII")  # magic, rows, compressed bytes
+
+
+class TelemetryRecorder:
+    version = 1
+
+    def __init__(self, path, chunk_rows=65536, dtype=RECORD_DTYPE):
+        """
+        :param path: log file path 日志文件路径
+        :param chunk_rows: rows per chunk 每块的行数
+        """
+        self.path = path
+        self.dtype = dtype
+        self.chunk_rows = chunk_rows
+        self.file = open(path, "wb")
+        meta = json.dumps(self.header()).encode()
+        self.file.write(file_header.pack(FILE_MAGIC, self.version, len(meta)) + meta)
+        # two buffers: one is filled by the control loop while the other is written 双缓冲 一个记录时另一个写文件
+        self.free = Queue()
+        for _ in range(2):
+            self.free.put(np.zeros(chunk_rows, dtype))
+        self.full = Queue()
+        self.buf = self.free.get()
+        self.rows = 0
+        self.writer = threading.Thread(target=self.__write, daemon=True)
+        self.writer.start()
+
+    def header(self):
+        """
+        :return: JSON header of the log 日志的JSON文件头
+        """
+        return {"dtype": self.dtype.descr, "chunk_rows": self.chunk_rows}
+
+    def encode_chunk(self, chunk):
+        """
+        bytes of one chunk, runs on the writer thread 一块数据的字节 在写文件线程中运行
+        :return: list of buffers to write 要写入的缓冲区列表
+        """
+        return [chunk_header.pack(CHUNK_MAGIC, chunk.shape[0]), memoryview(chunk).cast("B")]
+
+    def __write(self):
+        while True:
+            item = self.full.get()
+            if item is None:
+                return
+            buf, rows = item
+            for part in self.encode_chunk(buf[:rows]):
+                self.file.write(part)
+            self.free.put(buf)
+
+    def __flush(self):
+        if self.rows == 0:
+            return
+        self.full.put((self.buf, self.rows))
+        self.rows = 0
+        if self.free.empty():
+            self.buf = np.zeros(self.chunk_rows, self.dtype)  # 写文件跟不上时临时多分配一块
+        else:
+            self.buf = self.free.get()
+
+    def record(self, Motors, q=None, dq=None, tau=None, kp=None, kd=None, t=None):
+        """
+        append the state of several motors and the command they were sent 记录多个电机的状态和发送的指令
+        :param Motors: list of Motor objects 电机对象列表
+        :param q: commanded position, scalar or one per motor, None if not sent 指令位置 未发送为None
+        :param dq: commanded velocity 指令速度
+        :param tau: commanded torque 指令力矩
+        :param kp: commanded kp
+        :param kd: commanded kd
+        :param t: time of the row, default the feedback time of each motor 时间 默认为每个电机的反馈时间
+        """
+        rows = self.next_rows(len(Motors))
+        rows["t"] = [Motor.recv_time for Motor in Motors] if t is None else t
+        rows["motor_id"] = [Motor.SlaveID for Motor in Motors]
+        rows["status"] = [Motor.status for Motor in Motors]
+        rows["temp_mos"] = [Motor.temp_mos for Motor in Motors]
+        rows["temp_rotor"] = [Motor.temp_rotor for Motor in Motors]
+        rows["q"] = [Motor.state_q for Motor in Motors]
+        rows["dq"] = [Motor.state_dq for Motor in Motors]
+        rows["tau"] = [Motor.state_tau for Motor in Motors]
+        for name, value in (("q_cmd", q), ("dq_cmd", dq), ("tau_cmd", tau), ("kp", kp), ("kd", kd)):
+            rows[name] = np.nan if value is None else value
+
+    def next_rows(self, n):
+        """
+        :return: the next n rows of the chunk buffer, a new chunk is started when they do not fit 块缓冲区中接下来的n行
+        """
+        if n > self.chunk_rows:
+            raise ValueError("more motors than rows per chunk")
+        if self.rows + n > self.chunk_rows:
+            self.__flush()
+        rows = self.buf[self.rows:self.rows + n]
+        self.rows += n
+        return rows
+
+    def close(self):
+        self.__flush()
+        self.full.put(None)
+        self.writer.join()
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class CompactRecorder(TelemetryRecorder):
+    version = 2
+
+    def __init__(self, path, Motors, chunk_rows=65536, codec=None, level=None):
+        """
+        telemetry log of the raw wire integers, several times smaller than TelemetryRecorder
+        记录协议原始整数的遥测日志 比TelemetryRecorder小数倍
+        q/dq/tau are kept as the 16/12/12 bit integers of the feedback frame and the commands as the integers of the
+        MIT frame, with the PMAX/VMAX/TMAX of every motor in the header. Every chunk is sorted by motor,
+        delta and zigzag coded, split into byte planes and compressed on the writer thread. read_log decodes it
+        back to RECORD_DTYPE. q/dq/tau保存为反馈帧中的16/12/12位整数，指令保存为MIT帧中的整数，文件头记录每个电机的
+        PMAX/VMAX/TMAX。每块数据按电机排序，差分和zigzag编码，按字节平面拆分后在写文件线程中压缩。read_log解析回RECORD_DTYPE。
+        POS_VEL/VEL setpoints are stored at the MIT resolution too, use TelemetryRecorder when that is not enough
+        POS_VEL/VEL的期望值同样按MIT精度保存 精度不够时使用TelemetryRecorder
+        :param path: log file path 日志文件路径
+        :param Motors: every motor that will be recorded, Motor objects or objects with a limits attribute
+        要记录的所有电机 电机对象或带limits属性的对象
+        :param chunk_rows: rows per chunk 每块的行数
+        :param codec: "zstd" (needs the zstandard package) or "zlib", default zstd when it is installed
+        压缩算法 默认在安装了zstandard时使用zstd
+        :param level: compression level 压缩级别
+        """
+        self.limits = {}
+        for Motor in Motors:
+            limits = getattr(Motor, "limits", None) or MotorControl.Limit_Param[Motor.MotorType]
+            self.limits[Motor.SlaveID] = tuple(float(x) for x in limits)
+        self.codec = codec or default_codec()
+        self.compress = compressor(self.codec, level)
+        super().__init__(path, chunk_rows, COMPACT_DTYPE)
+
+    def header(self):
+        meta = super().header()
+        meta.update(format="compact", codec=self.codec, record_dtype=RECORD_DTYPE.descr,
+                    motors=[[SlaveID] + list(limits) for SlaveID, limits in self.limits.items()])
+        return meta
+
+    def record(self, Motors, q=None, dq=None, tau=None, kp=None, kd=None, t=None):
+        """
+        arguments as in TelemetryRecorder.record 参数与TelemetryRecorder.record相同
+        """
+        try:
+            limits = np.array([self.limits[Motor.SlaveID] for Motor in Motors], np.float64).reshape(-1, 3)
+        except KeyError as e:
+            raise ValueError("motor 0x%02X was not given to CompactRecorder" % e.args[0]) from None
+        rows = self.next_rows(len(Motors))
+        rows["t"] = [Motor.recv_time for Motor in Motors] if t is None else t
+        rows["motor_id"] = [Motor.SlaveID for Motor in Motors]
+        rows["status"] = [Motor.status for Motor in Motors]
+        rows["temp_mos"] = [Motor.temp_mos for Motor in Motors]
+        rows["temp_rotor"] = [Motor.temp_rotor for Motor in Motors]
+        # the feedback floats came from the wire integers, rounding gives those integers back 反馈值由协议整数得到 四舍五入即可还原
+        for name, col, bits in (("q", 0, 16), ("dq", 1, 12), ("tau", 2, 12)):
+            x = np.nan_to_num(np.array([getattr(Motor, "state_" + name) for Motor in Motors], np.float64))
+            x_max = limits[:, col]
+            rows[name] = np.rint((np.clip(x, -x_max, x_max) + x_max) / (2 * x_max) * ((1 << bits) - 1))
+        mask = 0
+        for bit, (name, value) in enumerate(zip(("q_cmd", "dq_cmd", "tau_cmd", "kp", "kd"), (q, dq, tau, kp, kd))):
+            if value is None:
+                rows[name] = 0
+                continue
+            _, limit, bits = COMMAND_FIELDS[bit]
+            x_min, x_max = limit if isinstance(limit, tuple) else (-limits[:, limit], limits[:, limit])
+            rows[name] = float_to_uint_array(value, x_min, x_max, bits)  # as the MIT frame encodes it 与MIT帧的编码相同
+            mask |= 1 << bit
+        rows["cmd_mask"] = mask
+
+    def encode_chunk(self, chunk):
+        # rows of one motor next to each other, so the deltas are small; motor_id stays in row order and gives the
+        # order back 同一电机的行排在一起使差分值很小 motor_id保持原顺序用来恢复行顺序
+        order = np.argsort(chunk["motor_id"], kind="stable")
+        grouped = chunk[order]
+        parts = []
+        for name, width in COMPACT_COLUMNS:
+            if name == "motor_id":
+                column = chunk[name]
+            elif name == "t":
+                column = np.rint(grouped[name] * 1e6)  # microseconds 微秒
+            else:
+                column = grouped[name]
+            parts.append(delta_encode(column, width))
+        payload = self.compress(b"".join(parts))
+        return [compact_chunk_header.pack(COMPACT_CHUNK_MAGIC, chunk.shape[0], len(payload)), payload]
+
+
+def default_codec():
+    try:
+        import zstandard  # noqa: F401
+    except ImportError:
+        return "zlib"
+    return "zstd"
+
+
+def compressor(codec, level=None):
+    if codec == "zlib":
+        level = 6 if level is None else level
+        return lambda data: zlib.compress(data, level)
+    if codec == "zstd":
+        import zstandard
+        return zstandard.ZstdCompressor(level=3 if level is None else level).compress
+    raise ValueError("unknown codec %r" % codec)
+
+
+def decompressor(codec):
+    if codec == "zlib":
+        return zlib.decompress
+    if codec == "zstd":
+        import zstandard
+        return zstandard.ZstdDecompressor().decompress
+    raise ValueError("unknown codec %r" % codec)
+
+
+def delta_encode(column, width):
+    """
+    delta, zigzag and byte planes of an integer column 整数列的差分、zigzag编码和字节平面
+    :param width: unsigned dtype wide enough for the zigzag deltas 能容纳zigzag差分值的无符号类型
+    :return: bytes, the lowest byte of every value first 字节串 先存放所有值的最低字节
+    """
+    d = np.diff(column.astype(np.int64), prepend=np.int64(0))
+    z = ((d << 1) ^ (d >> 63)).astype(width)
+    return np.ascontiguousarray(z.view(np.uint8).reshape(-1, z.itemsize).T).tobytes()
+
+
+def delta_decode(buf, offset, rows, width):
+    """
+    inverse of delta_encode 还原delta_encode
+    :return: (int64 column, offset after it) 整数列 以及其后的偏移
+    """
+    size = np.dtype(width).itemsize
+    planes = np.frombuffer(buf, np.uint8, rows * size, offset).reshape(size, rows)
+    z = np.ascontiguousarray(planes.T).view(width).reshape(rows).astype(np.int64)
+    return np.cumsum((z >> 1) ^ -(z & 1)), offset + rows * size
+
+
+def decode_compact(payload, rows, meta, decompress):
+    """
+    one compact chunk back to RECORD_DTYPE rows 把一块紧凑格式数据解析为RECORD_DTYPE
+    """
+    buf = decompress(payload)
+    columns = {}
+    offset = 0
+    for name, width in COMPACT_COLUMNS:
+        columns[name], offset = delta_decode(buf, offset, rows, width)
+    motor_id = columns.pop("motor_id")
+    order = np.argsort(motor_id, kind="stable")
+    # limits of every row, looked up by motor_id 按motor_id查找每行的限幅
+    table = np.asarray(meta["motors"], np.float64).reshape(-1, 4)
+    lookup = np.zeros((max(int(table[:, 0].max(initial=0)), int(motor_id.max(initial=0))) + 1, 3))
+    lookup[table[:, 0].astype(np.intp)] = table[:, 1:]
+    limits = lookup[motor_id[order]]
+    grouped = np.empty(rows, RECORD_DTYPE)
+    grouped["t"] = columns["t"] / 1e6
+    for name in ("status", "temp_mos", "temp_rotor"):
+        grouped[name] = columns[name]
+    for name, col, bits in (("q", 0, 16), ("dq", 1, 12), ("tau", 2, 12)):
+        grouped[name] = uint_to_float_array(columns[name], -limits[:, col], limits[:, col], bits)
+    mask = columns["cmd_mask"]
+    for bit, (name, limit, bits) in enumerate(COMMAND_FIELDS):
+        x_min, x_max = limit if isinstance(limit, tuple) else (-limits[:, limit], limits[:, limit])
+        grouped[name] = np.where(mask & (1 << bit), uint_to_float_array(columns[name], x_min, x_max, bits), np.nan)
+    out = np.empty(rows, RECORD_DTYPE)
+    out[order] = grouped
+    out["motor_id"] = motor_id
+    return out
+
+
+def read_log(path):
+    """
+    read a telemetry log one chunk at a time, compact logs are decoded to RECORD_DTYPE
+    逐块读取遥测日志 紧凑格式的日志解析为RECORD_DTYPE
+    :return: generator of structured arrays 结构化数组的生成器
+    """
+    with open(path, "rb") as f:
+        magic, version, length = file_header.unpack(f.read(file_header.size))
+        if magic != FILE_MAGIC:
+            raise ValueError("%s is not a telemetry log" % path)
+        meta = json.loads(f.read(length))
+        if meta.get("format") == "compact":
+            decompress = decompressor(meta["codec"])
+            while True:
+                head = f.read(compact_chunk_header.size)
+                if len(head) < compact_chunk_header.size:
+                    return
+                magic, rows, size = compact_chunk_header.unpack(head)
+                if magic != COMPACT_CHUNK_MAGIC:
+                    raise ValueError("corrupt chunk in %s" % path)
+                payload = f.read(size)
+                if len(payload) < size:
+                    return  # the recorder was stopped while writing 记录时被中断 丢弃不完整的块
+                yield decode_compact(payload, rows, meta, decompress)
+        dtype = np.dtype([tuple(field) for field in meta["dtype"]])
+        while True:
+            head = f.read(chunk_header.size)
+            if len(head) < chunk_header.size:
+                return
+            magic, rows = chunk_header.unpack(head)
+            if magic != CHUNK_MAGIC:
+                raise ValueError("corrupt chunk in %s" % path)
+            chunk = np.empty(rows, dtype)
+            got = f.readinto(memoryview(chunk).cast("B"))
+            if got < chunk.nbytes:
+                # the recorder was stopped while writing 记录时被中断 丢弃不完整的块
+                return
+            yield chunk
+
+
+def arrow_schema(dtype, motor_ids=True):
+    import pyarrow as pa
+    fields = []
+    for name in dtype.names:
+        if name == "motor_id":
+            if motor_ids:
+                fields.append(pa.field(name, pa.dictionary(pa.int16(), pa.uint16())))
+            continue
+        fields.append(pa.field(name, pa.from_numpy_dtype(dtype[name])))
+    return pa.schema(fields)
+
+
+class MotorDictionary:
+    def __init__(self):
+        """
+        dictionary of the motor_id column, it only grows so every batch extends the previous one
+        motor_id列的字典 只增加不修改 每批数据的字典都是上一批的扩展
+        """
+        self.index = np.full(1 << 16, -1, np.int16)
+        self.ids = []
+
+    def encode(self, motor_ids):
+        import pyarrow as pa
+        for SlaveID in np.unique(motor_ids):
+            if self.index[SlaveID] < 0:
+                self.index[SlaveID] = len(self.ids)
+                self.ids.append(int(SlaveID))
+        return pa.DictionaryArray.from_arrays(pa.array(self.index[motor_ids]), pa.array(self.ids, pa.uint16()))
+
+
+def arrow_batch(chunk, schema, dictionary=None):
+    import pyarrow as pa
+    columns = []
+    for field in schema:
+        if field.name == "motor_id":
+            columns.append((dictionary or MotorDictionary()).encode(chunk["motor_id"]))
+        else:
+            columns.append(pa.array(np.ascontiguousarray(chunk[field.name])))
+    return pa.RecordBatch.from_arrays(columns, schema=schema)
+
+
+def export_arrow(log_path, out_path, compression="zstd"):
+    """
+    convert a telemetry log to one Arrow IPC file, buffers are compressed on all cores
+    把遥测日志转换为一个Arrow IPC文件，多核压缩
+    :param compression: "zstd", "lz4" or None
+    :return: number of rows 行数
+    """
+    import pyarrow as pa
+    rows = 0
+    writer = None
+    dictionary = MotorDictionary()
+    try:
+        for chunk in read_log(log_path):
+            if writer is None:
+                schema = arrow_schema(chunk.dtype)
+                options = pa.ipc.IpcWriteOptions(compression=compression, use_threads=True,
+                                                 emit_dictionary_deltas=True)
+                writer = pa.ipc.new_file(out_path, schema, options=options)
+            writer.write_batch(arrow_batch(chunk, schema, dictionary))
+            rows += chunk.shape[0]
+    finally:
+        if writer is not None:
+            writer.close()
+    return rows
+
+
+def export_parquet(log_path, out_path, partition=True, compression="zstd", row_group_rows=262144, threads=None):
+    """
+    convert a telemetry log to Parquet 把遥测日志转换为Parquet
+    :param out_path: directory when partitioned, else file path 分区时为目录 否则为文件路径
+    :param partition: one motor_id=<id>/part-0.parquet file per motor, written in parallel 每个电机一个文件 并行写入
+    :param compression: Parquet compression codec 压缩算法
+    :param row_group_rows: rows per row group, also bounds the memory per motor 每个行组的行数 也限制了每个电机占用的内存
+    :param threads: writer threads, default the number of cores 写入线程数 默认CPU核数
+    :return: number of rows 行数
+    """
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    rows = 0
+    writers = {}
+    pending = {}  # motor_id -> [record batches not written yet] 还没有写入的数据
+    pending_rows = {}
+    pool = ThreadPoolExecutor(threads or os.cpu_count())
+
+    def write(key, batches):
+        writers[key].write_table(pa.Table.from_batches(batches))
+
+    try:
+        for chunk in read_log(log_path):
+            rows += chunk.shape[0]
+            if not partition:
+                if None not in writers:
+                    schema = arrow_schema(chunk.dtype)
+                    writers[None] = pq.ParquetWriter(out_path, schema, compression=compression)
+                    pending[None], pending_rows[None] = [], 0
+                groups = [(None, chunk)]
+            else:
+                schema = arrow_schema(chunk.dtype, motor_ids=False)
+                order = np.argsort(chunk["motor_id"], kind="stable")
+                ids, starts = np.unique(chunk["motor_id"][order], return_index=True)
+                groups = [(int(SlaveID), chunk[part]) for SlaveID, part in zip(ids, np.split(order, starts[1:]))]
+                for key, _ in groups:
+                    if key not in writers:
+                        path = os.path.join(out_path, "motor_id=%d" % key)
+                        os.makedirs(path, exist_ok=True)
+                        writers[key] = pq.ParquetWriter(os.path.join(path, "part-0.parquet"), schema,
+                                                        compression=compression)
+                        pending[key], pending_rows[key] = [], 0
+            jobs = []
+            for key, part in groups:
+                pending[key].append(arrow_batch(part, writers[key].schema))
+                pending_rows[key] += part.shape[0]
+                if pending_rows[key] >= row_group_rows:
+                    jobs.append(pool.submit(write, key, pending[key]))
+                    pending[key], pending_rows[key] = [], 0
+            for job in jobs:
+                job.result()
+        jobs = [pool.submit(write, key, batches) for key, batches in pending.items() if batches]
+        for job in jobs:
+            job.result()
+    finally:
+        pool.shutdown()
+        for writer in writers.values():
+            writer.close()
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description="convert a DM telemetry log 转换遥测日志")
+    parser.add_argument("log", help="telemetry log 遥测日志")
+    parser.add_argument("out", help="output file or directory 输出文件或目录")
+    parser.add_argument("--format", choices=("parquet", "arrow"), default="parquet")
+    parser.add_argument("--no-partition", action="store_true", help="one Parquet file for all motors 所有电机写入一个文件")
+    parser.add_argument("--compression", default="zstd")
+    args = parser.parse_args()
+    start = time.perf_counter()
+    if args.format == "arrow":
+        rows = export_arrow(args.log, args.out, args.compression)
+    else:
+        rows = export_parquet(args.log, args.out, not args.no_partition, args.compression)
+    print("%d rows in %.1f s" % (rows, time.perf_counter() - start))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,153 @@
+from time import perf_counter, sleep
+import numpy as np
+from DM_CAN import Control_Type
+
+
+class Trajectory:
+    def __init__(self, t, q, dq=None, tau=None, inertia=None):
+        """
+        piecewise cubic trajectory of several motors 多个电机的分段三次曲线轨迹
+        :param t: waypoint times, shape (k,) 路点时间 单位秒
+        :param q: waypoint positions, shape (k, n) 路点位置 每列一个电机
+        :param dq: waypoint velocities, shape (k, n), default from finite differences 路点速度 默认由差分计算
+        :param tau: feed-forward torque at the waypoints, linearly interpolated 路点前馈力矩 线性插值
+        :param inertia: per motor inertia, adds inertia * ddq to the feed-forward torque 每个电机的惯量 前馈力矩加上inertia*ddq
+        """
+        t = np.asarray(t, np.float64)
+        q = np.asarray(q, np.float64).reshape(t.shape[0], -1)
+        if dq is None:
+            dq = np.gradient(q, t, axis=0)
+        dq = np.asarray(dq, np.float64).reshape(q.shape)
+        h = np.diff(t)[:, None]
+        p0, p1 = q[:-1], q[1:]
+        m0, m1 = dq[:-1] * h, dq[1:] * h
+        # Hermite to power basis in the normalized segment time s in [0, 1]
+        coeffs = np.stack([p0, m0, -3 * p0 + 3 * p1 - 2 * m0 - m1, 2 * p0 - 2 * p1 + m0 + m1], axis=1)
+        self.__setup(t, coeffs, tau, inertia)
+
+    @classmethod
+    def from_coefficients(cls, t, coeffs, tau=None, inertia=None):
+        """
+        trajectory from cubic spline segments 由三次样条分段系数构造轨迹
+        :param t: segment boundaries, shape (k,) 分段边界时间
+        :param coeffs: shape (k - 1, 4, n), segment i is c0 + c1*s + c2*s^2 + c3*s^3 with s = (t - t[i]) / (t[i+1] - t[i])
+        第i段为 c0 + c1*s + c2*s^2 + c3*s^3，s为段内归一化时间
+        """
+        self = cls.__new__(cls)
+        self.__setup(np.asarray(t, np.float64), np.asarray(coeffs, np.float64), tau, inertia)
+        return self
+
+    def __setup(self, t, coeffs, tau, inertia):
+        self.t = t
+        self.coeffs = coeffs
+        self.h = np.diff(t)
+        self.n = coeffs.shape[2]
+        self.tau = None if tau is None else np.asarray(tau, np.float64).reshape(t.shape[0], self.n)
+        self.inertia = None if inertia is None else np.broadcast_to(np.asarray(inertia, np.float64), (self.n,))
+
+    @property
+    def duration(self):
+        return self.t[-1] - self.t[0]
+
+    def evaluate(self, times):
+        """
+        evaluate every motor at several times 计算所有电机在多个时刻的期望值
+        times outside the trajectory hold the end points 超出范围的时刻保持端点
+        :param times: shape (m,) 时刻
+        :return: (q, dq, ddq, tau_ff) each shape (m, n)
+        """
+        times = np.clip(np.asarray(times, np.float64).reshape(-1), self.t[0], self.t[-1])
+        seg = np.clip(np.searchsorted(self.t, times, side="right") - 1, 0, self.h.shape[0] - 1)
+        h = self.h[seg][:, None]
+        s = ((times - self.t[seg]) / self.h[seg])[:, None]
+        c = self.coeffs[seg]
+        q = c[:, 0] + s * (c[:, 1] + s * (c[:, 2] + s * c[:, 3]))
+        dq = (c[:, 1] + s * (2 * c[:, 2] + s * 3 * c[:, 3])) / h
+        ddq = (2 * c[:, 2] + 6 * s * c[:, 3]) / (h * h)
+        tau_ff = np.zeros_like(q)
+        if self.tau is not None:
+            tau_ff += self.tau[seg] + s * (self.tau[seg + 1] - self.tau[seg])
+        if self.inertia is not None:
+            tau_ff += self.inertia * ddq
+        return q, dq, ddq, tau_ff
+
+
+class TrajectoryStreamer:
+    def __init__(self, motor_control, Motors, trajectory, mode=Control_Type.MIT, kp=0.0, kd=0.0, dt=0.001,
+                 block=100, v_min=0.1):
+        """
+        stream a trajectory to several motors through the batched send path 通过批量发送接口把轨迹发给多个电机
+        setpoints are computed a block of ticks at a time, the next block is prepared right after the send of
+        the tick that starts the current one 期望值按块计算，下一块在当前块第一个周期发送后立即预先计算
+        :param motor_control: MotorControl object 电机控制对象
+        :param Motors: list of Motor objects, one per trajectory column 电机对象列表 与轨迹的列对应
+        :param trajectory: Trajectory object 轨迹对象
+        :param mode: Control_Type.MIT, POS_VEL or VEL 控制模式
+        :param kp: MIT kp, scalar or one per motor
+        :param kd: MIT kd, scalar or one per motor
+        :param dt: tick period 控制周期 单位秒
+        :param block: ticks per precomputed block 每块的周期数
+        :param v_min: POS_VEL speed limit used where the trajectory is at rest 位置速度模式下轨迹静止时使用的最小速度
+        """
+        if trajectory.n != len(Motors):
+            raise ValueError("trajectory has %d columns but %d motors were given" % (trajectory.n, len(Motors)))
+        self.motor_control = motor_control
+        self.Motors = list(Motors)
+        self.trajectory = trajectory
+        self.mode = mode
+        self.kp = kp
+        self.kd = kd
+        self.dt = dt
+        self.block = block
+        self.v_min = v_min
+        self.ticks = int(np.ceil(trajectory.duration / dt)) + 1
+        self.overruns = 0
+        self.current = self.__compute(0)
+        self.next = self.__compute(block)
+
+    def __compute(self, start):
+        times = self.trajectory.t[0] + self.dt * np.arange(start, min(start + self.block, self.ticks))
+        q, dq, _, tau_ff = self.trajectory.evaluate(times)
+        return start, q, dq, tau_ff
+
+    def step(self, k):
+        """
+        send the setpoints of tick k 发送第k个周期的期望值
+        """
+        start, q, dq, tau_ff = self.current
+        if k >= start + q.shape[0] or k < start:
+            if self.next[0] <= k < self.next[0] + self.next[1].shape[0]:
+                self.current = self.next
+            else:
+                self.current = self.__compute(k - k % self.block)
+            start, q, dq, tau_ff = self.current
+            prepare = True
+        else:
+            prepare = False
+        i = k - start
+        if self.mode == Control_Type.MIT:
+            self.motor_control.controlMIT_batch(self.Motors, self.kp, self.kd, q[i], dq[i], tau_ff[i])
+        elif self.mode == Control_Type.POS_VEL:
+            self.motor_control.control_Pos_Vel_batch(self.Motors, q[i], np.maximum(np.abs(dq[i]), self.v_min))
+        elif self.mode == Control_Type.VEL:
+            self.motor_control.control_Vel_batch(self.Motors, dq[i])
+        else:
+            raise ValueError("unsupported control mode %r" % (self.mode,))
+        if prepare:
+            # lookahead: the next block is ready long before it is needed 提前准备下一块
+            self.next = self.__compute(start + q.shape[0])
+
+    def run(self):
+        """
+        stream the whole trajectory in real time 按实时周期发送整条轨迹
+        :return: number of ticks that missed their deadline 超时的周期数
+        """
+        t0 = perf_counter()
+        for k in range(self.ticks):
+            self.step(k)
+            wait = t0 + (k + 1) * self.dt - perf_counter()
+            if wait > 0:
+                sleep(wait)
+            else:
+                self.overruns += 1
+        return self.overruns
@@ -0,0 +1,165 @@
+import numpy as np
+
+
+class JointTransform:
+    def __init__(self, n, gear=1.0, direction=1, offset=0.0, coupling=None):
+        """
+        joint space to motor space 关节空间到电机空间的变换
+        q_motor = A q_joint + offset, dq_motor = A dq_joint, tau_motor = A^-T tau_joint, A = diag(gear * direction) C
+        :param n: number of joints, equal to the number of motors 关节数 与电机数相同
+        :param gear: motor turns per joint turn, scalar or one per motor 减速比 标量或每个电机一个
+        :param direction: 1 or -1, scalar or one per motor 方向 1或-1
+        :param offset: motor position at joint zero 关节零点对应的电机位置
+        :param coupling: (n, n) matrix C of differential/parallel linkages, default identity 差动/并联机构的耦合矩阵 默认单位矩阵
+        """
+        self.n = n
+        scale = (np.broadcast_to(np.asarray(gear, np.float64), (n,)) *
+                 np.broadcast_to(np.asarray(direction, np.float64), (n,)))
+        self.offset = np.broadcast_to(np.asarray(offset, np.float64), (n,)).copy()
+        if coupling is None:
+            A = np.diag(scale)
+        else:
+            coupling = np.asarray(coupling, np.float64)
+            if coupling.shape != (n, n):
+                raise ValueError("coupling matrix must be (%d, %d), not %r" % (n, n, coupling.shape))
+            A = scale[:, None] * coupling
+        if np.linalg.matrix_rank(A) < n:
+            raise ValueError("joint to motor transform is singular")
+        self.A = A
+        self.A_inv = np.linalg.inv(A)
+        # diagonal transforms stay element-wise, no matrix multiply 对角变换按元素计算 不做矩阵乘法
+        self.diagonal = not np.any(A - np.diag(np.diagonal(A)))
+        self.scale = np.diagonal(A).copy()
+
+    def to_motor(self, q=None, dq=None, tau=None):
+        """
+        joint commands to motor commands, None stays None 关节指令转换为电机指令 None保持为None
+        :return: (q, dq, tau) in motor space
+        """
+        if self.diagonal:
+            return (None if q is None else np.multiply(self.scale, q) + self.offset,
+                    None if dq is None else np.multiply(self.scale, dq),
+                    None if tau is None else np.divide(tau, self.scale))
+        if q is not None and dq is not None:
+            # position and velocity in one multiply 位置和速度一次矩阵乘法
+            x = self.A @ np.stack((np.broadcast_to(np.asarray(q, np.float64), (self.n,)),
+                                   np.broadcast_to(np.asarray(dq, np.float64), (self.n,))), 1)
+            q, dq = x[:, 0] + self.offset, x[:, 1]
+        else:
+            q = None if q is None else self.A @ np.broadcast_to(np.asarray(q, np.float64), (self.n,)) + self.offset
+            dq = None if dq is None else self.A @ np.broadcast_to(np.asarray(dq, np.float64), (self.n,))
+        tau = None if tau is None else self.A_inv.T @ np.broadcast_to(np.asarray(tau, np.float64), (self.n,))
+        return q, dq, tau
+
+    def to_joint(self, q=None, dq=None, tau=None):
+        """
+        motor states to joint states 电机状态转换为关节状态
+        :return: (q, dq, tau) in joint space
+        """
+        if self.diagonal:
+            return (None if q is None else (q - self.offset) / self.scale,
+                    None if dq is None else dq / self.scale,
+                    None if tau is None else tau * self.scale)
+        if q is not None and dq is not None:
+            x = self.A_inv @ np.stack((q - self.offset, dq), 1)
+            q, dq = x[:, 0], x[:, 1]
+        else:
+            q = None if q is None else self.A_inv @ (q - self.offset)
+            dq = None if dq is None else self.A_inv @ dq
+        tau = None if tau is None else self.A.T @ tau
+        return q, dq, tau
+
+    def gains_to_motor(self, kp=None, kd=None):
+        """
+        joint stiffness/damping to the per-motor MIT kp/kd 关节刚度/阻尼转换为每个电机的MIT kp/kd
+        K_motor = A^-T K_joint A^-1, the motors take its diagonal, exact when there is no coupling
+        电机只能使用其对角线 没有耦合时是精确的
+        :param kp: joint stiffness, scalar, one per joint or (n, n) 关节刚度
+        :param kd: joint damping 关节阻尼
+        :return: (kp, kd) one per motor
+        """
+        out = []
+        for K in (kp, kd):
+            if K is None:
+                out.append(None)
+                continue
+            K = np.asarray(K, np.float64)
+            if self.diagonal and K.ndim < 2:
+                out.append(K / (self.scale * self.scale))
+                continue
+            if K.ndim < 2:
+                K = np.diag(np.broadcast_to(K, (self.n,)))
+            out.append(np.diagonal(self.A_inv.T @ K @ self.A_inv).copy())
+        return tuple(out)
+
+
+class JointSpace:
+    def __init__(self, motor_control, Motors, transform, estimator=None):
+        """
+        control a motor group in joint space 在关节空间控制一组电机
+        commands are converted before the batched send, the joint state is updated after every decoded block of
+        feedback 指令在批量发送前转换，每解析完一批反馈就更新关节状态
+        :param motor_control: MotorControl object 电机控制对象
+        :param Motors: list of Motor objects, one per joint 电机对象列表 每个关节一个
+        :param transform: JointTransform
+        :param estimator: DM_Estimator.StateEstimator of the same motors, its multi-turn q/dq are used for the joint
+        state, needed when the gear ratio turns the motor past PMAX 同一组电机的状态估计器 使用其多圈位置和速度
+        减速比使电机转过PMAX时需要
+        """
+        self.motor_control = motor_control
+        self.Motors = list(Motors)
+        if transform.n != len(self.Motors):
+            raise ValueError("transform has %d joints for %d motors" % (transform.n, len(self.Motors)))
+        self.transform = transform
+        self.estimator = estimator
+        n = len(self.Motors)
+        self.q = np.zeros(n)  # joint state 关节状态
+        self.dq = np.zeros(n)
+        self.tau = np.zeros(n)
+        motor_control.decode_listeners.append(self.update)
+        self.update()
+
+    def close(self):
+        self.motor_control.decode_listeners.remove(self.update)
+
+    def update(self):
+        """
+        joint state from the last feedback 根据最近的反馈更新关节状态
+        """
+        n = len(self.Motors)
+        tau = np.fromiter((Motor.state_tau for Motor in self.Motors), np.float64, n)
+        if self.estimator is not None:
+            self.estimator.update()  # only takes new samples, so it is safe to call twice 只处理新样本 重复调用没有影响
+            q, dq = self.estimator.q, self.estimator.dq
+        else:
+            q = np.fromiter((Motor.state_q for Motor in self.Motors), np.float64, n)
+            dq = np.fromiter((Motor.state_dq for Motor in self.Motors), np.float64, n)
+        self.q, self.dq, self.tau = self.transform.to_joint(q, dq, tau)
+
+    def state(self):
+        """
+        :return: (q, dq, tau) of the joints 关节的位置 速度 力矩
+        """
+        return self.q, self.dq, self.tau
+
+    def controlMIT_batch(self, kp, kd, q, dq, tau, timeout=None):
+        """
+        MIT control in joint space, arguments as MotorControl.controlMIT_batch 关节空间的MIT控制
+        kp/kd are joint gains, see JointTransform.gains_to_motor 关节增益
+        """
+        q, dq, tau = self.transform.to_motor(q, dq, tau)
+        kp, kd = self.transform.gains_to_motor(kp, kd)
+        return self.motor_control.controlMIT_batch(self.Motors, kp, kd, q, dq, tau, timeout)
+
+    def control_Pos_Vel_batch(self, P_desired, V_desired, timeout=None):
+        """
+        position control in joint space, V_desired is the joint speed limit 关节空间的位置速度控制 V_desired为关节速度上限
+        """
+        P_desired, V_desired, _ = self.transform.to_motor(P_desired, V_desired)
+        return self.motor_control.control_Pos_Vel_batch(self.Motors, P_desired, np.abs(V_desired), timeout)
+
+    def control_Vel_batch(self, Vel_desired, timeout=None):
+        """
+        velocity control in joint space 关节空间的速度控制
+        """
+        return self.motor_control.control_Vel_batch(self.Motors, self.transform.to_motor(dq=Vel_desired)[1], timeout)
@@ -0,0 +1,295 @@
+"""
+transports for MotorControl 电机控制对象的传输层
+
+A transport moves raw CAN frames, MotorControl does the encoding and decoding. Any object with these methods can be
+passed to MotorControl instead of a serial object 传输层只负责收发CAN帧，编解码由MotorControl完成。实现下面这些方法的对象
+都可以代替串口对象传给MotorControl:
+
+    open() / close()
+    send_frames(can_ids, data)   data shape (n, 8)
+    recv_frames(expected=0, timeout=0.0) -> [(CANID, CMD, data, t), ...]
+        CMD is 0x11 for a received CAN frame, t is time.time(); when expected > 0 wait up to timeout for that many frames
+        CMD为0x11表示收到的CAN帧，t为time.time()时间戳；expected大于0时最多等待timeout直到收到这么多帧
+        CMD RX_STALE (DM_Codec) marks a frame sent before the last command reached the motor, it is not a reply
+        CMD为RX_STALE(DM_Codec)表示该帧在最近的命令到达电机之前发出 不算作回复
+    flush_output()               optional, drop frames not sent yet, used by emergency_stop 可选 丢弃还没有发出的帧 急停时使用
+"""
+import fcntl
+import os
+import select
+import socket
+import struct
+import sys
+import termios
+from time import time, monotonic
+import numpy as np
+from DM_CAN import SerialTransport
+
+
+class SocketCANTransport:
+    CAN_EFF_FLAG = 0x80000000
+    CAN_RTR_FLAG = 0x40000000
+    CAN_ERR_FLAG = 0x20000000
+    CAN_SFF_MASK = 0x000007FF
+    CAN_EFF_MASK = 0x1FFFFFFF
+    SO_TIMESTAMPNS = getattr(socket, "SO_TIMESTAMPNS", 35)
+    can_frame = struct.Struct("=IB3x8s")
+    timespec = struct.Struct("=qq")
+
+    def __init__(self, channel="can0", timestamps=True, rcvbuf=1 << 20):
+        """
+        native Linux CAN interface 使用Linux原生CAN接口(SocketCAN)
+        test without hardware on a virtual interface 无硬件时可以使用虚拟接口测试:
+            sudo ip link add dev vcan0 type vcan && sudo ip link set up vcan0
+        :param channel: interface name 接口名称 例如 can0 vcan0
+        :param timestamps: use kernel receive timestamps 使用内核接收时间戳
+        :param rcvbuf: socket receive buffer size 接收缓冲区大小
+        """
+        self.channel = channel
+        self.timestamps = timestamps
+        self.rcvbuf = rcvbuf
+        self.sock = None
+        self.ancbufsize = socket.CMSG_SPACE(self.timespec.size)
+        self.rx_buf = bytearray(self.can_frame.size)
+
+    @property
+    def is_open(self):
+        return self.sock is not None
+
+    def open(self):
+        if self.sock is not None:
+            self.close()
+        self.sock = socket.socket(socket.AF_CAN, socket.SOCK_RAW, socket.CAN_RAW)
+        if self.rcvbuf:
+            self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, self.rcvbuf)
+        if self.timestamps:
+            self.sock.setsockopt(socket.SOL_SOCKET, self.SO_TIMESTAMPNS, 1)
+        # 只接收正常的数据帧
+        self.sock.setsockopt(socket.SOL_CAN_RAW, socket.CAN_RAW_ERR_FILTER, 0)
+        self.sock.bind((self.channel,))
+        self.sock.setblocking(False)
+
+    def close(self):
+        if self.sock is not None:
+            self.sock.close()
+            self.sock = None
+
+    def send_frames(self, can_ids, data):
+        """
+        send CAN frames 发送多个CAN帧
+        all frames are packed into one buffer first, then handed to the kernel back to back
+        先把所有帧打包到一个缓冲区，再连续交给内核发送
+        :param can_ids: CAN ID of every frame 每一帧的CAN ID
+        :param data: frame data, shape (n, 8) 每一帧的数据
+        """
+        can_ids = np.asarray(can_ids, np.uint32).reshape(-1)
+        n = can_ids.shape[0]
+        frames = np.zeros((n, 4), np.uint32)
+        frames[:, 0] = np.where(can_ids > self.CAN_SFF_MASK, can_ids | self.CAN_EFF_FLAG, can_ids)
+        frames[:, 1] = 8
+        frames.view(np.uint8)[:, 8:16] = np.asarray(data, np.uint8).reshape(-1, 8)
+        view = memoryview(frames.view(np.uint8).reshape(-1))
+        size = self.can_frame.size
+        for i in range(n):
+            while True:
+                try:
+                    self.sock.send(view[i * size:(i + 1) * size])
+                    break
+                except BlockingIOError:
+                    # TX queue full, wait until the kernel has room 发送队列满，等待内核腾出空间
+                    select.select([], [self.sock], [], 0.01)
+
+    def recv_frames(self, expected=0, timeout=0.0):
+        """
+        drain every frame queued in the kernel 读取内核中排队的所有帧
+        :param expected: wait until this many frames have arrived 等待收到的帧数
+        :param timeout: longest wait 最长等待时间 单位秒
+        :return: list of (CANID, 0x11, data, t), t is the kernel receive timestamp 内核接收时间戳
+        """
+        frames = []
+        self.__drain(frames)
+        if expected > 0 and timeout > 0:
+            deadline = monotonic() + timeout
+            while len(frames) < expected:
+                remaining = deadline - monotonic()
+                if remaining <= 0 or not self.wait(remaining):
+                    break
+                self.__drain(frames)
+        return frames
+
+    def __drain(self, frames):
+        while True:
+            try:
+                nbytes, ancdata, _, _ = self.sock.recvmsg_into([self.rx_buf], self.ancbufsize)
+            except BlockingIOError:
+                return
+            if nbytes < self.can_frame.size:
+                continue
+            can_id, dlc, payload = self.can_frame.unpack_from(self.rx_buf)
+            if can_id & (self.CAN_RTR_FLAG | self.CAN_ERR_FLAG):
+                continue
+            t = None
+            for level, kind, cdata in ancdata:
+                if level == socket.SOL_SOCKET and kind == self.SO_TIMESTAMPNS:
+                    sec, nsec = self.timespec.unpack_from(cdata)
+                    t = sec + nsec * 1e-9
+            if t is None:
+                t = time()
+            mask = self.CAN_EFF_MASK if can_id & self.CAN_EFF_FLAG else self.CAN_SFF_MASK
+            frames.append((can_id & mask, 0x11, payload[:dlc].ljust(8, b"\x00"), t))
+
+    def wait(self, timeout):
+        """
+        block until a frame is readable or timeout 等待直到有数据可读或超时
+        :param timeout: seconds 单位秒
+        :return: True if readable 有数据可读返回True
+        """
+        readable, _, _ = select.select([self.sock], [], [], max(timeout, 0))
+        return bool(readable)
+
+
+class TermiosSerial:
+    TIOCGSERIAL = 0x541E
+    TIOCSSERIAL = 0x541F
+    ASYNC_LOW_LATENCY = 1 << 13
+    IOSSIOSPEED = 0x80045402  # macOS custom baud rate
+
+    def __init__(self, port, baudrate=921600, low_latency=True, bufsize=4096):
+        """
+        raw tty port without pyserial 不经过pyserial的原始串口
+        the tty is put in raw mode with VMIN=0/VTIME=0, waiting is done with select and a deadline so that a reply
+        is picked up as soon as its last byte arrives 串口设为原始模式且VMIN=0/VTIME=0，用select按截止时间等待，
+        回复的最后一个字节一到就能读取
+        :param port: tty path 串口路径 例如 /dev/ttyACM0
+        :param baudrate: baud rate 波特率
+        :param low_latency: set ASYNC_LOW_LATENCY where the driver supports it 在驱动支持时设置低延迟标志
+        :param bufsize: initial receive buffer size 接收缓冲区初始大小
+        """
+        self.port = port
+        self.baudrate = baudrate
+        self.low_latency = low_latency
+        self.fd = None
+        self.buf = bytearray(bufsize)
+        self.view = memoryview(self.buf)
+        self.fill = 0  # bytes read from the tty but not handed out yet 已读取但还没有取走的字节数
+        self.nread = bytearray(4)
+
+    @property
+    def is_open(self):
+        return self.fd is not None
+
+    def open(self):
+        if self.fd is not None:
+            self.close()
+        fd = os.open(self.port, os.O_RDWR | os.O_NOCTTY | os.O_NONBLOCK)
+        try:
+            iflag, oflag, cflag, lflag, ispeed, ospeed, cc = termios.tcgetattr(fd)
+            iflag &= ~(termios.IGNBRK | termios.BRKINT | termios.PARMRK | termios.ISTRIP | termios.INLCR |
+                       termios.IGNCR | termios.ICRNL | termios.IXON | termios.IXOFF | termios.IXANY)
+            oflag &= ~termios.OPOST
+            lflag &= ~(termios.ECHO | termios.ECHONL | termios.ICANON | termios.ISIG | termios.IEXTEN)
+            cflag &= ~(termios.CSIZE | termios.PARENB | termios.CSTOPB)
+            cflag |= termios.CS8 | termios.CREAD | termios.CLOCAL
+            cc[termios.VMIN] = 0
+            cc[termios.VTIME] = 0
+            speed = getattr(termios, "B%d" % self.baudrate, None)
+            if speed is not None:
+                ispeed = ospeed = speed
+            termios.tcsetattr(fd, termios.TCSANOW, [iflag, oflag, cflag, lflag, ispeed, ospeed, cc])
+            if speed is None:
+                if sys.platform != "darwin":
+                    raise ValueError("unsupported baud rate %d" % self.baudrate)
+                fcntl.ioctl(fd, self.IOSSIOSPEED, struct.pack("I", self.baudrate))
+            termios.tcflush(fd, termios.TCIOFLUSH)
+        except Exception:
+            os.close(fd)
+            raise
+        self.fd = fd
+        if self.low_latency:
+            self.__set_low_latency()
+        self.fill = 0
+
+    def __set_low_latency(self):
+        if not sys.platform.startswith("linux"):
+            return False
+        serial_struct = bytearray(128)
+        try:
+            fcntl.ioctl(self.fd, self.TIOCGSERIAL, serial_struct, True)
+            flags = struct.unpack_from("i", serial_struct, 16)[0]
+            struct.pack_into("i", serial_struct, 16, flags | self.ASYNC_LOW_LATENCY)
+            fcntl.ioctl(self.fd, self.TIOCSSERIAL, serial_struct)
+        except OSError:
+            return False  # e.g. cdc_acm and pseudo terminals 例如cdc_acm驱动和伪终端不支持
+        return True
+
+    def close(self):
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+
+    def write(self, data):
+        view = memoryview(data).cast("B")
+        while view:
+            try:
+                n = os.write(self.fd, view)
+            except BlockingIOError:
+                select.select([], [self.fd], [], 0.01)
+                continue
+            view = view[n:]
+
+    def reset_output_buffer(self):
+        termios.tcflush(self.fd, termios.TCOFLUSH)
+
+    @property
+    def in_waiting(self):
+        fcntl.ioctl(self.fd, termios.FIONREAD, self.nread, True)
+        return self.fill + struct.unpack("i", self.nread)[0]
+
+    def __fill(self):
+        while True:
+            if self.fill == len(self.buf):
+                self.view.release()
+                self.buf.extend(bytes(len(self.buf)))
+                self.view = memoryview(self.buf)
+            try:
+                n = os.readv(self.fd, [self.view[self.fill:]])
+            except BlockingIOError:
+                return
+            if n == 0:
+                return
+            self.fill += n
+
+    def wait_bytes(self, nbytes, deadline):
+        """
+        wait until nbytes are buffered or the deadline passes 等待直到缓冲了nbytes字节或超过截止时间
+        :param nbytes: number of bytes 字节数
+        :param deadline: time.monotonic() deadline 截止时间
+        :return: True if enough bytes arrived 收到足够字节返回True
+        """
+        self.__fill()
+        while self.fill < nbytes:
+            remaining = deadline - monotonic()
+            if remaining <= 0:
+                return False
+            select.select([self.fd], [], [], remaining)
+            self.__fill()
+        return True
+
+    def read_all(self):
+        self.__fill()
+        data = bytes(self.view[:self.fill])
+        self.fill = 0
+        return data
+
+
+class TermiosSerialTransport(SerialTransport):
+    def __init__(self, port, baudrate=921600, low_latency=True):
+        """
+        DM USB-CAN serial framing over a raw termios tty 使用原始termios串口的达妙USB转CAN协议
+        use together with MotorControl.reply_timeout so control calls return with the fresh feedback
+        配合MotorControl.reply_timeout使用，控制函数返回时就能拿到本次的反馈
+        :param port: tty path 串口路径
+        :param baudrate: baud rate 波特率
+        :param low_latency: set ASYNC_LOW_LATENCY where supported 在支持时设置低延迟标志
+        """
+        super().__init__(TermiosSerial(port, baudrate, low_latency))
@@ -0,0 +1,205 @@
+import time
+from collections import deque
+from time import monotonic
+import numpy as np
+from DM_CAN import DM_Motor_State
+
+
+class WatchdogEvent:
+    def __init__(self, kind, Motor, status, age, t):
+        """
+        :param kind: FaultWatchdog.FAULT, LOST, ... 事件类型
+        :param Motor: Motor object 电机对象
+        :param status: last status code 最近的状态码
+        :param age: seconds since the last feedback 距离上次反馈的时间
+        :param t: time.time() of the event 事件时间
+        """
+        self.kind = kind
+        self.Motor = Motor
+        self.status = status
+        self.age = age
+        self.t = t
+
+    def __repr__(self):
+        try:
+            status = DM_Motor_State(self.status).name
+        except ValueError:
+            status = "0x%X" % self.status
+        return "WatchdogEvent(%s, SlaveID=0x%02X, status=%s, age=%.4f)" % (self.kind, self.Motor.SlaveID, status,
+                                                                          self.age)
+
+
+class FaultWatchdog:
+    FAULT = "fault"  # the feedback reports an error code 反馈帧报告错误
+    FAULT_CLEARED = "fault_cleared"  # the error code went away 错误消失
+    LOST = "lost"  # no feedback for missed_ticks ticks 连续missed_ticks个周期没有反馈
+    RESTORED = "restored"  # feedback again after LOST 通讯恢复
+    RECOVERING = "recovering"  # clear error and re-enable sent 已发送清除错误和重新使能
+    RECOVERED = "recovered"  # enabled again 重新使能成功
+    GAVE_UP = "gave_up"  # max_attempts recoveries failed 恢复失败次数达到上限
+
+    def __init__(self, motor_control, Motors, missed_ticks=3, max_age=None, auto_recover=False, settle=0.01,
+                 confirm=0.05, backoff=0.1, backoff_max=2.0, max_attempts=5, on_event=None):
+        """
+        communication loss and fault detection for a motor group, with optional automatic recovery
+        电机组的通讯丢失和故障检测 可以自动恢复
+        error codes are checked as soon as each block of feedback is decoded, communication loss once per tick()
+        每解析完一批反馈就检查错误码，每次tick()检查通讯丢失
+        :param motor_control: MotorControl object 电机控制对象
+        :param Motors: list of Motor objects 电机对象列表
+        :param missed_ticks: ticks without new feedback before LOST 连续多少个周期没有新反馈判定为丢失
+        :param max_age: also LOST when the last feedback is older than this, seconds, None to only count ticks
+        反馈超过该时间也判定为丢失 单位秒 None表示只按周期计数
+        :param auto_recover: clear the error and re-enable motors that faulted while enabled 对使能时出错的电机自动清除错误并重新使能
+        :param settle: delay between clear error and enable 清除错误到重新使能的间隔 单位秒
+        :param confirm: time for the motor to report enabled 等待电机回复使能的时间 单位秒
+        :param backoff: delay before the next attempt, doubled after each failure 下次尝试前的等待时间 每次失败后加倍
+        :param backoff_max: longest delay between attempts 最长等待时间
+        :param max_attempts: failed attempts before GAVE_UP 失败多少次后放弃
+        :param on_event: called as on_event(WatchdogEvent) 事件回调
+        """
+        self.motor_control = motor_control
+        self.Motors = list(Motors)
+        n = len(self.Motors)
+        self.missed_ticks = missed_ticks
+        self.max_age = max_age
+        self.auto_recover = auto_recover
+        self.settle = settle
+        self.confirm = confirm
+        self.backoff = backoff
+        self.backoff_max = backoff_max
+        self.max_attempts = max_attempts
+        self.listeners = [] if on_event is None else [on_event]
+        self.events = deque(maxlen=1024)  # recent events 最近的事件
+        self.since_tick = []  # events since the last tick() 上次tick()之后的事件
+        self.status = np.fromiter((Motor.status for Motor in self.Motors), np.int64, n)
+        self.last_recv = np.fromiter((Motor.recv_time for Motor in self.Motors), np.float64, n)
+        self.missed = np.zeros(n, np.int64)  # ticks in a row without new feedback 连续没有新反馈的周期数
+        self.lost = np.zeros(n, bool)
+        self.fault = self.status >= DM_Motor_State.OVER_VOLTAGE
+        self.wanted = self.status == DM_Motor_State.ENABLED  # enabled before the fault, recover these 出错前处于使能状态
+        # recovery: 0 idle, 1 error cleared, 2 enable sent 恢复阶段: 0空闲 1已清除错误 2已发送使能
+        self.stage = np.zeros(n, np.int8)
+        self.stage_time = np.zeros(n)
+        self.attempts = np.zeros(n, np.int64)
+        self.next_attempt = np.zeros(n)
+        self.gave_up = np.zeros(n, bool)
+        self.clear_data = np.full((n, 8), 0xff, np.uint8)
+        self.clear_data[:, 7] = 0xFB
+        self.enable_data = np.full((n, 8), 0xff, np.uint8)
+        self.enable_data[:, 7] = 0xFC
+        motor_control.decode_listeners.append(self.check_status)
+
+    def close(self):
+        self.motor_control.decode_listeners.remove(self.check_status)
+
+    def add_listener(self, on_event):
+        self.listeners.append(on_event)
+
+    def __emit(self, kind, idx, now):
+        for i in idx:
+            Motor = self.Motors[i]
+            event = WatchdogEvent(kind, Motor, int(self.status[i]), now - Motor.recv_time, now)
+            self.events.append(event)
+            self.since_tick.append(event)
+            for listener in self.listeners:
+                listener(event)
+
+    def check_status(self):
+        """
+        look at the error codes of the latest feedback, runs after every decoded block of feedback
+        检查最新反馈中的错误码 每解析完一批反馈都会运行
+        """
+        n = len(self.Motors)
+        status = np.fromiter((Motor.status for Motor in self.Motors), np.int64, n)
+        changed = status != self.status
+        if not changed.any():
+            return
+        self.status = status
+        now = time.time()
+        fault = status >= DM_Motor_State.OVER_VOLTAGE
+        new_fault = fault & ~self.fault
+        cleared = ~fault & self.fault
+        self.fault = fault
+        enabled = status == DM_Motor_State.ENABLED
+        recovered = enabled & ((self.stage > 0) | (self.attempts > 0))
+        # the wanted state follows deliberate enable/disable, not the recovery 使能状态跟随用户操作 不受恢复过程影响
+        idle = (self.stage == 0) & (self.attempts == 0) & ~fault
+        self.wanted[idle] = enabled[idle]
+        self.wanted |= enabled
+        self.stage[enabled] = 0
+        self.attempts[enabled] = 0
+        self.gave_up[enabled] = False
+        if new_fault.any():
+            self.__emit(self.FAULT, np.flatnonzero(new_fault), now)
+        if cleared.any():
+            self.__emit(self.FAULT_CLEARED, np.flatnonzero(cleared), now)
+        if recovered.any():
+            self.__emit(self.RECOVERED, np.flatnonzero(recovered), now)
+
+    def tick(self):
+        """
+        call once per control tick, after the commands of the group were sent and the replies collected
+        每个控制周期调用一次 在发送指令并收集回复之后
+        :return: events since the last tick, including faults seen while decoding 上次tick之后的事件 包括解析反馈时发现的错误
+        """
+        n = len(self.Motors)
+        now = time.time()
+        recv = np.fromiter((Motor.recv_time for Motor in self.Motors), np.float64, n)
+        fresh = recv > self.last_recv
+        self.last_recv = recv
+        self.missed += 1
+        self.missed[fresh] = 0
+        lost = self.missed >= self.missed_ticks
+        if self.max_age is not None:
+            lost |= (now - recv) > self.max_age
+        new_lost = lost & ~self.lost
+        restored = ~lost & self.lost
+        self.lost = lost
+        if new_lost.any():
+            self.__emit(self.LOST, np.flatnonzero(new_lost), now)
+        if restored.any():
+            self.__emit(self.RESTORED, np.flatnonzero(restored), now)
+        if self.auto_recover and not self.motor_control.estop:
+            self.__recover(now)
+        events, self.since_tick = self.since_tick, []
+        return events
+
+    def __recover(self, now):
+        candidates = self.wanted & ~self.gave_up & (self.fault | (self.status == DM_Motor_State.DISABLED))
+        if not (candidates.any() or self.stage.any()):
+            return
+        t = monotonic()
+        mc = self.motor_control
+        # enable sent and not confirmed in time: the attempt failed 已发送使能但没有确认 本次尝试失败
+        failed = (self.stage == 2) & (t - self.stage_time > self.confirm)
+        if failed.any():
+            self.stage[failed] = 0
+            self.attempts[failed] += 1
+            delay = np.minimum(self.backoff * 2.0 ** (self.attempts[failed] - 1), self.backoff_max)
+            self.next_attempt[failed] = t + delay
+            give_up = failed & (self.attempts >= self.max_attempts)
+            if give_up.any():
+                self.gave_up |= give_up
+                self.__emit(self.GAVE_UP, np.flatnonzero(give_up), now)
+        enable = np.flatnonzero((self.stage == 1) & (t - self.stage_time >= self.settle))
+        if enable.size:
+            mc.send_batch([self.Motors[i].SlaveID for i in enable], self.enable_data[enable])
+            self.stage[enable] = 2
+            self.stage_time[enable] = t
+        start = np.flatnonzero(candidates & ~self.gave_up & (self.stage == 0) & ~self.lost & (t >= self.next_attempt))
+        if start.size:
+            self.__emit(self.RECOVERING, start, now)
+            mc.send_batch([self.Motors[i].SlaveID for i in start], self.clear_data[start])
+            self.stage[start] = 1
+            self.stage_time[start] = t
+
+    def reset(self, Motors=None):
+        """
+        forget failed attempts so GAVE_UP motors are tried again 清除失败次数 重新尝试已放弃的电机
+        """
+        idx = slice(None) if Motors is None else [self.Motors.index(Motor) for Motor in Motors]
+        self.attempts[idx] = 0
+        self.gave_up[idx] = False
+        self.next_attempt[idx] = 0.0
+        self.stage[idx] = 0
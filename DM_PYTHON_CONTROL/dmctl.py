@@ -0,0 +1,382 @@
+"""
+dmctl command line tool dmctl命令行工具
+
+One-shot operations on DM motors through the USB-CAN adapter, without writing a script. Only the stdlib codec in
+DM_Codec is loaded, NumPy is imported only by the options that need it (watch --log). 通过USB转CAN模块对达妙电机做一次性
+操作，不需要写脚本。只加载标准库实现的DM_Codec，只有需要NumPy的选项(watch --log)才会导入NumPy。
+
+usage 用法:
+    python dmctl.py -p /dev/ttyACM0 discover
+    python dmctl.py -p /dev/ttyACM0 read 1 PMAX VMAX TMAX
+    python dmctl.py -p /dev/ttyACM0 write 1 TIMEOUT 1000 CTRL_MODE 3
+    python dmctl.py -p /dev/ttyACM0 save 1 2
+    python dmctl.py -p /dev/ttyACM0 enable 1 2          # also disable, zero, clear
+    python dmctl.py -p /dev/ttyACM0 watch 1 2 --rate 20 [--log run.dmtl [--compact]]
+"""
+import argparse
+import sys
+import time
+from time import sleep, monotonic
+from DM_Codec import (PARAM_CAN_ID, CMD_READ, CMD_WRITE, CMD_SAVE, CMD_REFRESH, CMD_ENABLE, CMD_DISABLE, CMD_ZERO,
+                      CMD_CLEAR_ERROR, LIMIT_PARAM, DM_Motor_Type, DM_Motor_State, DM_variable, encode_host_frames,
+                      extract_reply_frames, param_frame_data, decode_param_reply, control_cmd_data, decode_feedback,
+                      motor_types_for_limits, is_in_ranges)
+
+NO_REPLY = 0xFF  # status before the first feedback, not a motor state, fits the u1 status column of DM_Telemetry
+# 收到第一个反馈之前的状态 不是电机状态码 可以写入DM_Telemetry的u1状态列
+
+
+class MotorState:
+    def __init__(self, SlaveID, MasterID=None, limits=None):
+        """
+        what dmctl knows about one motor, with the attribute names of DM_CAN.Motor dmctl记录的电机信息 属性名与DM_CAN.Motor相同
+        :param limits: (PMAX, VMAX, TMAX) used to decode the feedback 解析反馈使用的限幅
+        """
+        self.SlaveID = SlaveID
+        self.MasterID = MasterID
+        self.limits = limits or LIMIT_PARAM[DM_Motor_Type.DM4310]
+        self.status = NO_REPLY
+        self.state_q = float("nan")
+        self.state_dq = float("nan")
+        self.state_tau = float("nan")
+        self.temp_mos = 0
+        self.temp_rotor = 0
+        self.recv_time = 0.0
+
+
+class Bus:
+    def __init__(self, serial_device, frames_per_second=4000, chunk=16):
+        """
+        request/reply on the USB-CAN adapter 通过USB转CAN模块收发
+        :param serial_device: open serial object 已打开的串口对象
+        :param frames_per_second: send rate limit of long sweeps 大量发送时的速率上限 帧/秒
+        :param chunk: frames per serial write 每次串口写入的帧数
+        """
+        self.serial_ = serial_device
+        self.frames_per_second = frames_per_second
+        self.chunk = chunk
+        self.rest = b""
+        self.dropped_bytes = 0
+
+    def send(self, frames):
+        """
+        :param frames: list of (can_id, data) 多个(CAN ID, 数据)
+        """
+        period = self.chunk / float(self.frames_per_second)
+        next_send = monotonic()
+        for i in range(0, len(frames), self.chunk):
+            while monotonic() < next_send:
+                sleep(0.0005)
+            self.serial_.write(encode_host_frames(frames[i:i + self.chunk]))
+            next_send += period
+
+    def recv(self):
+        """
+        :return: list of (CANID, data, t) received so far 目前收到的CAN帧
+        """
+        frames, self.rest, dropped = extract_reply_frames(self.rest + self.serial_.read_all())
+        self.dropped_bytes += dropped
+        t = time.time()
+        return [(CANID, data, t) for CANID, CMD, data in frames if CMD == 0x11]
+
+    def collect(self, on_frame, timeout):
+        """
+        pass frames to on_frame until it returns True or timeout 把收到的帧交给on_frame 直到其返回True或超时
+        """
+        deadline = monotonic() + timeout
+        while True:
+            for frame in self.recv():
+                if on_frame(*frame):
+                    return True
+            if monotonic() >= deadline:
+                return False
+            sleep(0.0005)
+
+    def read_params(self, pairs, timeout=0.2):
+        """
+        :param pairs: list of (SlaveID, RID) 需要读取的寄存器
+        :return: {(SlaveID, RID): value}, registers that did not reply are left out 没有回复的寄存器不包含在内
+        """
+        return self.__params([(SlaveID, RID, None) for SlaveID, RID in pairs], timeout)
+
+    def write_params(self, writes, timeout=0.2):
+        """
+        :param writes: list of (SlaveID, RID, value) 需要写入的寄存器
+        :return: {(SlaveID, RID): value echoed by the motor} 电机回复的新值
+        """
+        return self.__params(writes, timeout)
+
+    def __params(self, items, timeout):
+        wanted = {(SlaveID, int(RID)) for SlaveID, RID, _ in items}
+        values = {}
+
+        def on_frame(CANID, data, t):
+            reply = decode_param_reply(data)
+            if reply is not None and (reply[0], reply[2]) in wanted:
+                values[(reply[0], reply[2])] = reply[3]
+            return len(values) == len(wanted)
+
+        self.recv()  # drop stale frames 丢弃之前的帧
+        self.send([(PARAM_CAN_ID, param_frame_data(SlaveID, CMD_READ if value is None else CMD_WRITE, RID, value))
+                   for SlaveID, RID, value in items])
+        self.collect(on_frame, timeout)
+        return values
+
+    def probe(self, ids, timeout=0.2):
+        """
+        read MST_ID and PMAX/VMAX/TMAX so the feedback of the motors can be matched and decoded
+        读取MST_ID和PMAX/VMAX/TMAX 用于匹配和解析电机的反馈
+        :return: list of MotorState, motors that did not reply keep MasterID None 没有回复的电机MasterID为None
+        """
+        rids = (DM_variable.MST_ID, DM_variable.PMAX, DM_variable.VMAX, DM_variable.TMAX)
+        values = self.read_params([(SlaveID, RID) for SlaveID in ids for RID in rids], timeout)
+        motors = []
+        for SlaveID in ids:
+            limits = tuple(values.get((SlaveID, RID)) for RID in rids[1:])
+            motors.append(MotorState(SlaveID, values.get((SlaveID, DM_variable.MST_ID)),
+                                     None if None in limits else limits))
+        return motors
+
+    def command(self, motors, frames, timeout=0.1):
+        """
+        send one frame per motor and decode the feedback they answer with 每个电机发送一帧并解析回复的反馈
+        :param motors: list of MotorState
+        :param frames: list of (can_id, data), one per motor 每个电机一帧
+        :return: list of MotorState that did not reply 没有回复的电机
+        """
+        waiting = {}
+        for Motor in motors:
+            waiting.setdefault(Motor.MasterID, []).append(Motor)
+
+        def on_frame(CANID, data, t):
+            candidates = waiting.get(CANID) or waiting.get(None) or []
+            for Motor in candidates:
+                if (Motor.SlaveID & 0xf) == (data[0] & 0xf):
+                    (_, Motor.status, Motor.state_q, Motor.state_dq, Motor.state_tau, Motor.temp_mos,
+                     Motor.temp_rotor) = decode_feedback(data, Motor.limits)
+                    Motor.recv_time = t
+                    candidates.remove(Motor)
+                    break
+            return not any(waiting.values())
+
+        self.recv()
+        self.send(frames)
+        self.collect(on_frame, timeout)
+        return [Motor for group in waiting.values() for Motor in group]
+
+    def discover(self, ids=range(0x01, 0x80), timeout=0.05):
+        """
+        find the motors in the ID range 扫描ID范围内的电机
+        :return: list of (SlaveID, {RID: value}) sorted by SlaveID
+        """
+        ids = list(ids)
+        found = self.read_params([(SlaveID, RID) for SlaveID in ids
+                                  for RID in (DM_variable.MST_ID, DM_variable.ESC_ID)], timeout)
+        ids = sorted({SlaveID for SlaveID, _ in found})
+        details = (DM_variable.SN, DM_variable.PMAX, DM_variable.VMAX, DM_variable.TMAX, DM_variable.CTRL_MODE)
+        found.update(self.read_params([(SlaveID, RID) for SlaveID in ids for RID in details], timeout))
+        return [(SlaveID, {RID: value for (sid, RID), value in found.items() if sid == SlaveID}) for SlaveID in ids]
+
+
+def parse_id(text):
+    return int(text, 0)
+
+
+def parse_ids(texts):
+    """
+    "1" "0x02" "3-6" -> [1, 2, 3, 4, 5, 6]
+    """
+    ids = []
+    for text in texts:
+        for part in text.split(","):
+            if "-" in part:
+                lo, hi = part.split("-")
+                ids.extend(range(parse_id(lo), parse_id(hi) + 1))
+            else:
+                ids.append(parse_id(part))
+    return ids
+
+
+def parse_rid(text):
+    try:
+        return DM_variable[text]
+    except KeyError:
+        pass
+    try:
+        return DM_variable(int(text, 0))
+    except ValueError:
+        raise argparse.ArgumentTypeError("unknown register %r 未知的寄存器" % text)
+
+
+def format_value(RID, value):
+    if isinstance(value, float):
+        return "%.6g" % value
+    if RID in (DM_variable.MST_ID, DM_variable.ESC_ID):
+        return "0x%02X" % value
+    return str(value)
+
+
+def status_name(status):
+    if status == NO_REPLY:
+        return "no reply"
+    try:
+        return DM_Motor_State(status).name
+    except ValueError:
+        return "0x%X" % status
+
+
+def cmd_discover(bus, args):
+    found = bus.discover(parse_ids(args.ids), args.timeout)
+    print("%-8s %-8s %-10s %-6s %s" % ("SlaveID", "MasterID", "SN", "mode", "type"))
+    for SlaveID, params in found:
+        limits = [params.get(RID) for RID in (DM_variable.PMAX, DM_variable.VMAX, DM_variable.TMAX)]
+        types = [] if None in limits else motor_types_for_limits(*limits)
+        print("0x%02X     %-8s %-10s %-6s %s" % (
+            SlaveID, format_value(DM_variable.MST_ID, params.get(DM_variable.MST_ID, 0)),
+            params.get(DM_variable.SN, "?"), params.get(DM_variable.CTRL_MODE, "?"),
+            ",".join(t.name for t in types) or "?"))
+    if not found:
+        print("no motor found")
+        return 1
+    return 0
+
+
+def cmd_read(bus, args):
+    rids = args.rids
+    values = bus.read_params([(args.id, RID) for RID in rids], args.timeout)
+    for RID in rids:
+        value = values.get((args.id, RID))
+        print("%-10s %s" % (RID.name, "no reply" if value is None else format_value(RID, value)))
+    return 0 if len(values) == len(rids) else 1
+
+
+def cmd_write(bus, args):
+    if len(args.pairs) % 2:
+        raise argparse.ArgumentTypeError("write needs RID VALUE pairs 需要成对的寄存器和值")
+    writes = []
+    for text, value in zip(args.pairs[::2], args.pairs[1::2]):
+        RID = parse_rid(text)
+        try:
+            # integer registers take 0x10 as well as 16 整数寄存器也可以写成0x10
+            writes.append((args.id, RID, int(value, 0) if is_in_ranges(RID) else float(value)))
+        except ValueError:
+            raise argparse.ArgumentTypeError("bad value %r for %s 寄存器的值无效" % (value, RID.name))
+    values = bus.write_params(writes, args.timeout)
+    ok = True
+    for SlaveID, RID, value in writes:
+        echoed = values.get((SlaveID, RID))
+        good = echoed is not None and abs(echoed - value) < 0.1
+        ok &= good
+        print("%-10s %s" % (RID.name, format_value(RID, echoed) if good else "failed"))
+    if ok:
+        print("written to RAM, run 'save' to keep them after power off 已写入RAM 掉电保存需要执行save")
+    return 0 if ok else 1
+
+
+def cmd_save(bus, args):
+    # 保存前需要失能电机 只保存确认已失能的电机
+    motors = bus.probe(parse_ids(args.ids), args.timeout)
+    missed = bus.command(motors, [(Motor.SlaveID, control_cmd_data(CMD_DISABLE)) for Motor in motors], args.timeout)
+    disabled = [Motor for Motor in motors if Motor not in missed and Motor.status != DM_Motor_State.ENABLED]
+    bus.send([(PARAM_CAN_ID, param_frame_data(Motor.SlaveID, CMD_SAVE)) for Motor in disabled])
+    sleep(0.01)
+    for Motor in motors:
+        print("0x%02X %s" % (Motor.SlaveID, "saved" if Motor in disabled else
+                             "not saved, disable not confirmed (%s)" % status_name(Motor.status)))
+    return 0 if len(disabled) == len(motors) else 1
+
+
+def cmd_control(bus, args):
+    cmd = {"enable": CMD_ENABLE, "disable": CMD_DISABLE, "zero": CMD_ZERO, "clear": CMD_CLEAR_ERROR}[args.command]
+    motors = bus.probe(parse_ids(args.ids), args.timeout)
+    missed = bus.command(motors, [(Motor.SlaveID, control_cmd_data(cmd)) for Motor in motors], args.timeout)
+    for Motor in motors:
+        print("0x%02X %s" % (Motor.SlaveID, status_name(Motor.status)))
+    if args.command == "enable":
+        return 0 if all(Motor.status == DM_Motor_State.ENABLED for Motor in motors) else 1
+    return 1 if missed else 0
+
+
+def cmd_watch(bus, args):
+    motors = bus.probe(parse_ids(args.ids), args.timeout)
+    for Motor in motors:
+        if Motor.MasterID is None:
+            print("0x%02X did not reply, its feedback is decoded with DM4310 limits" % Motor.SlaveID, file=sys.stderr)
+    recorder = None
+    if args.log:
+        from DM_Telemetry import TelemetryRecorder, CompactRecorder  # imports NumPy 需要NumPy
+        recorder = CompactRecorder(args.log, motors) if args.compact else TelemetryRecorder(args.log)
+    period = 1.0 / args.rate
+    frames = [(PARAM_CAN_ID, param_frame_data(Motor.SlaveID, CMD_REFRESH)) for Motor in motors]
+    next_tick = monotonic()
+    ticks = 0
+    try:
+        while args.count <= 0 or ticks < args.count:
+            bus.command(motors, frames, min(period, args.timeout))
+            if recorder is not None:
+                recorder.record(motors)
+            print("  ".join("0x%02X %-9s q=%8.4f dq=%8.4f tau=%7.3f T=%d/%d" % (
+                Motor.SlaveID, status_name(Motor.status), Motor.state_q, Motor.state_dq, Motor.state_tau,
+                Motor.temp_mos, Motor.temp_rotor) for Motor in motors), flush=True)
+            ticks += 1
+            next_tick += period
+            delay = next_tick - monotonic()
+            if delay > 0:
+                sleep(delay)
+            else:
+                next_tick = monotonic()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if recorder is not None:
+            recorder.close()
+    return 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="dmctl", description="DM motor command line tool 达妙电机命令行工具")
+    parser.add_argument("-p", "--port", required=True, help="serial port 串口 例如 /dev/ttyACM0 COM8")
+    parser.add_argument("-b", "--baudrate", type=int, default=921600)
+    parser.add_argument("-t", "--timeout", type=float, default=0.2, help="reply timeout 等待回复的时间 单位秒")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p = sub.add_parser("discover", help="find the motors on the bus 扫描总线上的电机")
+    p.add_argument("ids", nargs="*", default=["1-127"], help="IDs to probe 需要扫描的ID 例如 1-16")
+    p.set_defaults(fn=cmd_discover)
+    p = sub.add_parser("read", help="read registers 读取寄存器")
+    p.add_argument("id", type=parse_id)
+    p.add_argument("rids", nargs="+", type=parse_rid, help="DM_variable names or numbers 寄存器名称或编号")
+    p.set_defaults(fn=cmd_read)
+    p = sub.add_parser("write", help="write registers to RAM 写入寄存器(RAM)")
+    p.add_argument("id", type=parse_id)
+    p.add_argument("pairs", nargs="+", metavar="RID VALUE")
+    p.set_defaults(fn=cmd_write)
+    p = sub.add_parser("save", help="save the registers to flash, disables the motors 保存参数到flash 会失能电机")
+    p.add_argument("ids", nargs="+")
+    p.set_defaults(fn=cmd_save)
+    for name, text in (("enable", "enable 使能"), ("disable", "disable 失能"), ("zero", "set zero position 设置零点"),
+                       ("clear", "clear errors, the motors stay disabled 清除错误 电机保持失能")):
+        p = sub.add_parser(name, help=text)
+        p.add_argument("ids", nargs="+")
+        p.set_defaults(fn=cmd_control)
+    p = sub.add_parser("watch", help="print the state of motors 持续显示电机状态")
+    p.add_argument("ids", nargs="+")
+    p.add_argument("--rate", type=float, default=10.0, help="refreshes per second 每秒刷新次数")
+    p.add_argument("--count", type=int, default=0, help="stop after this many refreshes, 0 runs until Ctrl-C 刷新次数")
+    p.add_argument("--log", help="also record a DM_Telemetry log, needs NumPy 同时记录遥测日志 需要NumPy")
+    p.add_argument("--compact", action="store_true", help="record the raw wire integers, compressed 记录压缩的协议原始整数")
+    p.set_defaults(fn=cmd_watch)
+    args = parser.parse_args(argv)
+
+    import serial
+    serial_device = serial.Serial(args.port, args.baudrate, timeout=0)
+    try:
+        return args.fn(Bus(serial_device), args)
+    except argparse.ArgumentTypeError as e:
+        parser.error(str(e))
+    finally:
+        serial_device.close()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
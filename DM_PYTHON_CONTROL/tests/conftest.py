@@ -0,0 +1,5 @@
+import os
+import sys
+
+# the modules sit flat in DM_PYTHON_CONTROL 模块直接放在DM_PYTHON_CONTROL目录下
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
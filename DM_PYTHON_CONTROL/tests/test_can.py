@@ -0,0 +1,56 @@
+from time import monotonic
+
+from DM_CAN import Motor, MotorControl, DM_Motor_Type, DM_Motor_State, DM_variable
+from DM_Codec import param_frame_data, CMD_READ
+from DM_Sim import SimFleet, SimTransport
+
+
+def test_register_reply_is_not_feedback():
+    transport = SimTransport(SimFleet([DM_Motor_Type.DM4310]))
+    motor_control = MotorControl(transport)
+    Motor1 = Motor(DM_Motor_Type.DM4310, 0x01, 0x11)
+    motor_control.addMotor(Motor1)
+    assert motor_control.enable_batch([Motor1], timeout=0.01) == []
+
+    # a register reply read by recv() while the motor waits for its feedback 电机等待反馈时recv()读到寄存器回复
+    motor_control.pending[Motor1.SlaveID] = Motor1
+    motor_control.param_pending.add((Motor1.SlaveID, DM_variable.MST_ID))
+    transport.send_frames([0x7FF], [list(param_frame_data(Motor1.SlaveID, CMD_READ, DM_variable.MST_ID))])
+    motor_control.recv()
+    assert Motor1.status == DM_Motor_State.ENABLED
+    assert Motor1.SlaveID in motor_control.pending
+    assert Motor1.temp_param_dict[DM_variable.MST_ID] == 0x11
+    assert not motor_control.param_pending
+
+
+def test_feedback_like_register_reply_without_read():
+    # status 0, ID 1 and q near -PMAX: data[0:4] = 01 00 33 07 like a read of MST_ID 状态0 ID为1 q接近-PMAX
+    transport = SimTransport(SimFleet([DM_Motor_Type.DM4310]))
+    motor_control = MotorControl(transport)
+    Motor1 = Motor(DM_Motor_Type.DM4310, 0x01, 0x11)
+    motor_control.addMotor(Motor1)
+    motor_control.pending[Motor1.SlaveID] = Motor1
+    transport.replies.append((0x11, 0x11, bytes([0x01, 0x00, 0x33, 0x07, 0xff, 0xf8, 30, 31]), 0.0))
+    motor_control.recv()
+    assert Motor1.SlaveID not in motor_control.pending
+    assert Motor1.getPosition() < -12.4
+    assert Motor1.temp_mos == 30
+    assert DM_variable.MST_ID not in Motor1.temp_param_dict
+
+
+def test_waiting_call_ignores_earlier_fire_and_forget_motors():
+    # motor 3 is not on the bus 总线上没有3号电机
+    motor_control = MotorControl(SimTransport(SimFleet([DM_Motor_Type.DM4310] * 2)))
+    A, B, C = (Motor(DM_Motor_Type.DM4310, i, i + 0x10) for i in (1, 2, 3))
+    for m in (A, B, C):
+        motor_control.addMotor(m)
+    motor_control.controlMIT_batch([A, B, C], 0, 0.1, [0, 0, 0], [0, 0, 0], [0, 0, 0])
+    start = monotonic()
+    assert motor_control.enable_batch([A, B], timeout=0.1) == []
+    assert monotonic() - start < 0.05
+    assert C.missed_replies == 0
+
+    # calls sent with timeout 0 are still collected by a later wait_replies 之后的wait_replies仍然等待timeout为0的调用
+    motor_control.controlMIT_batch([A, B], 0, 0.1, [0, 0], [0, 0], [0, 0], timeout=0)
+    motor_control.controlMIT_batch([C], 0, 0.1, [0], [0], [0], timeout=0)
+    assert motor_control.wait_replies(0.01) == [C]
@@ -0,0 +1,53 @@
+import threading
+from concurrent.futures import Future
+from time import sleep
+
+from DM_CAN import Motor, MotorControl, DM_Motor_Type
+from DM_Daemon import MotorDaemon, ClientSession
+from DM_Sim import SimFleet, SimTransport
+
+
+def make_daemon(tmp_path, **kwargs):
+    motor_control = MotorControl(SimTransport(SimFleet([DM_Motor_Type.DM4310] * 2)))
+    Motors = [Motor(DM_Motor_Type.DM4310, i + 1, i + 0x11) for i in range(2)]
+    for m in Motors:
+        motor_control.addMotor(m)
+    return MotorDaemon(motor_control, Motors, str(tmp_path / "dm.sock"), "dm_test_%d" % id(tmp_path), **kwargs)
+
+
+def test_estop_runs_ahead_of_queued_requests(tmp_path):
+    daemon = make_daemon(tmp_path)
+    session = ClientSession()
+    clients = [threading.Thread(target=daemon.submit, args=(session, {"op": "enable", "motors": [1, 2]}), daemon=True)
+               for _ in range(3)]
+    for client in clients:
+        client.start()
+    while daemon.queue.qsize() < 3:
+        sleep(0.001)
+    threading.Thread(target=daemon.submit, args=(session, {"op": "estop"}), daemon=True).start()
+    while daemon.queue.qsize() < 4:
+        sleep(0.001)
+    assert daemon.motor_control.estop  # queued sends are blocked before the bus thread gets to it 排队的发送已被禁止
+    ops = []
+    while not daemon.queue.empty():
+        _, _, _, request, future = daemon.queue.get()
+        ops.append(request["op"])
+        future.set_result({"ok": True})
+    assert ops == ["estop", "enable", "enable", "enable"]
+
+
+def test_ticks_keep_running_under_a_busy_queue(tmp_path):
+    daemon = make_daemon(tmp_path, period=0.01)
+    # a backlog of requests that takes many periods to work off 需要很多个周期才能处理完的请求
+    session = ClientSession()
+    for _ in range(100000):
+        daemon.queue.put((1, next(daemon.order), session, {"op": "hello"}, Future()))
+    server = threading.Thread(target=daemon.serve_forever, daemon=True)
+    server.start()
+    try:
+        sleep(0.2)
+        assert not daemon.queue.empty()
+        assert daemon.tick >= 10
+    finally:
+        daemon.shutdown()
+        server.join(10)
@@ -0,0 +1,29 @@
+import numpy as np
+
+from DM_CAN import MotorControl, DM_Motor_Type
+from DM_Discovery import BusScanner
+from DM_Sim import SimFleet, SimTransport
+
+
+class OldFirmwareBus(SimTransport):
+    # motors that answer refresh (0xCC) but not register reads 只回复刷新状态 不回复读寄存器的电机
+    def send_frames(self, can_ids, data):
+        can_ids = np.asarray(can_ids, np.intp).reshape(-1)
+        data = np.asarray(data, np.uint8).reshape(-1, 8)
+        keep = (can_ids != 0x7FF) | (data[:, 2] == 0xCC)
+        super().send_frames(can_ids[keep], data[keep])
+
+
+def test_old_firmware_slave_id_is_confirmed():
+    # 0x02 is scanned first and has the same low nibble as 0x12 0x02先被扫描 低4位与0x12相同
+    bus = OldFirmwareBus(SimFleet([DM_Motor_Type.DM4310]), slave_ids=[0x12], master_ids=[0x22])
+    scanner = BusScanner(MotorControl(bus))
+    found = scanner.scan(range(0x01, 0x20), timeout=0.01, details=False)
+    assert [(m.SlaveID, m.MasterID) for m in found] == [(0x12, 0x22)]
+    assert scanner.unresolved == []
+
+
+def test_type_hints_from_limits():
+    scanner = BusScanner(MotorControl(SimTransport(SimFleet([DM_Motor_Type.DM4310, DM_Motor_Type.DM8009]))))
+    found = scanner.scan(range(0x01, 0x04), timeout=0.01)
+    assert [m.type_hints()[0] for m in found] == [DM_Motor_Type.DM4310, DM_Motor_Type.DM8009]
@@ -0,0 +1,67 @@
+import argparse
+from struct import pack
+
+import numpy as np
+import pytest
+
+from DM_CAN import DM_Motor_Type
+from DM_Codec import CMD_SAVE
+from DM_Sim import SimFleet, SimTransport
+from DM_Telemetry import TelemetryRecorder, CompactRecorder, read_log
+from dmctl import Bus, MotorState, NO_REPLY, status_name, cmd_write, cmd_save
+
+
+class SimSerial:
+    """
+    USB-CAN serial stand-in on top of SimTransport 基于SimTransport的USB转CAN串口替身
+    """
+
+    def __init__(self, transport):
+        self.transport = transport
+        self.sent = []  # (can_id, data) of every host frame 每个下发帧
+        self.rx = bytearray()
+
+    def write(self, data):
+        frames = [(data[k + 13] | (data[k + 14] << 8), bytes(data[k + 21:k + 29])) for k in range(0, len(data), 30)]
+        self.sent += frames
+        self.transport.send_frames([can_id for can_id, _ in frames], [list(d) for _, d in frames])
+        for CANID, CMD, reply, _ in self.transport.recv_frames():
+            self.rx += bytes([0xAA, CMD, 0x08]) + pack("<I", CANID) + bytes(reply) + b"\x55"
+        return len(data)
+
+    def read_all(self):
+        data = bytes(self.rx)
+        self.rx.clear()
+        return data
+
+
+def test_watch_log_before_first_reply(tmp_path):
+    # watch --log records the motors that have not replied yet 记录还没有回复的电机
+    motors = [MotorState(1, 0x11), MotorState(2)]
+    assert status_name(motors[0].status) == "no reply"
+    for name, recorder in (("full.dmtl", TelemetryRecorder(str(tmp_path / "full.dmtl"))),
+                           ("compact.dmtl", CompactRecorder(str(tmp_path / "compact.dmtl"), motors))):
+        recorder.record(motors)
+        recorder.close()
+        rows = np.concatenate(list(read_log(str(tmp_path / name))))
+        assert rows["status"].tolist() == [NO_REPLY, NO_REPLY]
+
+
+def test_write_integer_register_in_hex():
+    transport = SimTransport(SimFleet([DM_Motor_Type.DM4310]))
+    bus = Bus(SimSerial(transport))
+    assert cmd_write(bus, argparse.Namespace(id=1, pairs=["TIMEOUT", "0x10"], timeout=0.05)) == 0
+    assert transport.timeout[0] == 0x10
+    with pytest.raises(argparse.ArgumentTypeError):
+        cmd_write(bus, argparse.Namespace(id=1, pairs=["PMAX", "abc"], timeout=0.05))
+
+
+def test_save_reports_motors_that_did_not_disable(capsys):
+    # motor 2 is not on the bus 总线上没有2号电机
+    serial_device = SimSerial(SimTransport(SimFleet([DM_Motor_Type.DM4310])))
+    assert cmd_save(Bus(serial_device), argparse.Namespace(ids=["1", "2"], timeout=0.05)) == 1
+    out = capsys.readouterr().out
+    assert "0x01 saved" in out
+    assert "0x02 not saved" in out
+    saved = [d[0] for can_id, d in serial_device.sent if can_id == 0x7FF and d[2] == CMD_SAVE]
+    assert saved == [1]
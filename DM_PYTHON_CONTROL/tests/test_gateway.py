@@ -0,0 +1,46 @@
+from DM_CAN import Motor, MotorControl, DM_Motor_Type, DM_Motor_State
+from DM_Gateway import GatewayEmulator, GatewayTransport
+from DM_Sim import SimFleet, SimTransport
+
+
+def make_gateway(n=3, max_state=32):
+    fleet = SimFleet([DM_Motor_Type.DM4310] * n, dt=0.002)
+    board = GatewayEmulator(SimTransport(fleet), realtime=False, slots=n,  # one period per poll 每次查询一个周期
+                            max_state=max_state)
+    motor_control = MotorControl(GatewayTransport(board))
+    Motors = [Motor(DM_Motor_Type.DM4310, i + 1, i + 0x11) for i in range(n)]
+    for m in Motors:
+        motor_control.addMotor(m)
+    return board, motor_control, Motors
+
+
+def test_commands_confirmed_while_slots_stream():
+    # the board keeps resending the MIT slots, their replies carry the state from before the command
+    # 板子一直重发MIT槽位 它们的回复带的是指令之前的状态
+    board, motor_control, Motors = make_gateway()
+    for _ in range(20):
+        for _ in range(3):
+            motor_control.controlMIT_batch(Motors, 5, 0.5, 0, 0, 0)
+            motor_control.recv()
+        assert board.active.all()
+        assert motor_control.enable_batch(Motors, timeout=0.005) == []
+        for _ in range(3):
+            motor_control.controlMIT_batch(Motors, 5, 0.5, 0, 0, 0)
+            motor_control.recv()
+        assert board.active.all()
+        assert motor_control.disable_batch(Motors, timeout=0.005) == []
+        assert not board.active.any()
+
+
+def test_stale_replies_spread_over_state_frames():
+    # state frames smaller than a period of replies, the slot replies from before the command arrive periods later
+    # 状态帧装不下一个周期的回复 命令之前的槽位回复要过几个周期才到
+    board, motor_control, Motors = make_gateway(n=4, max_state=3)
+    motor_control.enable_batch(Motors, timeout=0.05)
+    for _ in range(5):
+        motor_control.controlMIT_batch(Motors, 5, 0.5, 0, 0, 0)
+        motor_control.recv()
+    assert len(board.rx) > len(Motors)
+    assert motor_control.disable_batch(Motors, timeout=0.05) == []
+    assert not board.active.any()
+    assert all(m.status == DM_Motor_State.DISABLED for m in Motors)
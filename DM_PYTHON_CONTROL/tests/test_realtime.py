@@ -0,0 +1,92 @@
+from struct import pack
+
+import numpy as np
+
+from DM_CAN import Motor, MotorControl, DM_Motor_Type
+from DM_Realtime import RealtimeLoop
+
+
+class ReplySerial:
+    """
+    USB-CAN serial stand-in that answers every MIT frame with a feedback frame 对每个MIT帧回复反馈帧的串口替身
+    hold: bytes of the newest replies kept back until release() 保留最新回复的字节数 直到调用release()
+    """
+
+    def __init__(self, master_ids):
+        self.master_ids = master_ids  # SlaveID -> MasterID
+        self.is_open = False
+        self.rx = bytearray()
+        self.held = bytearray()
+        self.hold = 0
+        self.position = 0
+
+    def open(self):
+        self.is_open = True
+
+    def close(self):
+        self.is_open = False
+
+    def reset_output_buffer(self):
+        pass
+
+    @property
+    def in_waiting(self):
+        return len(self.rx)
+
+    def read(self, n):
+        data = bytes(self.rx[:n])
+        del self.rx[:n]
+        return data
+
+    def read_all(self):
+        return self.read(len(self.rx))
+
+    def write(self, data):
+        replies = bytearray()
+        for k in range(0, len(data), 30):
+            slave_id = data[k + 13]
+            q = self.position
+            feedback = bytes([0x10 | slave_id, q >> 8, q & 0xff, 0x80, 0x08, 0x00, 30, 31])
+            replies += bytes([0xAA, 0x11, 0x08]) + pack("<I", self.master_ids[slave_id]) + feedback + b"\x55"
+        if self.hold:
+            self.held = replies[len(replies) - self.hold:]
+            replies = replies[:len(replies) - self.hold]
+        self.rx += replies
+        return len(data)
+
+    def release(self):
+        self.rx += self.held
+        self.held = bytearray()
+
+
+def make_loop():
+    device = ReplySerial({1: 0x11, 2: 0x12})
+    motor_control = MotorControl(device)
+    Motors = [Motor(DM_Motor_Type.DM4310, 1, 0x11), Motor(DM_Motor_Type.DM4310, 2, 0x12)]
+    for m in Motors:
+        motor_control.addMotor(m)
+    return device, RealtimeLoop(motor_control, Motors, timeout=0.002)
+
+
+def test_reply_split_across_reads():
+    device, loop = make_loop()
+    device.position = 0x1000
+    assert loop.step() == 0
+    q_old = loop.q.copy()
+
+    # the second reply arrives in two reads, its first 6 bytes land in the slot that held the old reply
+    # 第二个回复分两次读到 前6个字节写在上一个回复所在的槽位中
+    device.position = 0xC000
+    device.hold = 10
+    assert loop.step() == 1
+    assert loop.fresh.tolist() == [True, False]
+    assert loop.q[1] == q_old[1]
+    assert loop.stats()["resyncs"] == 0
+
+    device.hold = 0
+    device.release()
+    device.position = 0x8000
+    loop.step()
+    assert loop.stats()["resyncs"] == 0
+    assert loop.missed_replies.tolist() == [0, 1]
+    assert np.allclose(loop.q, 0.0, atol=0.001)
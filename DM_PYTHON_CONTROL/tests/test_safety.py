@@ -0,0 +1,50 @@
+import numpy as np
+import pytest
+
+from DM_CAN import Motor, DM_Motor_Type
+from DM_Safety import CommandLimiter
+
+
+def make_limiter():
+    Motors = [Motor(DM_Motor_Type.DM4310, i + 1, i + 0x11) for i in range(3)]
+    return Motors, CommandLimiter(Motors, q_min=-2, q_max=2, tau_max=5)
+
+
+@pytest.mark.parametrize("group", [slice(None), slice(1, 3), [2, 0]])
+@pytest.mark.parametrize("fields", [("q", "dq", "tau"), ("q", "dq"), ("dq", "tau"), ("q", "tau"), ("tau",)])
+def test_apply_any_motors_and_fields(group, fields):
+    # whole group or a subset, contiguous (q dq) or not (q tau) 整组或部分电机 字段连续或不连续
+    Motors, limiter = make_limiter()
+    Motors = Motors[group] if isinstance(group, slice) else [Motors[i] for i in group]
+    n = len(Motors)
+    values = {"q": np.linspace(1, 30, n), "dq": np.zeros(n), "tau": np.full(n, 100.0)}
+    out = limiter.apply(Motors, **{name: values[name] for name in fields})
+    expect = {"q": np.minimum(values["q"], 2), "dq": values["dq"], "tau": np.full(n, 5.0)}
+    for i, name in enumerate(("q", "dq", "tau")):
+        if name in fields:
+            assert np.allclose(out[i], expect[name])
+        else:
+            assert out[i] is None
+    events = limiter.saturation_events()
+    for Motor, q in zip(Motors, values["q"]):
+        saturated = events[Motor.SlaveID][0]
+        assert saturated[2] == ("tau" in fields)
+        assert saturated[0] == ("q" in fields and q > 2)
+
+
+def test_nan_holds_the_last_output():
+    Motors, limiter = make_limiter()
+    limiter.apply(Motors, q=[0.5, 1.0, 1.5], tau=[0, 0, 0])
+    q, _, tau = limiter.apply(Motors, q=[np.nan, 0.2, 0.3], tau=[1, np.nan, 1])
+    assert q.tolist() == [0.5, 0.2, 0.3]
+    assert tau.tolist() == [1, 0, 1]
+
+
+def test_nan_without_an_earlier_output_raises():
+    # holding nothing would mean inventing a target such as q = 0 没有可以保持的值 不能编造一个目标位置
+    Motors, limiter = make_limiter()
+    limiter.apply(Motors[:2], q=[0.5, 1.0])
+    with pytest.raises(ValueError, match="0x03"):
+        limiter.apply(Motors, q=[0.1, 0.1, np.nan])
+    assert np.isnan(limiter.last[0, 2])
+    assert limiter.last[0, :2].tolist() == [0.5, 1.0]
@@ -0,0 +1,35 @@
+import numpy as np
+
+from DM_CAN import Motor, DM_Motor_Type
+from DM_Scheduler import OrderedGroup
+
+
+class WireBus:
+    """
+    frames leave one frame_time apart and every motor answers latency after its own frame
+    帧间隔frame_time依次发出 每个电机在自己的帧之后latency回复
+    """
+
+    def __init__(self, frame_time, latency):
+        self.frame_time = frame_time
+        self.latency = latency
+        self.group = None
+
+    def controlMIT_batch(self, Motors, kp, kd, q, dq, tau, timeout=None):
+        for position, m in enumerate(Motors):
+            m.recv_time = self.group.t_tick + position * self.frame_time + self.latency
+        return []
+
+
+def test_offset_from_the_send_time_of_each_frame():
+    bus = WireBus(frame_time=130e-6, latency=200e-6)
+    Motors = [Motor(DM_Motor_Type.DM4310, i, i + 0x10) for i in range(1, 7)]
+    group = OrderedGroup(bus, Motors, OrderedGroup.ROUND_ROBIN, frame_time=130e-6)
+    bus.group = group
+    for _ in range(6):
+        group.controlMIT_batch(0, 0.5, 0, 0, 0)
+        assert np.allclose(group.offset_last, 200e-6, atol=1e-6)
+    for row in group.report():
+        assert row["replies"] == 6
+        assert abs(row["offset_mean"] - 200e-6) < 1e-6
+        assert row["position_mean"] == 2.5
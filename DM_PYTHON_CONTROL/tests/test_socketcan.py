@@ -0,0 +1,73 @@
+import os
+import threading
+import time
+from time import monotonic, sleep
+
+import numpy as np
+import pytest
+
+from DM_Transport import SocketCANTransport
+
+# sudo ip link add dev vcan0 type vcan && sudo ip link set up vcan0
+CHANNEL = os.environ.get("DM_VCAN", "vcan0")
+
+
+@pytest.fixture
+def bus():
+    # one transport sends, the other receives, CAN_RAW does not loop frames back to the sender
+    # 一个发送一个接收 CAN_RAW不会把帧回送给发送的套接字
+    tx, rx = SocketCANTransport(CHANNEL), SocketCANTransport(CHANNEL)
+    try:
+        tx.open()
+        rx.open()
+    except (OSError, AttributeError) as e:
+        tx.close()
+        rx.close()
+        pytest.skip("%s is not available: %s" % (CHANNEL, e))
+    yield tx, rx
+    tx.close()
+    rx.close()
+
+
+def test_round_trip(bus):
+    tx, rx = bus
+    can_ids = [0x001, 0x7FF, 0x1ABCDE]  # the last one needs the extended frame format 最后一个需要扩展帧
+    data = np.arange(24, dtype=np.uint8).reshape(3, 8)
+    tx.send_frames(can_ids, data)
+    frames = rx.recv_frames(3, 1.0)
+    assert [CANID for CANID, _, _, _ in frames] == can_ids
+    assert [CMD for _, CMD, _, _ in frames] == [0x11] * 3
+    assert [bytes(d) for _, _, d, _ in frames] == [row.tobytes() for row in data]
+
+
+def test_expected_count_wait(bus):
+    tx, rx = bus
+    start = monotonic()
+    assert rx.recv_frames(1, 0.05) == []
+    assert monotonic() - start >= 0.045
+
+    def late():
+        sleep(0.02)
+        tx.send_frames([0x11], [[1] * 8])
+        sleep(0.02)
+        tx.send_frames([0x12], [[2] * 8])
+
+    sender = threading.Thread(target=late)
+    sender.start()
+    frames = rx.recv_frames(2, 1.0)
+    sender.join()
+    assert [CANID for CANID, _, _, _ in frames] == [0x11, 0x12]
+
+
+def test_kernel_timestamps(bus):
+    tx, rx = bus
+    sent = time.time()
+    tx.send_frames([0x11, 0x12], np.zeros((2, 8), np.uint8))
+    sleep(0.05)
+    read = time.time()
+    frames = rx.recv_frames()
+    stamps = [t for _, _, _, t in frames]
+    assert len(stamps) == 2
+    # SO_TIMESTAMPNS gives the arrival time, not the time of the read 内核时间戳是到达时间 不是读取时间
+    assert all(sent - 0.01 <= t <= read - 0.03 for t in stamps)
+    assert stamps[0] <= stamps[1]
@@ -0,0 +1,90 @@
+import os
+import sys
+import termios
+import threading
+from time import monotonic, sleep
+
+import pytest
+
+from DM_Transport import TermiosSerial
+
+pytestmark = pytest.mark.skipif(not hasattr(os, "openpty"), reason="needs a pseudo terminal 需要伪终端")
+
+
+@pytest.fixture
+def pty():
+    # the test writes to the master side, TermiosSerial opens the slave by its path 测试写主设备 TermiosSerial按路径打开从设备
+    master, slave = os.openpty()
+    port = TermiosSerial(os.ttyname(slave), bufsize=16)
+    port.open()
+    os.close(slave)
+    yield master, port
+    port.close()
+    os.close(master)
+
+
+def read_master(master, n, timeout=1.0):
+    data = b""
+    deadline = monotonic() + timeout
+    while len(data) < n and monotonic() < deadline:
+        data += os.read(master, n - len(data))
+    return data
+
+
+def test_raw_mode(pty):
+    master, port = pty
+    iflag, oflag, cflag, lflag, _, _, cc = termios.tcgetattr(port.fd)
+    assert not lflag & (termios.ICANON | termios.ECHO | termios.ISIG | termios.IEXTEN)
+    assert not iflag & (termios.ICRNL | termios.IXON | termios.ISTRIP)
+    assert not oflag & termios.OPOST
+    assert cflag & termios.CSIZE == termios.CS8
+    assert cc[termios.VMIN] == 0 and cc[termios.VTIME] == 0
+    # every byte passes unchanged in both directions, no CR/LF mapping, echo or signals 双向所有字节原样通过
+    data = bytes(range(256))
+    os.write(master, data[:128])
+    os.write(master, data[128:])
+    assert port.wait_bytes(256, monotonic() + 1.0)
+    assert port.read_all() == data
+    port.write(b"\r\n\x03\x11\x13")
+    assert read_master(master, 5) == b"\r\n\x03\x11\x13"
+
+
+def test_wait_bytes_deadline(pty):
+    master, port = pty
+    start = monotonic()
+    assert not port.wait_bytes(1, start + 0.05)
+    assert 0.045 <= monotonic() - start < 0.5
+    assert not port.wait_bytes(1, start)  # deadline already passed 截止时间已过
+
+    writer = threading.Timer(0.02, os.write, (master, b"\xAA" * 16))
+    writer.start()
+    start = monotonic()
+    assert port.wait_bytes(16, start + 1.0)
+    assert monotonic() - start < 0.5  # returns when the bytes arrive, not at the deadline 数据到达就返回
+    writer.join()
+
+
+def test_partial_reads_fill_the_buffer(pty):
+    master, port = pty
+    buf = port.buf
+    os.write(master, b"\x01" * 10)
+    assert not port.wait_bytes(16, monotonic() + 0.05)
+    assert port.fill == 10 and port.in_waiting == 10
+    os.write(master, b"\x02" * 6)
+    assert port.wait_bytes(16, monotonic() + 1.0)
+    assert port.buf is buf and port.fill == 16
+    assert port.read_all() == b"\x01" * 10 + b"\x02" * 6
+    assert port.fill == 0
+    # more than the initial 16 bytes grows the buffer 超过初始大小时扩大缓冲区
+    os.write(master, bytes(range(40)))
+    assert port.wait_bytes(40, monotonic() + 1.0)
+    assert port.read_all() == bytes(range(40))
+    assert len(port.buf) >= 40
+
+
+@pytest.mark.skipif(not sys.platform.startswith("linux"), reason="ASYNC_LOW_LATENCY is Linux only 仅Linux")
+def test_low_latency_fails_gracefully(pty):
+    # a pty has no serial_struct, TIOCGSERIAL fails and open() still succeeds 伪终端不支持TIOCGSERIAL open()仍然成功
+    master, port = pty
+    assert port.is_open
+    assert port._TermiosSerial__set_low_latency() is False
@@ -34,6 +34,7 @@
 
 #include "bsp_fdcan.h"
 #include "dm_motor_ctrl.h"
+#include "dm_gateway.h"
 #include <stdio.h>  
 #include <string.h>
 
@@ -154,7 +155,11 @@ void StartDefaultTask(void *argument)
 
     bsp_can_init();
     
-    
+#if DM_GATEWAY_MODE
+	// UART gateway: the host configures and drives the motors, the board only forwards
+	dm_gateway_init();
+	HAL_TIM_Base_Start_IT(&htim3);
+#else
     
     dm_motor_init();
 	motor[Motor1].ctrl.mode 	= spd_mode;
@@ -172,6 +177,7 @@ void StartDefaultTask(void *argument)
 	dm_motor_enable(&hfdcan1, &motor[Motor1]);
 	HAL_Delay(1000);
 	HAL_TIM_Base_Start_IT(&htim3);
+#endif
     
   /* Infinite loop */
   for(;;)
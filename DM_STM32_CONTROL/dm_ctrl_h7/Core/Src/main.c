@@ -46,6 +46,7 @@
 /* USER CODE BEGIN PM */
 #include "bsp_fdcan.h"
 #include "dm_motor_ctrl.h"
+#include "dm_gateway.h"
 #include <stdio.h>  
 #include <string.h> 
 volatile float g_target_motor_speed;
@@ -222,6 +223,9 @@ void HAL_TIM_PeriodElapsedCallback(TIM_HandleTypeDef *htim)
   }
   /* USER CODE BEGIN Callback 1 */
   if (htim->Instance == TIM3) {
+#if DM_GATEWAY_MODE
+		dm_gateway_tick();
+#else
 		
 		read_all_motor_data(&motor[Motor1]);
 		
@@ -233,6 +237,7 @@ void HAL_TIM_PeriodElapsedCallback(TIM_HandleTypeDef *htim)
         motor[Motor1].ctrl.vel_set = g_target_motor_speed;
 
         dm_motor_ctrl_send(&hfdcan1, &motor[Motor1]);
+#endif
   }
   /* USER CODE END Callback 1 */
 }
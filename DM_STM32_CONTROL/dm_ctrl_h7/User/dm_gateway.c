@@ -0,0 +1,401 @@
+#include "dm_gateway.h"
+#include "dm_motor_ctrl.h"
+#include "bsp_fdcan.h"
+#include "usart.h"
+#include "string.h"
+
+/* DMA1不能访问DTCM 串口DMA缓冲区放到AXI SRAM(STM32H723XG_FLASH.ld和MDK-ARM/CtrBoard.sct中的.dma_buffer段) */
+#if defined(__CC_ARM)
+#define GW_DMA_BUFFER __attribute__((section(".dma_buffer"), zero_init, aligned(32)))
+#else
+#define GW_DMA_BUFFER __attribute__((section(".dma_buffer"), aligned(32)))
+#endif
+
+gw_slot_t gw_slot[GW_SLOT_NUM];
+gw_stat_t gw_stat;
+
+static uint8_t gw_uart_dma[GW_UART_DMA_SIZE] GW_DMA_BUFFER;
+static uint8_t gw_state_buf[GW_STATE_SIZE(GW_MAX_STATE)] GW_DMA_BUFFER;
+static uint16_t gw_uart_tail;
+
+static uint8_t gw_host_buf[GW_HOST_SIZE(GW_MAX_FRAMES)];
+static uint16_t gw_host_fill;
+static uint16_t gw_host_len;
+
+static gw_frame_t gw_oneshot[GW_ONESHOT_NUM];
+static uint8_t gw_oneshot_num;
+
+/* FDCAN1接收中断和TIM3中断优先级相同 不会互相打断 所以队列不需要关中断 */
+static gw_frame_t gw_rx_fifo[GW_RX_FIFO_NUM];
+static uint8_t gw_rx_seq[GW_RX_FIFO_NUM];		// 收到该帧时总线上的主机帧序号
+static uint16_t gw_rx_head;
+static uint16_t gw_rx_tail;
+static uint8_t gw_bus_seq;						// 最近一次转发的主机帧序号
+
+static uint8_t gw_div;
+
+/**
+************************************************************************
+* @brief:      	gw_crc16: CRC16-CCITT
+* @param:      	buf: 数据
+* @param:      	len: 数据长度
+* @retval:     	CRC 初值0xFFFF 多项式0x1021
+* @details:    	主机帧和状态帧的校验
+************************************************************************
+**/
+uint16_t gw_crc16(const uint8_t *buf, uint16_t len)
+{
+	uint16_t crc = 0xFFFF;
+	uint8_t i;
+
+	while (len--)
+	{
+		crc ^= (uint16_t)(*buf++) << 8;
+		for (i = 0; i < 8; i++)
+			crc = (crc & 0x8000) ? (uint16_t)((crc << 1) ^ 0x1021) : (uint16_t)(crc << 1);
+	}
+	return crc;
+}
+
+static void gw_uart_start(void)
+{
+	gw_uart_tail = 0;
+	gw_host_fill = 0;
+	HAL_UART_Receive_DMA(&huart1, gw_uart_dma, GW_UART_DMA_SIZE);
+	// 循环接收 每个周期查询DMA写到的位置 不需要半满/满中断
+	__HAL_DMA_DISABLE_IT(huart1.hdmarx, DMA_IT_HT | DMA_IT_TC);
+}
+
+/**
+************************************************************************
+* @brief:      	dm_gateway_init: 网关初始化
+* @param:      	void
+* @retval:     	void
+* @details:    	清空电机表和槽位，开始串口DMA接收；之后由TIM3中断调用dm_gateway_tick
+************************************************************************
+**/
+void dm_gateway_init(void)
+{
+	memset(motor, 0, sizeof(motor));
+	memset(gw_slot, 0, sizeof(gw_slot));
+	memset(&gw_stat, 0, sizeof(gw_stat));
+	gw_oneshot_num = 0;
+	gw_rx_head = gw_rx_tail = 0;
+	gw_bus_seq = 0;
+	gw_div = 0;
+	gw_uart_start();
+}
+
+static uint8_t gw_is_command(const uint8_t *data)
+{
+	uint8_t i;
+
+	for (i = 0; i < 7; i++)
+		if (data[i] != 0xFF)
+			return 0;
+	return 1;
+}
+
+/**
+************************************************************************
+* @brief:      	gw_find_slot: 查找电机的槽位
+* @param:      	slave: 电机ID
+* @param:      	create: 没有时分配一个空槽位
+* @retval:     	槽位序号 没有时返回-1
+* @details:    	槽位i对应motor[i]，motor[i].id为0表示空闲
+************************************************************************
+**/
+static int8_t gw_find_slot(uint8_t slave, uint8_t create)
+{
+	int8_t i, empty = -1;
+
+	for (i = 0; i < GW_SLOT_NUM; i++)
+	{
+		if (motor[i].id == slave)
+			return i;
+		if (empty < 0 && motor[i].id == 0)
+			empty = i;
+	}
+	if (create && empty >= 0)
+		motor[empty].id = slave;
+	return create ? empty : -1;
+}
+
+static void gw_release_all(void)
+{
+	uint8_t i;
+
+	for (i = 0; i < GW_SLOT_NUM; i++)
+		gw_slot[i].active = 0;
+}
+
+static void gw_oneshot_push(uint16_t id, const uint8_t *data)
+{
+	if (gw_oneshot_num >= GW_ONESHOT_NUM)
+	{
+		gw_stat.tx_full++;
+		gw_stat.flags |= GW_FLAG_TX_FULL;
+		return;
+	}
+	gw_oneshot[gw_oneshot_num].id = id;
+	memcpy(gw_oneshot[gw_oneshot_num].data, data, 8);
+	gw_oneshot_num++;
+}
+
+/**
+************************************************************************
+* @brief:      	gw_host_frame: 处理主机帧中的一个CAN帧
+* @param:      	id: CAN ID
+* @param:      	data: 8字节数据
+* @retval:     	void
+* @details:    	控制帧保存到该电机的槽位并每个周期重发；命令帧和参数帧只发送一次，
+*               命令帧同时释放该电机的槽位，失能后不会再收到旧的控制帧
+************************************************************************
+**/
+static void gw_host_frame(uint16_t id, const uint8_t *data)
+{
+	uint8_t slave = id & 0xFF;
+	int8_t slot;
+
+	if (id < 0x400 && slave != 0 && !gw_is_command(data))
+	{
+		slot = gw_find_slot(slave, 1);
+		if (slot >= 0)
+		{
+			gw_slot[slot].frame.id = id;
+			memcpy(gw_slot[slot].frame.data, data, 8);
+			gw_slot[slot].active = 1;
+			motor[slot].ctrl.mode = (id >> 8) + mit_mode;
+			return;
+		}
+	}
+	else if (id < 0x400 && slave != 0)
+	{
+		slot = gw_find_slot(slave, 0);
+		if (slot >= 0)
+			gw_slot[slot].active = 0;
+	}
+	gw_oneshot_push(id, data);
+}
+
+static void gw_host_apply(void)
+{
+	const uint8_t *p = &gw_host_buf[GW_HEAD_SIZE];
+	uint8_t i;
+
+	gw_stat.seq = gw_host_buf[3];
+	gw_stat.host_age = 0;
+	gw_stat.host_frames++;
+	switch (gw_host_buf[2])
+	{
+		case GW_TYPE_FRAMES:
+			for (i = 0; i < gw_host_buf[4]; i++, p += GW_ENTRY_SIZE)
+				gw_host_frame(p[0] | (p[1] << 8), p + 2);
+			break;
+		case GW_TYPE_RELEASE:
+			gw_release_all();
+			gw_oneshot_num = 0;
+			break;
+	}
+}
+
+static void gw_bad_frame(void)
+{
+	gw_stat.bad_frames++;
+	gw_stat.flags |= GW_FLAG_BAD_FRAME;
+	gw_host_fill = 0;
+}
+
+/**
+************************************************************************
+* @brief:      	gw_parse_byte: 主机帧解析状态机
+* @param:      	b: 收到的字节
+* @retval:     	void
+* @details:    	先找帧头0xA5 0x5A，收齐帧头后按count得到帧长，收齐后校验CRC
+************************************************************************
+**/
+static void gw_parse_byte(uint8_t b)
+{
+	uint16_t crc;
+
+	if (gw_host_fill == 0 && b != GW_MAGIC0)
+		return;
+	if (gw_host_fill == 1 && b != GW_MAGIC1)
+	{
+		gw_host_fill = (b == GW_MAGIC0) ? 1 : 0;
+		return;
+	}
+	gw_host_buf[gw_host_fill++] = b;
+	if (gw_host_fill == GW_HEAD_SIZE)
+	{
+		if (gw_host_buf[4] > GW_MAX_FRAMES)
+		{
+			gw_bad_frame();
+			return;
+		}
+		gw_host_len = GW_HOST_SIZE(gw_host_buf[4]);
+	}
+	if (gw_host_fill > GW_HEAD_SIZE && gw_host_fill == gw_host_len)
+	{
+		crc = gw_host_buf[gw_host_len - 2] | (gw_host_buf[gw_host_len - 1] << 8);
+		if (crc != gw_crc16(&gw_host_buf[2], gw_host_len - 4))
+		{
+			gw_bad_frame();
+			return;
+		}
+		gw_host_apply();
+		gw_host_fill = 0;
+	}
+}
+
+static void gw_uart_poll(void)
+{
+	uint16_t head;
+
+	if (huart1.RxState == HAL_UART_STATE_READY)
+	{
+		// 接收被串口错误(例如溢出)中止 重新开始
+		gw_uart_start();
+		return;
+	}
+	head = GW_UART_DMA_SIZE - __HAL_DMA_GET_COUNTER(huart1.hdmarx);
+	if (head >= GW_UART_DMA_SIZE)
+		head = 0;
+	while (gw_uart_tail != head)
+	{
+		gw_parse_byte(gw_uart_dma[gw_uart_tail]);
+		if (++gw_uart_tail == GW_UART_DMA_SIZE)
+			gw_uart_tail = 0;
+	}
+}
+
+/**
+************************************************************************
+* @brief:      	dm_gateway_can_rx: 保存收到的CAN帧
+* @param:      	rec_id: CAN ID
+* @param:      	data: 8字节数据
+* @retval:     	void
+* @details:    	在fdcan1_rx_callback中调用，下一帧状态帧上传；同时记下当时总线上的主机帧序号
+************************************************************************
+**/
+void dm_gateway_can_rx(uint16_t rec_id, uint8_t *data)
+{
+	gw_frame_t *f;
+
+	if ((uint16_t)(gw_rx_head - gw_rx_tail) >= GW_RX_FIFO_NUM)
+	{
+		gw_stat.rx_dropped++;
+		gw_stat.flags |= GW_FLAG_OVERFLOW;
+		return;
+	}
+	f = &gw_rx_fifo[gw_rx_head & (GW_RX_FIFO_NUM - 1)];
+	f->id = rec_id;
+	memcpy(f->data, data, 8);
+	gw_rx_seq[gw_rx_head & (GW_RX_FIFO_NUM - 1)] = gw_bus_seq;
+	gw_rx_head++;
+}
+
+/**
+************************************************************************
+* @brief:      	gw_send_state: 发送状态帧
+* @param:      	void
+* @retval:     	void
+* @details:    	上一帧还在发送时跳过，收到的CAN帧留到下一帧；每帧最多GW_MAX_STATE个CAN帧，
+*               并且只包含在同一个主机帧转发期间收到的CAN帧，seq为该主机帧的序号，
+*               主机据此判断回复是在命令发出之前还是之后收到的
+************************************************************************
+**/
+static void gw_send_state(void)
+{
+	uint16_t avail = gw_rx_head - gw_rx_tail;
+	uint16_t n, i, len, crc;
+	uint8_t seq = gw_bus_seq;
+	uint8_t *p;
+
+	if (huart1.gState != HAL_UART_STATE_READY)
+		return;
+	if (avail > GW_MAX_STATE)
+		avail = GW_MAX_STATE;
+	if (avail)
+		seq = gw_rx_seq[gw_rx_tail & (GW_RX_FIFO_NUM - 1)];
+	for (n = 0; n < avail && gw_rx_seq[(gw_rx_tail + n) & (GW_RX_FIFO_NUM - 1)] == seq; n++)
+		;
+	gw_state_buf[0] = GW_MAGIC0;
+	gw_state_buf[1] = GW_MAGIC1;
+	gw_state_buf[2] = GW_TYPE_STATE;
+	gw_state_buf[3] = seq;
+	gw_state_buf[4] = n;
+	gw_state_buf[5] = gw_stat.flags;
+	gw_state_buf[6] = gw_stat.tick;
+	gw_state_buf[7] = gw_stat.tick >> 8;
+	gw_state_buf[8] = gw_stat.tick >> 16;
+	gw_state_buf[9] = gw_stat.tick >> 24;
+	p = &gw_state_buf[GW_HEAD_SIZE + 4];
+	for (i = 0; i < n; i++, p += GW_ENTRY_SIZE)
+	{
+		gw_frame_t *f = &gw_rx_fifo[(gw_rx_tail + i) & (GW_RX_FIFO_NUM - 1)];
+		p[0] = f->id;
+		p[1] = f->id >> 8;
+		memcpy(p + 2, f->data, 8);
+	}
+	gw_rx_tail += n;
+	len = GW_STATE_SIZE(n);
+	crc = gw_crc16(&gw_state_buf[2], len - 4);
+	gw_state_buf[len - 2] = crc;
+	gw_state_buf[len - 1] = crc >> 8;
+	gw_stat.flags = 0;
+	HAL_UART_Transmit_DMA(&huart1, gw_state_buf, len);
+}
+
+static void gw_can_send(gw_frame_t *f)
+{
+	if (fdcanx_send_data(&hfdcan1, f->id, f->data, 8))
+	{
+		gw_stat.tx_full++;
+		gw_stat.flags |= GW_FLAG_TX_FULL;
+	}
+}
+
+/**
+************************************************************************
+* @brief:      	dm_gateway_tick: 网关周期
+* @param:      	void
+* @retval:     	void
+* @details:    	在TIM3中断中调用，每GW_TICK_DIV次执行一次:
+*               解析主机帧 -> 检查主机超时 -> 上传上个周期收到的CAN帧 -> 发送只发一次的帧和所有槽位的控制帧
+*               转发之前先取出FDCAN接收FIFO中已有的帧，它们记为上一个主机帧的回复
+************************************************************************
+**/
+void dm_gateway_tick(void)
+{
+	uint8_t i;
+
+	if (++gw_div < GW_TICK_DIV)
+		return;
+	gw_div = 0;
+	gw_stat.tick++;
+	gw_uart_poll();
+	if (gw_stat.host_age < 0xFFFF)
+		gw_stat.host_age++;
+	if (gw_stat.host_age > GW_HOST_TIMEOUT)
+	{
+		for (i = 0; i < GW_SLOT_NUM; i++)
+		{
+			if (gw_slot[i].active)
+			{
+				gw_release_all();
+				gw_stat.flags |= GW_FLAG_TIMEOUT;
+				break;
+			}
+		}
+	}
+	fdcan1_rx_callback();
+	gw_send_state();
+	gw_bus_seq = gw_stat.seq;
+	for (i = 0; i < gw_oneshot_num; i++)
+		gw_can_send(&gw_oneshot[i]);
+	gw_oneshot_num = 0;
+	for (i = 0; i < GW_SLOT_NUM; i++)
+		if (gw_slot[i].active)
+			gw_can_send(&gw_slot[i].frame);
+}
@@ -0,0 +1,82 @@
+#ifndef __DM_GATEWAY_H__
+#define __DM_GATEWAY_H__
+#include "main.h"
+#include "dm_motor_drv.h"
+
+/*
+ * 串口网关模式 USART1 <-> FDCAN1
+ * 主机每个周期发送一帧，里面打包了所有电机的CAN帧；板子按固定频率把控制帧转发到FDCAN，
+ * 并把一个周期内收到的所有CAN帧打包成一帧状态帧发回主机。
+ *
+ * 帧格式(小端)，两个方向相同:
+ *   [0] 0xA5  [1] 0x5A  [2] type  [3] seq  [4] count  [5] flags
+ *   主机帧: [6 ...]  count个条目，每个10字节: CAN ID(u16) + data[8]
+ *   状态帧: [6..9] 板子的周期计数(u32)，[10 ...] count个条目
+ *           状态帧的seq是收到这些CAN帧时正在转发的主机帧的序号，一帧状态帧中的CAN帧都属于同一个主机帧
+ *   最后两个字节: CRC16-CCITT(初值0xFFFF)，从type开始到条目结束
+ *
+ * 主机帧中的控制帧(MIT/POS/SPD/PSI)按电机ID保存到槽位，每个周期重发一次，直到被新的控制帧替换；
+ * 命令帧(使能/失能/清除错误/保存零点，前7字节为0xFF)和参数帧(0x7FF)只发送一次，并释放该电机的槽位。
+ * GW_HOST_TIMEOUT个周期没有收到主机帧时释放所有槽位，电机自己的CAN超时随后生效。
+ */
+
+#define DM_GATEWAY_MODE		1			// 1: 串口网关模式 0: Motor1速度示例
+
+#define GW_TICK_DIV			2			// TIM3(1kHz)每多少次中断转发一次 1Mbps时6个电机需要2ms
+#define GW_HOST_TIMEOUT		50			// 多少个网关周期没有主机帧后释放所有槽位
+#define GW_SLOT_NUM			num			// 槽位数 与motor[num]一一对应
+#define GW_MAX_FRAMES		32			// 主机帧最多的CAN帧数
+#define GW_MAX_STATE		32			// 状态帧最多的CAN帧数
+#define GW_ONESHOT_NUM		16			// 只发送一次的帧的队列长度
+#define GW_RX_FIFO_NUM		64			// 等待上传的CAN帧队列长度 必须是2的幂
+#define GW_UART_DMA_SIZE	1024		// 串口DMA循环接收缓冲区
+
+#define GW_MAGIC0			0xA5
+#define GW_MAGIC1			0x5A
+#define GW_TYPE_FRAMES		0x01		// 主机: 一批CAN帧
+#define GW_TYPE_RELEASE		0x02		// 主机: 释放所有槽位 停止转发
+#define GW_TYPE_STATE		0x81		// 板子: 收到的CAN帧
+
+#define GW_FLAG_OVERFLOW	0x01		// 上次状态帧之后有CAN帧被丢弃
+#define GW_FLAG_TIMEOUT		0x02		// 主机超时 槽位已释放
+#define GW_FLAG_BAD_FRAME	0x04		// 上次状态帧之后收到CRC错误的主机帧
+#define GW_FLAG_TX_FULL		0x08		// 上次状态帧之后FDCAN发送队列满
+
+#define GW_HEAD_SIZE		6
+#define GW_ENTRY_SIZE		10
+#define GW_HOST_SIZE(n)		(GW_HEAD_SIZE + GW_ENTRY_SIZE * (n) + 2)
+#define GW_STATE_SIZE(n)	(GW_HEAD_SIZE + 4 + GW_ENTRY_SIZE * (n) + 2)
+
+typedef struct
+{
+	uint16_t id;
+	uint8_t data[8];
+} gw_frame_t;
+
+typedef struct
+{
+	uint8_t active;						// 正在转发
+	gw_frame_t frame;					// 最近的控制帧
+} gw_slot_t;
+
+typedef struct
+{
+	uint32_t tick;						// 网关周期计数
+	uint8_t seq;						// 最近一个有效主机帧的序号
+	uint8_t flags;						// GW_FLAG_* 下一帧状态帧上报后清零
+	uint16_t host_age;					// 多少个周期没有收到主机帧
+	uint32_t host_frames;				// 统计
+	uint32_t bad_frames;
+	uint32_t rx_dropped;
+	uint32_t tx_full;
+} gw_stat_t;
+
+extern gw_slot_t gw_slot[GW_SLOT_NUM];
+extern gw_stat_t gw_stat;
+
+void dm_gateway_init(void);
+void dm_gateway_tick(void);
+void dm_gateway_can_rx(uint16_t rec_id, uint8_t *data);
+uint16_t gw_crc16(const uint8_t *buf, uint16_t len);
+
+#endif /* __DM_GATEWAY_H__ */
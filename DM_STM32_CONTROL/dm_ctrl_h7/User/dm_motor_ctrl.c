@@ -1,5 +1,6 @@
 #include "dm_motor_drv.h"
 #include "dm_motor_ctrl.h"
+#include "dm_gateway.h"
 #include "string.h"
 #include "stdbool.h"
 
@@ -188,11 +189,17 @@ void fdcan1_rx_callback(void)
 {
 	uint16_t rec_id;
 	uint8_t rx_data[8] = {0};
+#if DM_GATEWAY_MODE
+	// gateway: drain the whole FIFO, every frame goes to the host
+	while (fdcanx_receive(&hfdcan1, &rec_id, rx_data))
+		dm_gateway_can_rx(rec_id, rx_data);
+#else
 	fdcanx_receive(&hfdcan1, &rec_id, rx_data);
 	switch (rec_id)
 	{
  		case 0x00: dm_motor_fbdata(&motor[Motor1], rx_data); receive_motor_data(&motor[Motor1], rx_data); break;
 	}
+#endif
 }
 
 